@@ -1,36 +1,166 @@
 # Fedora-AutoEnv-Setup/install.py
 
+import argparse
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # Ensure the script's directory is in the Python path
 sys.path.insert(0, str(Path(__file__).parent))
 
 from scripts import console_output as con
-from scripts.config import app_logger, CONFIG_FILE_NAME
+from scripts.config import app_logger, CONFIG_FILE_NAME, TRACE_FILE_PATH
 from scripts.phase_manager import load_phase_status
 from scripts.main_menu import main_menu_handler
 from scripts.config_loader import load_configuration
+from scripts import system_utils as util
+from scripts import exec_trace
+from scripts import local_rpm_repo
+from scripts import headless
+from scripts import install_root
+from scripts import run_planner
+from scripts.config import PHASES
 
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Fedora AutoEnv Setup. Without --phases/--all it shows the interactive menu.",
+        epilog="Exit codes in headless mode: 0 success, 1 a phase failed, 2 invalid arguments or configuration, 3 a phase was skipped."
+    )
+    selection = parser.add_mutually_exclusive_group()
+    selection.add_argument("--phases", nargs="+", metavar="PHASE",
+                           help=f"Run these phases without prompts (ids or menu numbers, space or comma separated): {', '.join(PHASES)}. "
+                                "Pending dependencies are added automatically.")
+    selection.add_argument("--all", action="store_true", help="Run every phase without prompts.")
+    parser.add_argument("--yes", "-y", action="store_true",
+                        help="Rerun selected phases that are already complete even if they are up to date.")
+    parser.add_argument("--config", default=CONFIG_FILE_NAME, metavar="PATH", help=f"Configuration file (default: {CONFIG_FILE_NAME}).")
+    parser.add_argument("--json", action="store_true",
+                        help="Print the results (or the --plan) as JSON on stdout; console output goes to stderr.")
+    parser.add_argument("--plan", action="store_true",
+                        help="Show what the selected (default: pending) phases would install, the download size and an ETA, then exit without changing anything.")
+    parser.add_argument("--installroot", action="append", metavar="PATH",
+                        help="Provision the system tree at PATH instead of the live system (dnf --installroot, Flatpak and user homes under PATH). "
+                             "Repeat for several roots; they are provisioned concurrently and share one package download cache.")
+    args = parser.parse_args(argv)
+    if args.phases:
+        args.phases = [item.strip() for value in args.phases for item in value.split(",") if item.strip()]
+    if (args.json or args.yes) and not (args.phases or args.all or args.plan):
+        parser.error("--json and --yes need --phases, --all or --plan (the interactive menu has its own prompts).")
+    if args.installroot:
+        if not (args.phases or args.all or args.plan):
+            parser.error("--installroot needs --phases, --all or --plan.")
+        args.installroot = list(dict.fromkeys(Path(root).resolve() for root in args.installroot))
+        if Path("/") in args.installroot:
+            parser.error("--installroot / is the live system; omit --installroot to provision it.")
+    return args
+
+def selected_phases(args, phase_status):
+    """Phase ids selected by --phases/--all, or None for the interactive menu. Raises ValueError for unknown phases."""
+    if args.all:
+        return list(PHASES)
+    if args.phases:
+        phase_ids, added = headless.resolve_phase_selection(args.phases, phase_status)
+        if added:
+            con.print_info(f"Adding pending dependencies: {', '.join(added)}")
+        return phase_ids
+    return None
+
+def show_plan(app_config, phase_ids):
+    """--plan: prints the dry-run plan of phase_ids. Returns (exit code, plan as a dict); the code is 1 if the disk space is insufficient."""
+    plan = run_planner.build_run_plan(app_config, phase_ids, logger=app_logger)
+    run_planner.print_run_plan(plan, logger=app_logger)
+    return (0 if plan.disk_space_ok else 1), run_planner.plan_to_dict(plan, logger=app_logger)
+
+def run_selection(args, app_config, phase_status, phase_ids):
+    """--plan, or the headless run of phase_ids. Returns (exit code, JSON-serializable report)."""
+    if args.plan:
+        pending = [phase_id for phase_id in PHASES if not phase_status.get(phase_id, False)]
+        return show_plan(app_config, phase_ids if phase_ids is not None else pending)
+    return headless.run_headless(app_config, phase_status, phase_ids, assume_yes=args.yes, logger=app_logger)
+
+def provision_root(root, args, app_config):
+    """run_selection against one install root, with that root's own phase status."""
+    with install_root.targeting(root):
+        con.print_step(f"Install root {root}")
+        phase_status = load_phase_status()
+        exit_code, report = run_selection(args, app_config, phase_status, selected_phases(args, phase_status))
+        app_logger.info(f"Install root '{root}' finished with exit code {exit_code}.")
+        return exit_code, report
+
+def provision_roots(args, app_config):
+    """
+    Runs provision_root for every --installroot, one thread per root (--plan goes one root at a
+    time so the plans print in order). Returns the most severe exit code and the reports by root.
+    """
+    workers = 1 if args.plan else len(args.installroot)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="installroot") as pool:
+        futures = {root: pool.submit(provision_root, root, args, app_config) for root in args.installroot}
+    results = {}
+    for root, future in futures.items():
+        try:
+            results[str(root)] = future.result()
+        except Exception as e:
+            app_logger.error(f"Provisioning install root '{root}' failed: {e}", exc_info=True)
+            con.print_error(f"Provisioning install root '{root}' failed: {e}")
+            results[str(root)] = (headless.EXIT_PHASE_FAILED, {"error": str(e)})
+    exit_code = headless.combine_exit_codes(code for code, _ in results.values())
+    return exit_code, {"roots": {root: report for root, (_, report) in results.items()}, "exit_code": exit_code}
+
 def main():
     """Main function to run the Fedora AutoEnv Setup utility."""
+    args = parse_args()
     app_logger.info("Fedora AutoEnv Setup script started.")
+    exit_code = 0
+
+    # In --json mode stdout carries only the JSON document; everything printed or run goes to stderr
+    json_stream = headless.reserve_stdout_for_json() if args.json else None
+    if args.phases or args.all or args.plan:
+        con.set_non_interactive(True)
 
     try:
         # Load application-wide configuration from packages
-        app_config = load_configuration(CONFIG_FILE_NAME) # Explicitly pass filename
+        config_file = args.config
+        app_config = load_configuration(config_file)
         if not app_config: # load_configuration returns {} on error or empty file
             # Check if the file itself is missing, as load_configuration prints detailed errors
-            if not Path(CONFIG_FILE_NAME).is_file():
-                con.print_error(f"Critical: Configuration file '{CONFIG_FILE_NAME}' not found in project root or current directory.", exit_after=True)
+            if not Path(config_file).is_file():
+                con.print_error(f"Critical: Configuration file '{config_file}' not found in project root or current directory.")
             else:
                 # File exists but is empty, or parsing failed (error already printed by loader)
-                con.print_error(f"Critical: Failed to load or parse '{CONFIG_FILE_NAME}'. Please ensure it exists and is valid. Check messages above.", exit_after=True)
-            sys.exit(1) # exit_after=True should handle this, but being explicit.
+                con.print_error(f"Critical: Failed to load or parse '{config_file}'. Please ensure it exists and is valid. Check messages above.")
+            return headless.EXIT_USAGE
 
         phase_status = load_phase_status()
-        main_menu_handler(app_config, phase_status)
+        try:
+            # With install roots this only validates the selection; each root adds its own pending dependencies
+            phase_ids = selected_phases(args, phase_status) if not args.installroot else headless.resolve_phase_selection(args.phases or [], {})
+        except ValueError as e:
+            con.print_error(str(e))
+            return headless.EXIT_USAGE
+
+        # One sudo handshake per run: privileged and per-user commands go through long-lived workers,
+        # started on first use so the menu does not ask for a password before anything runs
+        util.enable_privileged_workers(target_user=util.get_target_user(logger=app_logger), logger=app_logger)
+
+        # Repository metadata is refreshed once per run and reused until it is this old (or a repo is added)
+        util.set_dnf_metadata_max_age(60 * app_config.get("dnf_metadata_max_age_minutes", 60))
+
+        pip_settings = app_config.get("pip", {})
+        util.set_pip_options(pip_settings.get("wheelhouse"), pip_settings.get("constraints_file"))
+
+        if local_rpm_repo.activate_local_repo(app_config, logger=app_logger):
+            con.print_info(f"Installing from the local RPM repository at {app_config['local_rpm_repo']['path']}.")
+
+        if args.installroot or args.plan or phase_ids is not None:
+            if args.installroot:
+                exit_code, report = provision_roots(args, app_config)
+            else:
+                exit_code, report = run_selection(args, app_config, phase_status, phase_ids)
+            if json_stream is not None:
+                headless.emit_json(report, json_stream)
+        else:
+            main_menu_handler(app_config, phase_status)
 
     except ImportError as e:
         # This is a critical error, as it means the script's structure is broken.
@@ -41,16 +171,25 @@ def main():
         # con.console.print_exception(show_locals=True) # Rich traceback to console
         app_logger.critical(f"An unexpected critical error occurred in the main application: {e}", exc_info=True) # Log with traceback
         con.print_error(f"An unexpected critical error occurred: {e}. Check the log file for details.")
+        exit_code = headless.EXIT_PHASE_FAILED
 
 
     # In finally block:
     finally:
+        util.stop_privileged_workers()
+        if exec_trace.get_events():
+            if exec_trace.export_chrome_trace(TRACE_FILE_PATH):
+                app_logger.info(f"Execution trace written to {TRACE_FILE_PATH}")
+            else:
+                app_logger.warning(f"Could not write execution trace to {TRACE_FILE_PATH}")
+        app_logger.info(f"Query cache stats: {util.get_query_cache_stats()}")
         app_logger.info("Fedora AutoEnv Setup script finished.")
         con.print_info("Fedora AutoEnv Setup finished.")
+    return exit_code
 
 if __name__ == "__main__":
     try:
-        main()
+        sys.exit(main())
     except KeyboardInterrupt:
         con.print_info("\nOperation cancelled by user. Exiting.")
     except Exception as e:
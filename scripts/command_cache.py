@@ -0,0 +1,167 @@
+# Fedora-AutoEnv-Setup/scripts/command_cache.py
+
+# Memoizing cache for read-only command queries (rpm -q, flatpak remotes, flatpak --version, ...).
+# run_command(read_only=True) consults it; every other command that run_command executes is
+# classified, and mutating ones (dnf install/swap/remove, rpm --import, flatpak install,
+# remote-add, chsh, ...) invalidate the cache families they can affect.
+#
+# Keys are the command as executed (minus a leading plain "sudo") plus the run_as_user, so
+# `sudo rpm -q x` and `rpm -q x` share an entry. A family is the executable name ("rpm",
+# "flatpak", ...), looking through an `env VAR=...` prefix (install roots, see install_root), both
+# when classifying writes and when matching cached entries. Invalidation hooks let other per-run
+# caches (identity records, package indexes) be dropped by the same rules.
+
+import re
+import shlex
+import subprocess
+import threading
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
+
+CacheKey = Tuple[str, ...]
+
+# Subcommands that never change state. Anything else on these tools is treated as a write.
+_DNF_READ_ONLY = {"list", "info", "search", "repolist", "repoquery", "provides", "check-update", "makecache", "help", "--version", "history"}
+_FLATPAK_READ_ONLY = {"list", "info", "remotes", "remote-ls", "remote-info", "search", "--version", "history", "ps", "documents"}
+_RPM_WRITE_FLAGS = {"-i", "-U", "-F", "-e", "--install", "--upgrade", "--freshen", "--erase", "--import", "--reinstall", "--rebuilddb"}
+_IDENTITY_WRITERS = {"chsh", "usermod", "useradd", "userdel", "groupadd", "groupmod", "groupdel", "gpasswd"}
+
+# Families each kind of write invalidates. "dnf-repos" is not an executable: it marks a change to
+# the configured repositories, for hooks that cache repository metadata state.
+_DNF_FAMILIES = {"rpm", "dnf", "dnf5"}
+_REPO_CHANGING_DNF_SUBCOMMANDS = {"config-manager", "copr"}
+_IDENTITY_FAMILIES = {"getent", "id"}
+
+
+def _strip_sudo(argv: List[str]) -> List[str]:
+    if len(argv) > 1 and argv[0] == "sudo" and not argv[1].startswith("-"):
+        return argv[1:]
+    return argv
+
+def _strip_env(argv: List[str]) -> List[str]:
+    if argv and argv[0] == "env":
+        index = 1
+        while index < len(argv) and "=" in argv[index] and not argv[index].startswith("-"):
+            index += 1
+        return argv[index:]
+    return argv
+
+def _family_of(argv: List[str]) -> str:
+    return argv[0].rsplit("/", 1)[-1] if argv else ""
+
+def make_key(command: Union[str, List[str]], run_as_user: Optional[str] = None) -> CacheKey:
+    """Normalizes a command into a cache key."""
+    argv = [str(part) for part in command] if isinstance(command, list) else [command]
+    return (run_as_user or "",) + tuple(_strip_sudo(argv))
+
+def _split_shell_command(command: str) -> List[List[str]]:
+    """Best-effort split of a shell string into the simple commands of its pipeline/list."""
+    commands = []
+    for segment in re.split(r"\|\|?|&&|;", command):
+        try:
+            argv = shlex.split(segment)
+        except ValueError:
+            continue
+        if argv:
+            commands.append(argv)
+    return commands
+
+def invalidated_families(argv: List[str]) -> Set[str]:
+    """Returns the cache families a single (non-read-only) command may have changed."""
+    argv = _strip_env(_strip_sudo(argv))
+    family = _family_of(argv)
+    args = [arg for arg in argv[1:] if not arg.startswith("-") or arg == "--version"]
+    subcommand = args[0] if args else ""
+
+    if family in ("dnf", "dnf5", "yum"):
+        if subcommand in _DNF_READ_ONLY or "--downloadonly" in argv:
+            return set()
+        families = set(_DNF_FAMILIES) # Transactions change rpmdb
+        # config-manager/copr add repos, and so does installing a *-release package or an .rpm file/URL
+        if subcommand in _REPO_CHANGING_DNF_SUBCOMMANDS or any(arg.endswith(".rpm") or "-release" in arg for arg in args[1:]):
+            families.add("dnf-repos")
+        return families
+    if family == "rpm":
+        return {"rpm"} if any(arg in _RPM_WRITE_FLAGS for arg in argv[1:]) else set()
+    if family == "flatpak":
+        return set() if subcommand in _FLATPAK_READ_ONLY else {"flatpak"}
+    if family in _IDENTITY_WRITERS:
+        return set(_IDENTITY_FAMILIES)
+    if family == "tee" and any("/etc/yum.repos.d" in arg for arg in argv[1:]):
+        return set(_DNF_FAMILIES) | {"dnf-repos"}
+    return set()
+
+def command_families(command: Union[str, List[str]], shell: bool = False) -> Set[str]:
+    """invalidated_families for a command as given to run_command (argv list or shell string)."""
+    if isinstance(command, str) and shell:
+        return set().union(*(invalidated_families(argv) for argv in _split_shell_command(command))) if command else set()
+    if isinstance(command, list):
+        return invalidated_families([str(part) for part in command])
+    return set()
+
+
+class QueryCache:
+    """Thread-safe store of CompletedProcess results for read-only queries, with hit/miss counters."""
+
+    def __init__(self):
+        self._entries: Dict[CacheKey, subprocess.CompletedProcess] = {}
+        self._hooks: Dict[str, List[Callable[[], None]]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key: CacheKey) -> Optional[subprocess.CompletedProcess]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return entry
+
+    def put(self, key: CacheKey, process: subprocess.CompletedProcess) -> None:
+        with self._lock:
+            self._entries[key] = process
+
+    def register_invalidation_hook(self, family: str, hook: Callable[[], None]) -> None:
+        """Calls hook whenever a family is invalidated (e.g. drop a derived per-run cache)."""
+        with self._lock:
+            self._hooks.setdefault(family, []).append(hook)
+
+    def invalidate(self, families: Set[str]) -> None:
+        """Drops every entry whose executable belongs to one of families."""
+        if not families:
+            return
+        with self._lock:
+            stale = [key for key in self._entries if _family_of(_strip_env(list(key[1:]))) in families]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+            hooks = [hook for family in families for hook in self._hooks.get(family, [])]
+        for hook in hooks:
+            hook()
+
+    def note_executed(self, command: Union[str, List[str]], shell: bool = False) -> Set[str]:
+        """Classifies a command that was just run and invalidates what it may have changed."""
+        families = command_families(command, shell)
+        self.invalidate(families)
+        return families
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "invalidated_entries": self.invalidations,
+                "hit_rate_pct": round(100 * self.hits / total) if total else 0,
+            }
+
+
+# Shared per-run cache used by system_utils.run_command
+query_cache = QueryCache()
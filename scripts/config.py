@@ -5,14 +5,28 @@ import logging
 
 # --- Constants ---
 STATUS_FILE_NAME = "install_status.json"
+STEPS_FILE_NAME = "install_steps.json"
+FINGERPRINTS_FILE_NAME = "install_fingerprints.json"
 CONFIG_FILE_NAME = "packages.json"
 
 # Path to the status file (in the same directory as install.py)
 STATUS_FILE_PATH = Path(__file__).parent.parent / STATUS_FILE_NAME
 
+# Step checkpoints of phases that have not completed yet (see step_checkpoints.py)
+STEPS_FILE_PATH = Path(__file__).parent.parent / STEPS_FILE_NAME
+
+# Config and installed-state hashes of completed phases (see phase_fingerprints.py)
+FINGERPRINTS_FILE_PATH = Path(__file__).parent.parent / FINGERPRINTS_FILE_NAME
+
+# Per-user directory for the log file and run artifacts
+LOG_DIR = Path.home() / ".config" / "fedora-autoenv-setup"
+
+# Chrome trace-event timeline of the last run (open in https://ui.perfetto.dev)
+TRACE_FILE_PATH = LOG_DIR / "trace.json"
+
 def setup_logger():
     """Sets up the application logger."""
-    log_dir = Path.home() / ".config" / "fedora-autoenv-setup"
+    log_dir = LOG_DIR
     log_dir.mkdir(parents=True, exist_ok=True)
     log_file = log_dir / "fedora_autoenv_setup.log"
 
@@ -39,24 +53,34 @@ PHASES = {
         "name": "Phase 1: System Preparation ⚙️",
         "description": "Initial system checks, DNF configuration, RPM Fusion, DNS, system update, Flathub, and hostname.",
         "dependencies": [],
-        "handler": system_preparation.run
+        "handler": system_preparation.run,
+        "steps": system_preparation.STEP_NAMES,
+        "config_section": "phase1_system_preparation",
+        "dnf_work": True # Its DNF work is planned by dnf_planner (packages, groups, swaps)
     },
     "basic_installation": {
         "name": "Phase 2: Basic System Package Configuration 📦",
         "description": "Install essential CLI tools, Python, Ghostty, media codecs, etc.",
         "dependencies": ["system_preparation"],
-        "handler": basic_installation.run
+        "handler": basic_installation.run,
+        "steps": basic_installation.STEP_NAMES,
+        "config_section": "phase2_basic_configuration",
+        "dnf_work": True # Its DNF work is planned by dnf_planner (packages, groups, swaps)
     },
     "gnome_configuration": {
         "name": "Phase 3: GNOME Configuration & Extensions 🎨🖼️",
         "description": "Install GNOME Tweaks, Extension Manager, and configured extensions.",
         "dependencies": ["system_preparation", "basic_installation"],
-        "handler": gnome_configuration.run
+        "handler": gnome_configuration.run,
+        "steps": gnome_configuration.STEP_NAMES,
+        "config_section": "phase3_gnome_configuration"
     },
     "additional_packages": {
         "name": "Phase 5: Additional User Packages 🧩🌐",
         "description": "Install user-selected applications from DNF and Flatpak.",
         "dependencies": ["system_preparation", "basic_installation"],
-        "handler": additional_packages.run
+        "handler": additional_packages.run,
+        "steps": additional_packages.STEP_NAMES,
+        "config_section": "phase5_additional_packages"
     },
 }
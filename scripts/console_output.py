@@ -15,6 +15,17 @@ from rich.panel import Panel
 # We use explicit markup for styling.
 console = Console(highlight=False) 
 
+# Set by the headless CLI (install.py --phases/--all): prompts must never block an unattended run
+_non_interactive = False
+
+class PromptNotAllowedError(RuntimeError):
+    """A prompt without a default was reached while running non-interactively."""
+
+def set_non_interactive(enabled: bool = True):
+    """In non-interactive mode prompts return their default (and raise PromptNotAllowedError if there is none)."""
+    global _non_interactive
+    _non_interactive = enabled
+
 # --- Predefined Styles (can be expanded, but markup is often more flexible) ---
 # These are less used now that markup like "[bold red]...[/]" is preferred directly in messages.
 # However, they can be useful for Rich components that accept a Style object.
@@ -133,6 +144,11 @@ def ask_question(
     Returns:
         str: The user's input.
     """
+    if _non_interactive:
+        if default is None:
+            raise PromptNotAllowedError(f"Prompt '{prompt_message}' needs an answer, but the run is non-interactive.")
+        return default
+
     # Assemble a Rich Text object for the prompt for consistent styling
     # Using a leading icon for prompts
     rich_prompt = Text.assemble(
@@ -162,6 +178,9 @@ def confirm_action(prompt_message: str, default: bool = False) -> bool:
     Returns:
         bool: True if the user confirms (yes), False otherwise (no).
     """
+    if _non_interactive:
+        return default
+
     # Assemble a Rich Text object for the prompt
     # Using a leading icon for confirmations
     rich_prompt = Text.assemble(
@@ -0,0 +1,143 @@
+# Fedora-AutoEnv-Setup/scripts/dnf_config.py
+
+# The "DNF configuration" step of Phase 1: applies download tuning from
+# packages.json (phase1_system_preparation.dnf_config) to the [main] section of dnf.conf.
+# Only the managed keys are touched; comments, other keys and other sections are kept as they are.
+# The change is shown as a unified diff, the original is backed up, and nothing is written
+# when the file already matches, so the step is idempotent. All paths are relative to
+# target_root (default: the targeted install root, see install_root) so the step can run
+# against a scratch directory.
+
+import difflib
+import logging
+import re
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from scripts import exec_trace
+from scripts import install_root
+from scripts import system_utils as util
+from scripts.config import app_logger
+
+DNF_CONF_RELATIVE_PATH = Path("etc/dnf/dnf.conf")
+
+# packages.json key -> (dnf.conf option, value type)
+SUPPORTED_OPTIONS: Dict[str, Tuple[str, type]] = {
+    "max_parallel_downloads": ("max_parallel_downloads", int),
+    "fastestmirror": ("fastestmirror", bool),
+    "keepcache": ("keepcache", bool),
+    "deltarpm": ("deltarpm", bool),
+    "zchunk": ("zchunk", bool),
+    "metadata_expire": ("metadata_expire", str), # seconds, or with a unit: "6h", "2d", "-1" (never)
+}
+
+_MAX_PARALLEL_DOWNLOADS_LIMIT = 20 # dnf rejects larger values
+
+
+def normalize_settings(raw_settings: Dict, log: logging.Logger) -> Dict[str, str]:
+    """Validates the dnf_config section and returns dnf.conf option -> value text. Invalid entries are dropped."""
+    options: Dict[str, str] = {}
+    for key, value in raw_settings.items():
+        if key not in SUPPORTED_OPTIONS:
+            log.warning(f"Ignoring unsupported dnf_config key '{key}'.")
+            continue
+        option, value_type = SUPPORTED_OPTIONS[key]
+        if value_type is bool:
+            if not isinstance(value, bool):
+                log.warning(f"dnf_config '{key}' must be true or false, got {value!r}; ignoring it.")
+                continue
+            options[option] = "True" if value else "False"
+        elif value_type is int:
+            if isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= _MAX_PARALLEL_DOWNLOADS_LIMIT:
+                log.warning(f"dnf_config '{key}' must be an integer between 1 and {_MAX_PARALLEL_DOWNLOADS_LIMIT}, got {value!r}; ignoring it.")
+                continue
+            options[option] = str(value)
+        else:
+            text = str(value).strip()
+            if not re.fullmatch(r"-1|never|\d+[smhd]?", text):
+                log.warning(f"dnf_config '{key}' has an invalid value {value!r}; ignoring it.")
+                continue
+            options[option] = text
+    return options
+
+def render_dnf_conf(current_text: str, options: Dict[str, str]) -> str:
+    """Returns current_text with options set in its [main] section (which is created if missing)."""
+    lines = current_text.splitlines()
+    main_start = next((i for i, line in enumerate(lines) if line.strip().lower() == "[main]"), None)
+    if main_start is None:
+        lines = ["[main]"] + lines
+        main_start = 0
+    main_end = next((i for i in range(main_start + 1, len(lines)) if lines[i].strip().startswith("[")), len(lines))
+
+    remaining = dict(options)
+    main_body: List[str] = []
+    for line in lines[main_start + 1:main_end]:
+        match = re.match(r"\s*([A-Za-z0-9_.-]+)\s*=", line)
+        key = match.group(1).lower() if match else None
+        if key in options:
+            if key in remaining:
+                main_body.append(f"{key}={remaining.pop(key)}")
+            # A later duplicate of a managed key is dropped so the file has one authoritative value
+            continue
+        main_body.append(line)
+
+    # New keys go after the last non-blank line of [main], keeping any spacing before the next section
+    insert_at = len(main_body)
+    while insert_at > 0 and not main_body[insert_at - 1].strip():
+        insert_at -= 1
+    main_body[insert_at:insert_at] = [f"{key}={value}" for key, value in remaining.items()]
+
+    new_lines = lines[:main_start + 1] + main_body + lines[main_end:]
+    return "\n".join(new_lines) + "\n"
+
+@exec_trace.traced_helper
+def configure_dnf(
+    raw_settings: Dict,
+    target_root: Optional[Path] = None,
+    print_fn_info: Optional[Callable[[str], None]] = None,
+    print_fn_error: Optional[Callable[[str], None]] = None,
+    print_fn_sub_step: Optional[Callable[[str], None]] = None,
+    logger: Optional[logging.Logger] = None
+) -> bool:
+    """Applies the dnf_config settings to <target_root>/etc/dnf/dnf.conf. Returns True if it now matches."""
+    log = logger or app_logger
+    _p_info = print_fn_info or (lambda msg: None)
+    _p_error = print_fn_error or (lambda msg: None)
+    _p_sub = print_fn_sub_step or (lambda msg: None)
+
+    options = normalize_settings(raw_settings, log)
+    if not options:
+        log.info("No DNF configuration settings to apply.")
+        _p_info("No DNF configuration settings to apply.")
+        return True
+
+    conf_path = Path(target_root or install_root.path("/")) / DNF_CONF_RELATIVE_PATH
+    try:
+        current_text = conf_path.read_text(encoding="utf-8") if conf_path.exists() else ""
+    except OSError as e:
+        log.error(f"Cannot read {conf_path}: {e}", exc_info=True)
+        _p_error(f"Cannot read {conf_path}: {e}")
+        return False
+
+    new_text = render_dnf_conf(current_text, options)
+    if new_text == current_text:
+        log.info(f"{conf_path} already has the requested DNF settings.")
+        _p_info(f"{conf_path} already has the requested DNF settings.")
+        return True
+
+    diff = difflib.unified_diff(current_text.splitlines(), new_text.splitlines(), f"{conf_path} (current)", f"{conf_path} (new)", lineterm="")
+    _p_info(f"Changes to {conf_path}:")
+    for diff_line in diff:
+        log.info(f"dnf.conf diff: {diff_line}")
+        _p_sub(diff_line)
+
+    if not util.ensure_dir_exists(conf_path.parent, logger=log, print_fn_error=print_fn_error):
+        return False
+    if conf_path.exists() and not util.backup_system_file(conf_path, sudo_required=not util.path_writable(conf_path), backup_suffix_extra="dnfconf", logger=log, print_fn_info=print_fn_info):
+        _p_error(f"Could not back up {conf_path}; leaving it unchanged.")
+        return False
+    if not util.write_system_file(conf_path, new_text, logger=log, print_fn_error=print_fn_error):
+        return False
+
+    log.info(f"Applied DNF settings to {conf_path}: {options}")
+    return True
@@ -0,0 +1,219 @@
+# Fedora-AutoEnv-Setup/scripts/dnf_planner.py
+
+# Cross-phase DNF transaction planner. Collects the DNF work of the selected phases from
+# packages.json (packages, groups, swaps, custom-repo packages) and runs it as one transaction:
+# one metadata load, one depsolve and one parallel download batch instead of one per step.
+# The combined transaction goes through `dnf5 do` when available, otherwise a `dnf shell`
+# script. Results are attributed back to each phase from the installed-package index; if the
+# combined transaction fails, every phase's work is retried on its own so a bad package only
+# fails the phase that asked for it.
+
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from typing import Callable, Dict, List, Optional, Tuple
+
+from scripts import package_index
+from scripts import repo_setup
+from scripts import system_utils as util
+from scripts.config import PHASES
+
+_module_logger = logging.getLogger(__name__)
+
+
+class DnfTransactionPlan:
+    """The DNF work of several phases, each item tagged with the phase that asked for it first."""
+
+    def __init__(self):
+        self.packages: Dict[str, str] = {}                      # package spec -> phase_id
+        self.groups: Dict[str, str] = {}                        # group id -> phase_id
+        self.swaps: List[Tuple[str, str, str]] = []             # (from_pkg, to_pkg, phase_id)
+        self.custom_repos: List[Tuple[str, str, Dict]] = []     # (phase_id, repo key, config entry)
+        self.already_installed: Dict[str, List[str]] = {}       # phase_id -> skipped packages
+
+    def phases(self) -> List[str]:
+        phase_ids = set(self.packages.values()) | set(self.groups.values())
+        phase_ids |= {swap[2] for swap in self.swaps} | {repo[0] for repo in self.custom_repos}
+        return [phase_id for phase_id in PHASES if phase_id in phase_ids]
+
+    def work_for_phase(self, phase_id: str) -> Tuple[List[str], List[str], List[Tuple[str, str]]]:
+        """(packages, groups, swaps) that phase_id contributed."""
+        return (
+            [pkg for pkg, owner in self.packages.items() if owner == phase_id],
+            [group for group, owner in self.groups.items() if owner == phase_id],
+            [(from_pkg, to_pkg) for from_pkg, to_pkg, owner in self.swaps if owner == phase_id],
+        )
+
+    def is_empty(self) -> bool:
+        return not (self.packages or self.groups or self.swaps)
+
+    def describe(self) -> str:
+        return (f"{len(self.packages)} packages, {len(self.groups)} groups, {len(self.swaps)} swaps "
+                f"and {len(self.custom_repos)} custom repositories across {len(self.phases())} phases")
+
+
+def collect_dnf_work(
+    app_config: Dict,
+    phase_ids: List[str],
+    logger: Optional[logging.Logger] = None,
+    skip_installed: bool = True
+) -> DnfTransactionPlan:
+    """
+    Builds the combined plan for phase_ids (those with "dnf_work" in PHASES), leaving out packages
+    that are already installed.
+    With skip_installed=False the full package set is kept (e.g. to build a repository for other machines).
+    """
+    log = logger or _module_logger
+    plan = DnfTransactionPlan()
+    index = package_index.get_installed_package_index(log)
+
+    for phase_id in phase_ids:
+        if not PHASES[phase_id].get("dnf_work"):
+            continue # The phase installs no DNF packages itself
+        section = app_config.get(PHASES[phase_id].get("config_section", ""), {})
+
+        if skip_installed:
+            to_install, skipped = util.filter_installed_packages(section.get("dnf_packages", []), log)
+        else:
+            to_install, skipped = list(section.get("dnf_packages", [])), []
+        plan.already_installed[phase_id] = skipped
+        for pkg in to_install:
+            plan.packages.setdefault(pkg, phase_id)
+
+        for key, value in section.items():
+            if key.startswith("dnf_groups_"):
+                for group in value:
+                    if not skip_installed or not util.is_group_installed_this_run(group):
+                        plan.groups.setdefault(group, phase_id)
+            elif key.startswith("dnf_swap_") and value.get("from") and value.get("to"):
+                if not skip_installed:
+                    plan.packages.setdefault(value["to"], phase_id)
+                elif index.is_installed(value["from"]):
+                    plan.swaps.append((value["from"], value["to"], phase_id))
+                elif not index.satisfies(value["to"]):
+                    plan.packages.setdefault(value["to"], phase_id)
+
+        custom_repos = section.get("custom_repo_dnf_packages", {})
+        if skip_installed:
+            custom_repos = repo_setup.pending_entries(custom_repos, log)
+        for repo_key, entry in custom_repos.items():
+            plan.custom_repos.append((phase_id, repo_key, entry))
+            if entry.get("dnf_package_to_install"):
+                plan.packages.setdefault(entry["dnf_package_to_install"], phase_id)
+
+    log.info(f"Combined DNF plan: {plan.describe()}.")
+    return plan
+
+def _dnf5_supports_do(log: logging.Logger) -> bool:
+    if not shutil.which("dnf5"):
+        return False
+    try:
+        proc = util.run_command(["dnf5", "do", "--help"], capture_output=True, check=False, logger=log, read_only=True)
+        return proc.returncode == 0
+    except Exception:
+        return False
+
+def build_transaction_command(plan: DnfTransactionPlan, log: logging.Logger, assume_no: bool = False) -> Tuple[List[str], Optional[str]]:
+    """
+    Returns (command, script_path). With dnf5 this is a single `dnf5 do` command line; with dnf4 it
+    is `dnf shell` reading a temporary script, whose path is returned so the caller can remove it.
+    With assume_no=True dnf resolves and prints the transaction, then aborts it (for --plan).
+    """
+    answer = "--assumeno" if assume_no else "-y"
+    installs = list(plan.packages) + [to_pkg for _, to_pkg, _ in plan.swaps]
+    removals = [from_pkg for from_pkg, _, _ in plan.swaps]
+
+    if _dnf5_supports_do(log):
+        cmd = util.build_dnf_cmd(["do", answer, "--allowerasing"], dnf_binary="dnf5")
+        if installs or plan.groups:
+            cmd += ["--action=install"] + installs + [f"@{group}" for group in plan.groups]
+        if removals:
+            cmd += ["--action=remove"] + removals
+        return cmd, None
+
+    lines = []
+    if plan.packages:
+        lines.append("install " + " ".join(plan.packages))
+    for group in plan.groups:
+        lines.append(f"group install {group}")
+    for from_pkg, to_pkg, _ in plan.swaps:
+        lines.append(f"swap {from_pkg} {to_pkg}")
+    lines.append("run")
+    fd, script_path = tempfile.mkstemp(prefix="autoenv-dnf-", suffix=".dnfshell")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.chmod(script_path, 0o644)
+    return util.build_dnf_cmd(["shell", answer, "--allowerasing", script_path]), script_path
+
+def _run_phase_work_separately(
+    plan: DnfTransactionPlan,
+    phase_id: str,
+    log: logging.Logger,
+    print_fns: Dict[str, Optional[Callable[[str], None]]]
+) -> bool:
+    packages, groups, swaps = plan.work_for_phase(phase_id)
+    ok = util.install_dnf_packages(packages, logger=log, **print_fns) if packages else True
+    for from_pkg, to_pkg in swaps:
+        ok = util.swap_dnf_packages(from_pkg, to_pkg, logger=log, **print_fns) and ok
+    if groups:
+        ok = util.install_dnf_groups(groups, logger=log, **print_fns) and ok
+    return ok
+
+def execute_plan(
+    plan: DnfTransactionPlan,
+    print_fn_info: Optional[Callable[[str], None]] = None,
+    print_fn_error: Optional[Callable[[str], None]] = None,
+    print_fn_sub_step: Optional[Callable[[str], None]] = None,
+    logger: Optional[logging.Logger] = None
+) -> Dict[str, bool]:
+    """Runs the plan as one transaction. Returns, per phase, whether all of its DNF work is now done."""
+    log = logger or _module_logger
+    _p_info = print_fn_info or (lambda msg: None)
+    _p_error = print_fn_error or (lambda msg: None)
+    print_fns = {"print_fn_info": print_fn_info, "print_fn_error": print_fn_error, "print_fn_sub_step": print_fn_sub_step}
+    results = {phase_id: True for phase_id in plan.phases()}
+
+    # Third-party repositories must exist before the depsolve that needs their packages
+    repo_results = repo_setup.setup_custom_repos({repo_key: entry for _, repo_key, entry in plan.custom_repos}, logger=log, **print_fns)
+    for phase_id, repo_key, entry in plan.custom_repos:
+        if not repo_results.get(repo_key):
+            _p_error(f"Repository setup for {entry.get('name', repo_key)} failed; skipping its package.")
+            plan.packages.pop(entry.get("dnf_package_to_install", ""), None)
+            results[phase_id] = False
+
+    if plan.is_empty():
+        _p_info("No DNF work left: everything in the selected phases is already installed.")
+        return results
+
+    index = package_index.get_installed_package_index(log)
+    util.ensure_dnf_metadata(log)
+    cmd, script_path = build_transaction_command(plan, log)
+    _p_info(f"Running one combined DNF transaction for {plan.describe()}...")
+    try:
+        with index.transaction(): # Groups and --allowerasing: resnapshot afterwards
+            util.run_command(cmd, capture_output=True, check=True, stream_output=True, logger=log, print_fn_error=print_fn_error, print_fn_sub_step=print_fn_sub_step)
+        util.mark_groups_installed(plan.groups)
+    except (subprocess.CalledProcessError, OSError) as e:
+        log.warning(f"Combined DNF transaction failed ({e}); retrying each phase's DNF work separately.")
+        _p_error("Combined DNF transaction failed; retrying each phase separately to isolate the failure.")
+        for phase_id in list(results):
+            results[phase_id] = _run_phase_work_separately(plan, phase_id, log, print_fns) and results[phase_id]
+        return results
+    finally:
+        if script_path:
+            try:
+                os.unlink(script_path)
+            except OSError:
+                pass
+
+    # Attribute the outcome to each phase from the real installed state
+    for phase_id in list(results):
+        packages, _, swaps = plan.work_for_phase(phase_id)
+        missing = [pkg for pkg in packages + [to_pkg for _, to_pkg in swaps] if not index.satisfies(pkg)]
+        if missing:
+            log.error(f"After the combined transaction, {phase_id} is still missing: {', '.join(missing)}")
+            _p_error(f"{PHASES[phase_id]['name']}: still missing {', '.join(missing)}")
+            results[phase_id] = False
+    return results
@@ -0,0 +1,157 @@
+# Fedora-AutoEnv-Setup/scripts/exec_trace.py
+
+# Per-run execution trace: one span per phase, per system_utils helper and per child command.
+# Command spans carry wall time plus user/sys CPU and max RSS of the child (from wait4), and are
+# tagged with the phase and helper that issued them. export_chrome_trace() writes the Chrome
+# trace-event JSON format, which opens directly in Perfetto (ui.perfetto.dev) or chrome://tracing.
+
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+_current_phase: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("trace_phase", default=None)
+_current_helper: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("trace_helper", default=None)
+
+_events: List[Dict[str, Any]] = []
+_thread_names: Dict[int, str] = {}
+_async_lanes: Dict[int, int] = {}
+_lock = threading.Lock()
+_t0 = time.perf_counter()
+_pid = os.getpid()
+
+# Async commands overlap on one OS thread; give each asyncio task its own lane in the timeline
+_ASYNC_LANE_BASE = 1_000_000
+
+
+def get_current_phase() -> Optional[str]:
+    return _current_phase.get()
+
+def get_current_helper() -> Optional[str]:
+    return _current_helper.get()
+
+def _now_us() -> float:
+    return (time.perf_counter() - _t0) * 1_000_000
+
+def _lane() -> int:
+    """Timeline row for the caller: the OS thread, or a per-task lane inside an event loop."""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    with _lock:
+        if task is not None:
+            lane = _async_lanes.setdefault(id(task), _ASYNC_LANE_BASE + len(_async_lanes))
+            _thread_names.setdefault(lane, f"async {task.get_name()}")
+            return lane
+        tid = threading.get_native_id()
+        _thread_names.setdefault(tid, threading.current_thread().name)
+        return tid
+
+def _append_event(name: str, category: str, start_us: float, end_us: float, tid: int, args: Dict[str, Any]) -> None:
+    event = {
+        "name": name, "cat": category, "ph": "X",
+        "ts": round(start_us, 3), "dur": round(max(end_us - start_us, 0.0), 3),
+        "pid": _pid, "tid": tid, "args": args,
+    }
+    with _lock:
+        _events.append(event)
+
+@contextmanager
+def trace_span(name: str, category: str = "helper", **args: Any) -> Iterator[None]:
+    """Records a span around the block. 'phase' and 'helper' spans also tag nested command spans."""
+    token_phase = _current_phase.set(name) if category == "phase" else None
+    token_helper = _current_helper.set(name) if category == "helper" else None
+    tid = _lane()
+    start_us = _now_us()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        span_args = {"phase": _current_phase.get(), "outcome": outcome, **args}
+        if category == "helper":
+            span_args["helper"] = name
+        _append_event(name, category, start_us, _now_us(), tid, span_args)
+        if token_helper is not None:
+            _current_helper.reset(token_helper)
+        if token_phase is not None:
+            _current_phase.reset(token_phase)
+
+def traced_helper(fn: Callable) -> Callable:
+    """Decorator recording a 'helper' span for every call of a sync or async function."""
+    if asyncio.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            with trace_span(fn.__name__, "helper"):
+                return await fn(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with trace_span(fn.__name__, "helper"):
+            return fn(*args, **kwargs)
+    return wrapper
+
+def command_timer() -> Dict[str, float]:
+    """Captures the start of a command; pass the result to record_command."""
+    return {"start_us": _now_us(), "tid": _lane()}
+
+def record_command(
+    timer: Dict[str, float],
+    display_command: str,
+    returncode: Optional[int],
+    rusage: Optional[Dict[str, float]] = None,
+    via: str = "spawn"
+) -> None:
+    """Records a finished child command with its resource usage and the current phase/helper tags."""
+    args: Dict[str, Any] = {
+        "command": display_command,
+        "returncode": returncode,
+        "phase": _current_phase.get(),
+        "helper": _current_helper.get(),
+        "via": via,
+    }
+    if rusage:
+        args.update(rusage)
+    _append_event(_command_span_name(display_command), "command", timer["start_us"], _now_us(), int(timer["tid"]), args)
+
+def _command_span_name(display_command: str) -> str:
+    """Short timeline label: the executable, keeping 'sudo' and run_as_user context visible."""
+    parts = display_command.split()
+    if not parts:
+        return "command"
+    if display_command.startswith("(as ") and len(parts) > 2:
+        return f"{parts[2]} (as {parts[1].rstrip(')')})"
+    if parts[0] == "sudo" and len(parts) > 1:
+        return f"sudo {parts[1]}"
+    return parts[0]
+
+def get_events() -> List[Dict[str, Any]]:
+    with _lock:
+        return list(_events)
+
+def export_chrome_trace(path: Path) -> bool:
+    """Writes all recorded spans as a Chrome trace-event JSON file. Returns False on I/O errors."""
+    with _lock:
+        events = list(_events)
+        metadata = [
+            {"name": "thread_name", "ph": "M", "pid": _pid, "tid": tid, "args": {"name": name}}
+            for tid, name in _thread_names.items()
+        ]
+    metadata.append({"name": "process_name", "ph": "M", "pid": _pid, "tid": 0, "args": {"name": "Fedora AutoEnv Setup"}})
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, f)
+        return True
+    except OSError:
+        return False
@@ -0,0 +1,189 @@
+# Fedora-AutoEnv-Setup/scripts/flatpak_index.py
+
+# Per-run snapshot of the Flatpak state, so re-running a phase on a provisioned machine does
+# not contact Flathub once per app. One `flatpak list --app` answers "is this app installed?"
+# for every app of every phase, one `flatpak remotes` answers "is this remote configured?",
+# and each remote's app listing (`flatpak remote-ls --app`) is fetched at most once per run to
+# reject misspelled app ids before anything is downloaded. Any flatpak command that changes
+# state marks the installed/remotes snapshot stale (see command_cache); remote listings are kept.
+# Each install root (see install_root) has its own index, over the system installation in the root.
+
+import logging
+import os
+import subprocess
+import threading
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from scripts import command_cache
+from scripts import exec_trace
+from scripts import install_root
+
+_module_logger = logging.getLogger(__name__)
+
+
+class InstalledApp(NamedTuple):
+    application: str
+    origin: str        # remote the app was installed from
+    installation: str  # "system", "user" or a custom installation name
+
+
+def _installation_name(system_wide: bool) -> str:
+    return "system" if system_wide else "user"
+
+def _run_flatpak(args: List[str], log: logging.Logger, env: Optional[Dict[str, str]] = None) -> subprocess.CompletedProcess:
+    """Runs a read-only flatpak query (with env added to the environment). Raises FileNotFoundError if flatpak is missing."""
+    cmd = ["flatpak"] + args
+    display = " ".join(cmd)
+    log.debug(f"Querying Flatpak state: {display}")
+    timer = exec_trace.command_timer()
+    try:
+        # Not run through run_command: this is the index's own cache fill
+        proc = subprocess.run(cmd, capture_output=True, text=True, check=False, env=dict(os.environ, **env) if env else None)
+    except FileNotFoundError:
+        exec_trace.record_command(timer, display, None, None, "spawn")
+        raise
+    exec_trace.record_command(timer, display, proc.returncode, None, "spawn")
+    return proc
+
+def parse_list_output(output: str) -> List[InstalledApp]:
+    apps = []
+    for line in output.splitlines():
+        fields = [field.strip() for field in line.split("\t")]
+        if len(fields) == 3 and fields[0]:
+            apps.append(InstalledApp(*fields))
+    return apps
+
+def parse_remotes_output(output: str) -> Set[Tuple[str, str]]:
+    """(remote name, installation) pairs from `flatpak remotes --columns=name,options`."""
+    remotes = set()
+    for line in output.splitlines():
+        fields = [field.strip() for field in line.split("\t")]
+        if not fields[0]:
+            continue
+        options = fields[1].split(",") if len(fields) > 1 else []
+        installation = "user" if "user" in options else "system"
+        remotes.add((fields[0].lower(), installation))
+    return remotes
+
+def parse_remote_info_output(output: str) -> Dict[str, str]:
+    """'Key: value' fields of `flatpak remote-info` ("Download", "Installed", "Runtime", ...)."""
+    fields = {}
+    for line in output.splitlines():
+        key, sep, value = line.partition(":")
+        if sep and key.strip() and value.strip():
+            fields.setdefault(key.strip(), value.strip())
+    return fields
+
+
+class FlatpakIndex:
+    """Installed apps, configured remotes and (lazily) each remote's available apps, shared by all phases."""
+
+    def __init__(self, logger: Optional[logging.Logger] = None, env: Optional[Dict[str, str]] = None):
+        self._log = logger or _module_logger
+        self._env = env or {} # e.g. FLATPAK_SYSTEM_DIR of an install root
+        self._lock = threading.RLock()
+        self._apps: Dict[Tuple[str, str], InstalledApp] = {} # (application, installation) -> app
+        self._remotes: Set[Tuple[str, str]] = set()
+        self._remote_apps: Dict[Tuple[str, str], Optional[Set[str]]] = {}
+        self._remote_info: Dict[Tuple[str, str, str], Optional[Dict[str, str]]] = {}
+        self._runtimes: Optional[Set[str]] = None # Installed runtime refs, listed on first use
+        self._loaded = False
+
+    def _ensure_loaded(self) -> None:
+        with self._lock:
+            if self._loaded:
+                return
+            list_proc = _run_flatpak(["list", "--app", "--columns=application,origin,installation"], self._log, self._env)
+            remotes_proc = _run_flatpak(["remotes", "--columns=name,options"], self._log, self._env)
+            apps = parse_list_output(list_proc.stdout) if list_proc.returncode == 0 else []
+            self._apps = {(app.application, app.installation): app for app in apps}
+            self._remotes = parse_remotes_output(remotes_proc.stdout) if remotes_proc.returncode == 0 else set()
+            self._loaded = True
+            self._log.info(f"Flatpak index loaded: {len(self._apps)} apps, {len(self._remotes)} remotes.")
+
+    def mark_stale(self) -> None:
+        with self._lock:
+            self._loaded = False
+            self._runtimes = None
+
+    def is_installed(self, app_id: str, system_wide: bool = True) -> bool:
+        self._ensure_loaded()
+        with self._lock:
+            return (app_id, _installation_name(system_wide)) in self._apps
+
+    def installed_app(self, app_id: str, system_wide: bool = True) -> Optional[InstalledApp]:
+        self._ensure_loaded()
+        with self._lock:
+            return self._apps.get((app_id, _installation_name(system_wide)))
+
+    def installed_app_ids(self, system_wide: bool = True) -> Set[str]:
+        self._ensure_loaded()
+        installation = _installation_name(system_wide)
+        with self._lock:
+            return {app_id for app_id, app_installation in self._apps if app_installation == installation}
+
+    def has_remote(self, remote_name: str, system_wide: bool = True) -> bool:
+        self._ensure_loaded()
+        with self._lock:
+            return (remote_name.lower(), _installation_name(system_wide)) in self._remotes
+
+    def remote_app_ids(self, remote_name: str, system_wide: bool = True) -> Optional[Set[str]]:
+        """Apps the remote offers, listed once per run. None if the listing failed (offline, unknown remote)."""
+        key = (remote_name.lower(), _installation_name(system_wide))
+        with self._lock:
+            if key in self._remote_apps:
+                return self._remote_apps[key]
+        proc = _run_flatpak(["remote-ls", f"--{key[1]}", "--app", "--columns=application", remote_name], self._log, self._env)
+        if proc.returncode == 0:
+            listing = {line.strip() for line in proc.stdout.splitlines() if line.strip()}
+        else:
+            self._log.warning(f"Could not list the apps of Flatpak remote '{remote_name}': {proc.stderr.strip()}")
+            listing = None
+        with self._lock:
+            self._remote_apps[key] = listing
+        return listing
+
+    def installed_runtime_refs(self, system_wide: bool = True) -> Set[str]:
+        """Refs ("org.gnome.Platform/x86_64/46") of the installed runtimes."""
+        with self._lock:
+            if self._runtimes is None:
+                proc = _run_flatpak(["list", f"--{_installation_name(system_wide)}", "--runtime", "--columns=ref"], self._log, self._env)
+                self._runtimes = {line.strip() for line in proc.stdout.splitlines() if line.strip()} if proc.returncode == 0 else set()
+            return set(self._runtimes)
+
+    def remote_info(self, remote_name: str, ref: str, system_wide: bool = True) -> Optional[Dict[str, str]]:
+        """The fields of `flatpak remote-info` for ref, fetched once per run. None if the query failed."""
+        key = (remote_name.lower(), _installation_name(system_wide), ref)
+        with self._lock:
+            if key in self._remote_info:
+                return self._remote_info[key]
+        proc = _run_flatpak(["remote-info", f"--{key[1]}", remote_name, ref], self._log, self._env)
+        if proc.returncode == 0:
+            info = parse_remote_info_output(proc.stdout)
+        else:
+            self._log.warning(f"Could not get Flatpak remote info for '{ref}' from '{remote_name}': {proc.stderr.strip()}")
+            info = None
+        with self._lock:
+            self._remote_info[key] = info
+        return info
+
+
+_indexes: Dict[str, FlatpakIndex] = {} # install_root.key() -> index
+_index_lock = threading.Lock()
+
+
+def get_flatpak_index(logger: Optional[logging.Logger] = None) -> FlatpakIndex:
+    """Returns the Flatpak index of the targeted install root shared by all phases for this run (loaded lazily on first lookup)."""
+    with _index_lock:
+        root_key = install_root.key()
+        if root_key not in _indexes:
+            _indexes[root_key] = FlatpakIndex(logger, env=install_root.flatpak_env())
+        return _indexes[root_key]
+
+def _on_flatpak_changed() -> None:
+    index = _indexes.get(install_root.key())
+    if index is not None:
+        index.mark_stale()
+
+# installs, uninstalls and remote-add/-modify run through run_command invalidate the "flatpak" family
+command_cache.query_cache.register_invalidation_hook("flatpak", _on_flatpak_changed)
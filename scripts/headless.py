@@ -0,0 +1,134 @@
+# Fedora-AutoEnv-Setup/scripts/headless.py
+
+# Non-interactive front end to the phase engine, for unattended provisioning
+# (install.py --phases/--all). The selected phases run exactly as "run all" runs them from
+# the menu: one combined DNF transaction, then the phases as a dependency graph. Nothing
+# prompts: pending dependencies of the selected phases are added automatically, and phases
+# that are already complete are only rerun when their fingerprint changed (or with --yes).
+# Each phase ends up with one outcome:
+#   completed          ran and succeeded
+#   failed             ran and failed
+#   skipped            not run because a dependency did not complete
+#   up_to_date         already complete, configuration and installed state unchanged
+#   already_complete   already complete, no fingerprint to compare (rerun with --yes)
+# and the exit code summarizes them: 0 all fine, 1 a phase failed, 2 invalid arguments or
+# configuration, 3 a phase was skipped (and none failed). With several install roots
+# (--installroot), the run's exit code is the most severe of the roots' codes.
+
+import json
+import logging
+import os
+import sys
+from typing import Dict, IO, Iterable, List, Optional, Tuple
+
+from scripts import main_menu
+from scripts import phase_fingerprints
+from scripts.config import PHASES
+
+EXIT_OK = 0
+EXIT_PHASE_FAILED = 1
+EXIT_USAGE = 2
+EXIT_PHASE_SKIPPED = 3
+
+# Most severe first
+_EXIT_CODE_SEVERITY = (EXIT_PHASE_FAILED, EXIT_USAGE, EXIT_PHASE_SKIPPED)
+
+_TASK_STATUS_TO_OUTCOME = {"ok": "completed", "failed": "failed", "skipped": "skipped"}
+
+_module_logger = logging.getLogger(__name__)
+
+
+def resolve_phase_selection(requested: List[str], phase_status: Dict[str, bool]) -> Tuple[List[str], List[str]]:
+    """
+    Maps requested phase ids (or 1-based menu numbers) to phase ids in PHASES order, adding the
+    dependencies that are not complete yet. Returns (phase ids, the dependencies that were added).
+    Raises ValueError for unknown phases.
+    """
+    phase_ids = list(PHASES)
+    selected = set()
+    for item in requested:
+        if item in PHASES:
+            selected.add(item)
+        elif item.isdigit() and 1 <= int(item) <= len(phase_ids):
+            selected.add(phase_ids[int(item) - 1])
+        else:
+            raise ValueError(f"Unknown phase '{item}'. Known phases: {', '.join(phase_ids)}")
+
+    added = set()
+    stack = list(selected)
+    while stack:
+        for dep_id in PHASES[stack.pop()]["dependencies"]:
+            if not phase_status.get(dep_id, False) and dep_id not in selected | added:
+                added.add(dep_id)
+                stack.append(dep_id)
+    return [phase_id for phase_id in phase_ids if phase_id in selected | added], [phase_id for phase_id in phase_ids if phase_id in added]
+
+def exit_code_for(outcomes: Dict[str, Dict]) -> int:
+    statuses = {outcome["status"] for outcome in outcomes.values()}
+    if "failed" in statuses:
+        return EXIT_PHASE_FAILED
+    if "skipped" in statuses:
+        return EXIT_PHASE_SKIPPED
+    return EXIT_OK
+
+def combine_exit_codes(exit_codes: Iterable[int]) -> int:
+    """The most severe of several runs' exit codes (one per install root)."""
+    codes = set(exit_codes)
+    return next((code for code in _EXIT_CODE_SEVERITY if code in codes), EXIT_OK)
+
+def run_headless(
+    app_config: Dict,
+    phase_status: Dict[str, bool],
+    phase_ids: List[str],
+    assume_yes: bool = False,
+    logger: Optional[logging.Logger] = None
+) -> Tuple[int, Dict]:
+    """Runs phase_ids without prompts. Returns (exit code, report) where the report is JSON-serializable."""
+    log = logger or _module_logger
+    outcomes: Dict[str, Dict] = {}
+    to_run = []
+    for phase_id in phase_ids:
+        if phase_status.get(phase_id, False):
+            run, freshness = main_menu.prepare_rerun(phase_id, app_config, assume_yes=assume_yes)
+            if not run:
+                status = "up_to_date" if freshness == phase_fingerprints.UP_TO_DATE else "already_complete"
+                outcomes[phase_id] = {"status": status, "duration_seconds": 0.0, "error": None}
+                continue
+        to_run.append(phase_id)
+
+    if to_run:
+        for phase_id, result in main_menu.run_phases(app_config, phase_status, to_run).items():
+            outcomes[phase_id] = {
+                "status": _TASK_STATUS_TO_OUTCOME[result.status],
+                "duration_seconds": round(result.duration, 1),
+                "error": str(result.error) if result.error is not None else None,
+            }
+
+    exit_code = exit_code_for(outcomes)
+    report = {
+        "phases": {
+            phase_id: dict(name=PHASES[phase_id]["name"], **outcomes[phase_id])
+            for phase_id in PHASES if phase_id in outcomes
+        },
+        "exit_code": exit_code,
+    }
+    summary = ", ".join(f"{phase_id}={outcome['status']}" for phase_id, outcome in outcomes.items())
+    log.info(f"Headless run finished with exit code {exit_code}: {summary or 'no phases'}")
+    return exit_code, report
+
+def reserve_stdout_for_json() -> IO[str]:
+    """
+    Moves everything else on stdout to stderr and returns a stream on the original stdout, for emit_json.
+    fd 1 itself is pointed at stderr, so commands that inherit it (those run without capture_output)
+    cannot interleave their output with the JSON document either.
+    """
+    sys.stdout.flush()
+    json_fd = os.dup(1)
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+    return os.fdopen(json_fd, "w", encoding="utf-8")
+
+def emit_json(report: Dict, stream: IO[str]) -> None:
+    """Writes report to stream (the original stdout in --json mode; console output goes to stderr)."""
+    stream.write(json.dumps(report, indent=2, ensure_ascii=False) + "\n")
+    stream.flush()
@@ -0,0 +1,189 @@
+# Fedora-AutoEnv-Setup/scripts/install_root.py
+
+# Alternate install roots (install.py --installroot PATH). Without one, every helper targets the
+# live system. Inside `targeting(root)` the same helpers target the tree under root instead:
+#   dnf      --installroot=<root> --releasever=<root's, else the host's release>, with a package
+#            cache shared by all roots (keepcache on, so each package is downloaded once)
+#   rpm      --root=<root> (installed-package index, rpm --import)
+#   flatpak  the system installation at <root>/var/lib/flatpak (FLATPAK_SYSTEM_DIR)
+#   users    looked up in <root>/etc/passwd; homes are under root, commands "as the user" run with
+#            the user's numeric uid/gid (setpriv), since the user need not exist on the host
+#   state    install_status/steps/fingerprints are kept per root, next to the host's files
+# The root is a context variable: install.py provisions several roots concurrently, one thread per
+# root, and the scheduler threads of each root's phases inherit it (see task_scheduler).
+# Commands are rewritten in run_command (adapt_command), so helpers build their command lines as
+# for the live system. Shell strings are not rewritten.
+
+import contextlib
+import contextvars
+import hashlib
+import shutil
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Union
+
+SHARED_DNF_CACHE_DIR = Path("/var/cache/fedora-autoenv-setup/dnf")
+STATE_DIR_NAME = "install-roots"
+
+FLATPAK_SYSTEM_RELATIVE_DIR = Path("var/lib/flatpak")
+PASSWD_RELATIVE_PATH = Path("etc/passwd")
+OS_RELEASE_RELATIVE_PATH = Path("etc/os-release")
+YUM_REPOS_RELATIVE_DIR = Path("etc/yum.repos.d")
+
+# Regular (login) accounts, as useradd numbers them on Fedora
+_FIRST_REGULAR_UID = 1000
+_LAST_REGULAR_UID = 59999
+_NOLOGIN_SHELLS = ("/sbin/nologin", "/usr/sbin/nologin", "/bin/false", "/usr/bin/false")
+
+_DNF_PROGRAMS = {"dnf", "dnf5", "yum"}
+
+_current_root: contextvars.ContextVar[Optional[Path]] = contextvars.ContextVar("install_root", default=None)
+
+
+class PasswdEntry(NamedTuple):
+    user: str
+    uid: int
+    gid: int
+    home: str
+    shell: str
+
+
+def current() -> Optional[Path]:
+    """The install root targeted in this context, or None for the live system."""
+    return _current_root.get()
+
+def key(root: Optional[Path] = None) -> str:
+    """Key for per-root caches: the root path, or "" for the live system."""
+    root = root if root is not None else current()
+    return str(root) if root is not None else ""
+
+@contextlib.contextmanager
+def targeting(root: Optional[Union[str, Path]]) -> Iterator[Optional[Path]]:
+    """Targets root (an absolute path; None for the live system) for the duration of the block."""
+    resolved = Path(root).resolve() if root is not None else None
+    token = _current_root.set(resolved)
+    try:
+        yield resolved
+    finally:
+        _current_root.reset(token)
+
+def path(system_path: Union[str, Path], root: Optional[Path] = None) -> Path:
+    """system_path (absolute, as on the live system) inside the targeted root."""
+    root = root if root is not None else current()
+    if root is None:
+        return Path(system_path)
+    return root / Path(system_path).relative_to("/")
+
+def state_path(default_path: Path, root: Optional[Path] = None) -> Path:
+    """Where a state file (install_status.json, ...) of the targeted root lives: default_path for the live system."""
+    root = root if root is not None else current()
+    if root is None:
+        return default_path
+    slug = f"{root.name or 'root'}-{hashlib.sha256(str(root).encode('utf-8')).hexdigest()[:8]}"
+    state_dir = default_path.parent / STATE_DIR_NAME / slug
+    state_dir.mkdir(parents=True, exist_ok=True)
+    return state_dir / default_path.name
+
+# --- Users ---
+
+def read_passwd(root: Path) -> List[PasswdEntry]:
+    """The entries of <root>/etc/passwd (empty if the root has none yet)."""
+    entries = []
+    try:
+        lines = (root / PASSWD_RELATIVE_PATH).read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return []
+    for line in lines:
+        fields = line.split(":")
+        if len(fields) < 7 or line.startswith("#"):
+            continue
+        try:
+            entries.append(PasswdEntry(fields[0], int(fields[2]), int(fields[3]), fields[5], fields[6]))
+        except ValueError:
+            continue
+    return entries
+
+def passwd_entry(root: Path, username: str) -> Optional[PasswdEntry]:
+    return next((entry for entry in read_passwd(root) if entry.user == username), None)
+
+def regular_users(root: Path) -> List[PasswdEntry]:
+    """Login accounts of the root, lowest uid first."""
+    users = [
+        entry for entry in read_passwd(root)
+        if _FIRST_REGULAR_UID <= entry.uid <= _LAST_REGULAR_UID and entry.shell not in _NOLOGIN_SHELLS
+    ]
+    return sorted(users, key=lambda entry: entry.uid)
+
+def user_command_prefix(entry: PasswdEntry, root: Path) -> List[str]:
+    """Runs the rest of the command line with the uid/gid of a user of root, and HOME inside root."""
+    return [
+        "sudo", "-n", "setpriv", f"--reuid={entry.uid}", f"--regid={entry.gid}", "--clear-groups",
+        "env", f"HOME={path(entry.home, root)}", f"USER={entry.user}", f"LOGNAME={entry.user}",
+    ]
+
+# --- Commands ---
+
+def _os_release_version(os_release: Path) -> Optional[str]:
+    try:
+        lines = os_release.read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return None
+    for line in lines:
+        name, sep, value = line.partition("=")
+        if sep and name.strip() == "VERSION_ID":
+            return value.strip().strip('"') or None
+    return None
+
+def releasever(root: Path) -> Optional[str]:
+    """The root's Fedora release, or the host's while the root has no os-release yet."""
+    return _os_release_version(root / OS_RELEASE_RELATIVE_PATH) or _os_release_version(Path("/") / OS_RELEASE_RELATIVE_PATH)
+
+def _has_own_repos(root: Path) -> bool:
+    repos_dir = root / YUM_REPOS_RELATIVE_DIR
+    return repos_dir.is_dir() and any(repos_dir.glob("*.repo"))
+
+def _is_dnf5(program: str) -> bool:
+    return Path(shutil.which(program) or program).resolve().name == "dnf5"
+
+def set_shared_dnf_cache_dir(cache_dir: Union[str, Path]) -> None:
+    """Sets the package cache every root's dnf commands share."""
+    global SHARED_DNF_CACHE_DIR
+    SHARED_DNF_CACHE_DIR = Path(cache_dir)
+
+def dnf_root_args(program: str, root: Path) -> List[str]:
+    """Global dnf options that make a dnf command operate on root."""
+    args = [f"--installroot={root}"]
+    version = releasever(root)
+    if version:
+        args.append(f"--releasever={version}")
+    args += [f"--setopt=cachedir={SHARED_DNF_CACHE_DIR}", "--setopt=keepcache=True"]
+    # dnf4 falls back to the host's configuration and repositories while the root has none; dnf5 only when asked
+    if _is_dnf5(program) and not _has_own_repos(root):
+        args.append("--use-host-config")
+    return args
+
+def flatpak_env(root: Optional[Path] = None) -> Dict[str, str]:
+    """Environment that points flatpak's system installation into root (empty for the live system)."""
+    root = root if root is not None else current()
+    if root is None:
+        return {}
+    return {"FLATPAK_SYSTEM_DIR": str(root / FLATPAK_SYSTEM_RELATIVE_DIR)}
+
+def adapt_command(command: Union[str, List[str]]) -> Union[str, List[str]]:
+    """
+    Rewrites an argv command line (optionally behind a plain "sudo") to target the current root:
+    dnf gets dnf_root_args, rpm gets --root and flatpak runs under `env FLATPAK_SYSTEM_DIR=...`
+    (sudo would drop the variable from the environment). Anything else is returned unchanged.
+    """
+    root = current()
+    if root is None or not isinstance(command, list) or not command:
+        return command
+    argv = [str(part) for part in command]
+    index = 1 if len(argv) > 1 and argv[0] == "sudo" and not argv[1].startswith("-") else 0
+    program = argv[index].rsplit("/", 1)[-1]
+    if program in _DNF_PROGRAMS and not any(arg.startswith("--installroot") for arg in argv):
+        return argv[:index + 1] + dnf_root_args(argv[index], root) + argv[index + 1:]
+    if program == "rpm" and not any(arg.startswith("--root") for arg in argv):
+        return argv[:index + 1] + [f"--root={root}"] + argv[index + 1:]
+    if program == "flatpak":
+        return argv[:index] + ["env"] + [f"{name}={value}" for name, value in flatpak_env(root).items()] + argv[index:]
+    return command
@@ -0,0 +1,168 @@
+# Fedora-AutoEnv-Setup/scripts/local_rpm_repo.py
+
+# Local RPM repository for provisioning many identical workstations from one packages.json.
+# build_local_repo() resolves the full package set of the selected phases once (with every
+# dependency, regardless of what this machine has installed), downloads the RPMs into a directory
+# and generates repo metadata with createrepo_c. activate_local_repo() then makes every dnf command
+# of the run use that directory (typically a shared mount) as a high-priority repository, or as
+# the only one in exclusive mode.
+#
+# packages.json:
+#   "local_rpm_repo": {
+#       "path": "/srv/autoenv-rpms",   # directory (or mount) holding the repository
+#       "enabled": true,               # use it for installs when it has metadata
+#       "priority": 1,                 # lower wins over the public repos (default 99)
+#       "exclusive": false,            # true: disable every other repo (offline provisioning)
+#       "gpgcheck": true               # false only for unsigned, locally built RPMs
+#   }
+
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from scripts import dnf_planner
+from scripts import exec_trace
+from scripts import repo_setup
+from scripts import system_utils as util
+
+LOCAL_REPO_ID = "autoenv-local"
+
+_module_logger = logging.getLogger(__name__)
+
+
+def get_local_repo_config(app_config: Dict) -> Dict:
+    """The 'local_rpm_repo' section with defaults filled in (empty path if not configured)."""
+    section = app_config.get("local_rpm_repo", {}) or {}
+    return {
+        "path": section.get("path", ""),
+        "enabled": bool(section.get("enabled", False)),
+        "priority": int(section.get("priority", 1)),
+        "exclusive": bool(section.get("exclusive", False)),
+        "gpgcheck": bool(section.get("gpgcheck", True)),
+    }
+
+def has_repo_metadata(repo_dir: Path) -> bool:
+    return (Path(repo_dir) / "repodata" / "repomd.xml").is_file()
+
+def dnf_args_for_local_repo(repo_dir: Path, priority: int = 1, exclusive: bool = False, gpgcheck: bool = True) -> List[str]:
+    """Global dnf options that add repo_dir as repository LOCAL_REPO_ID."""
+    args = [
+        f"--repofrompath={LOCAL_REPO_ID},{Path(repo_dir).resolve()}",
+        f"--setopt={LOCAL_REPO_ID}.priority={priority}",
+        f"--setopt={LOCAL_REPO_ID}.gpgcheck={int(gpgcheck)}",
+    ]
+    if exclusive:
+        args += ["--disablerepo=*", f"--enablerepo={LOCAL_REPO_ID}"]
+    return args
+
+def _parse_group_packages(group_info_output: str) -> List[str]:
+    """
+    Mandatory and default package names from `dnf group info` output. Handles the dnf4 layout
+    (section header line, then one indented name per line) and the dnf5 layout ('Mandatory packages : a').
+    """
+    packages, section = [], ""
+    for line in group_info_output.splitlines():
+        if ":" in line:
+            label, value = line.split(":", 1)
+            if label.strip():
+                section = label.strip().lower()
+        else:
+            value = line
+        value = value.strip().lstrip("=+-").strip()
+        if value and (section.startswith("mandatory") or section.startswith("default")):
+            packages.append(value.split()[0])
+    return packages
+
+def _expand_groups(groups: List[str], log: logging.Logger) -> List[str]:
+    """`dnf download` does not take @group specs, so groups are expanded to their member packages."""
+    members: List[str] = []
+    for group in groups:
+        cmd = util.build_dnf_cmd(["group", "info", group], sudo=False, global_args=False)
+        proc = util.run_command(cmd, capture_output=True, check=False, logger=log, read_only=True)
+        group_packages = _parse_group_packages(proc.stdout or "") if proc.returncode == 0 else []
+        if not group_packages:
+            log.warning(f"Could not list the packages of DNF group '{group}'; it will not be in the local repository.")
+        members += group_packages
+    return members
+
+@exec_trace.traced_helper
+def build_local_repo(
+    app_config: Dict,
+    phase_ids: List[str],
+    repo_dir: Path,
+    print_fn_info: Optional[Callable[[str], None]] = None,
+    print_fn_error: Optional[Callable[[str], None]] = None,
+    print_fn_sub_step: Optional[Callable[[str], None]] = None,
+    logger: Optional[logging.Logger] = None
+) -> bool:
+    """
+    Downloads every package of phase_ids, plus all dependencies, into repo_dir and (re)generates
+    its metadata. Custom repositories are set up first so their packages resolve. Re-running
+    only fetches what is missing.
+    """
+    log = logger or _module_logger
+    _p_info = print_fn_info or (lambda msg: None)
+    _p_error = print_fn_error or (lambda msg: None)
+    print_fns = {"print_fn_info": print_fn_info, "print_fn_error": print_fn_error, "print_fn_sub_step": print_fn_sub_step}
+    repo_dir = Path(repo_dir)
+
+    if not shutil.which("createrepo_c"):
+        log.error("'createrepo_c' not found; it is needed to generate the local repository metadata.")
+        _p_error("'createrepo_c' is not installed (sudo dnf install createrepo_c).")
+        return False
+
+    plan = dnf_planner.collect_dnf_work(app_config, phase_ids, logger=log, skip_installed=False)
+    repo_results = repo_setup.setup_custom_repos({repo_key: entry for _, repo_key, entry in plan.custom_repos}, logger=log, **print_fns)
+    for _, repo_key, entry in plan.custom_repos:
+        if not repo_results.get(repo_key):
+            _p_error(f"Repository setup for {entry.get('name', repo_key)} failed; its package is left out.")
+            plan.packages.pop(entry.get("dnf_package_to_install", ""), None)
+
+    specs = [spec for spec in plan.packages if not spec.startswith("@")] + _expand_groups(list(plan.groups), log)
+    if not specs:
+        _p_info("No packages to put in the local repository.")
+        return True
+
+    if not util.ensure_dir_exists(repo_dir, logger=log, print_fn_error=print_fn_error):
+        return False
+
+    _p_info(f"Downloading {len(specs)} packages and all their dependencies into {repo_dir}...")
+    util.ensure_dnf_metadata(log)
+    # Resolve against the configured repos only (no global args): the local repository itself may be incomplete
+    download_cmd = util.build_dnf_cmd(["download", "--resolve", "--alldeps", f"--destdir={repo_dir}"] + specs, global_args=False)
+    try:
+        util.run_command(download_cmd, capture_output=True, check=True, stream_output=True, logger=log, print_fn_error=print_fn_error, print_fn_sub_step=print_fn_sub_step)
+    except Exception as e:
+        log.error(f"Downloading packages into the local repository failed: {e}", exc_info=True)
+        _p_error("Downloading packages into the local repository failed. Check the log for details.")
+        return False
+
+    createrepo_cmd = ["sudo", "createrepo_c", "--quiet"]
+    if has_repo_metadata(repo_dir):
+        createrepo_cmd.append("--update")
+    try:
+        util.run_command(createrepo_cmd + [str(repo_dir)], capture_output=True, check=True, logger=log, print_fn_error=print_fn_error)
+    except Exception as e:
+        log.error(f"createrepo_c failed for {repo_dir}: {e}", exc_info=True)
+        return False
+
+    rpm_count = sum(1 for name in os.listdir(repo_dir) if name.endswith(".rpm"))
+    log.info(f"Local RPM repository at {repo_dir} holds {rpm_count} packages.")
+    _p_info(f"Local RPM repository ready: {rpm_count} packages in {repo_dir}.")
+    return True
+
+def activate_local_repo(app_config: Dict, logger: Optional[logging.Logger] = None) -> bool:
+    """Adds the configured local repository to every dnf command of this run, if enabled and built."""
+    log = logger or _module_logger
+    settings = get_local_repo_config(app_config)
+    if not settings["enabled"] or not settings["path"]:
+        return False
+    repo_dir = Path(settings["path"])
+    if not has_repo_metadata(repo_dir):
+        log.warning(f"Local RPM repository {repo_dir} has no metadata yet; using the public repositories.")
+        return False
+    util.set_dnf_global_args(dnf_args_for_local_repo(repo_dir, settings["priority"], settings["exclusive"], settings["gpgcheck"]))
+    log.info(f"Using local RPM repository {repo_dir} (priority {settings['priority']}, exclusive={settings['exclusive']}).")
+    return True
@@ -1,14 +1,25 @@
 # Fedora-AutoEnv-Setup/scripts/main_menu.py
 
 import sys
-from typing import Dict
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
 from scripts import console_output as con
+from scripts import dnf_planner
+from scripts import exec_trace
+from scripts import local_rpm_repo
+from scripts import phase_fingerprints
+from scripts import prefetch
+from scripts import run_planner
+from scripts import step_checkpoints
+from scripts import system_utils as util
+from scripts import task_scheduler as ts
 from scripts.config import PHASES, app_logger
-from scripts.phase_manager import are_dependencies_met, mark_phase_complete
+from scripts.phase_manager import are_dependencies_met, mark_phase_complete, step_progress
 
 
-def display_main_menu(phase_status: Dict[str, bool]):
+def display_main_menu(phase_status: Dict[str, bool], prefetcher: Optional[prefetch.DnfPrefetcher] = None):
     """Displays the main menu of available phases."""
     con.print_step("Fedora AutoEnv Setup - Main Menu", char="*")
     con.print_info("Select a phase to run, or 'q' to quit.")
@@ -33,6 +44,9 @@ def display_main_menu(phase_status: Dict[str, bool]):
             status_text = f"[bold yellow](Locked - Needs: {deps_str})[/]"
         else:
             status_text = "[cyan](Available)[/]"
+            steps_done, steps_total = step_progress(phase_id)
+            if steps_done:
+                status_text = f"[cyan](Available - {steps_done}/{steps_total} steps done)[/]"
 
         menu_label = f"{item_number}. {phase_info['name']} {status_text}"
         con.console.print(menu_label)
@@ -43,20 +57,194 @@ def display_main_menu(phase_status: Dict[str, bool]):
         item_number += 1
 
     con.print_rule()
+    if prefetcher is not None and prefetcher.enabled:
+        for line in prefetcher.status_lines():
+            con.console.print(f"[dim]  ⇣ {line}[/]")
+        con.print_rule()
+    if not all(phase_status.get(phase_id, False) for phase_id in PHASES):
+        con.console.print(" a. Run all pending phases (one combined DNF transaction, independent phases in parallel)")
+    prefetch_state = "on" if prefetcher is not None and prefetcher.enabled else "off"
+    con.console.print(f" p. Toggle background package prefetch (currently {prefetch_state})")
+    con.console.print(" r. Build/update the local RPM repository for all phases")
     con.console.print(" q. Quit")
     return menu_items
 
+def _queue_prefetch(prefetcher: prefetch.DnfPrefetcher, app_config: Dict, phase_status: Dict[str, bool]):
+    """Queues download-only prefetches for the phases that could run now."""
+    runnable = [
+        phase_id for phase_id in PHASES
+        if not phase_status.get(phase_id, False) and are_dependencies_met(phase_id, phase_status)
+    ]
+    prefetcher.queue_phases(app_config, runnable)
+
+def _settle_prefetch(prefetcher: prefetch.DnfPrefetcher):
+    """Stops queued prefetches and waits for a running download before a phase uses dnf."""
+    if prefetcher.is_busy():
+        con.print_info("Waiting for the background package download to finish...")
+    waited_for = prefetcher.settle()
+    if waited_for is not None:
+        con.print_info(f"Background download finished: {waited_for.describe()}")
+
+def build_local_rpm_repo(app_config: Dict):
+    """Downloads the packages of every phase into the configured local repository for other machines."""
+    repo_path = local_rpm_repo.get_local_repo_config(app_config)["path"]
+    if not repo_path:
+        repo_path = con.ask_question("Directory for the local RPM repository:", default="/srv/autoenv-rpms")
+    con.print_step(f"Building local RPM repository in {repo_path}")
+    with exec_trace.trace_span("build_local_rpm_repo", "phase"):
+        ok = local_rpm_repo.build_local_repo(
+            app_config, list(PHASES), Path(repo_path),
+            print_fn_info=con.print_info,
+            print_fn_error=con.print_error,
+            print_fn_sub_step=con.print_sub_step,
+            logger=app_logger
+        )
+    if ok:
+        con.print_success(f"Local RPM repository is ready. Set 'local_rpm_repo.path' to {repo_path} and 'enabled' to true on the other machines.")
+    else:
+        con.print_error("Building the local RPM repository failed.")
+
+def run_all_pending_phases(app_config: Dict, phase_status: Dict[str, bool], prefetcher: Optional[prefetch.DnfPrefetcher] = None):
+    """
+    Runs every phase not yet complete, in dependency order. Their DNF work is done up front as a
+    single combined transaction, so the handlers then find their packages already installed;
+    after that, phases whose dependencies are complete run concurrently.
+    """
+    pending = [phase_id for phase_id in PHASES if not phase_status.get(phase_id, False)]
+    if not pending:
+        con.print_info("All phases are already complete.")
+        return
+    run_phases(app_config, phase_status, pending, prefetcher)
+
+def run_phases(
+    app_config: Dict,
+    phase_status: Dict[str, bool],
+    phase_ids: List[str],
+    prefetcher: Optional[prefetch.DnfPrefetcher] = None
+) -> Dict[str, ts.TaskResult]:
+    """
+    Runs phase_ids (complete or not) as run-all does: one combined DNF transaction, then the
+    phases as a dependency graph. Returns each phase's result ('skipped' if a dependency did
+    not complete).
+    """
+    if prefetcher is not None:
+        _settle_prefetch(prefetcher)
+    util.ensure_privileged_workers(app_logger) # Ask for the password once, before the phases run concurrently
+
+    con.print_step("Combined DNF transaction for all pending phases")
+    with exec_trace.trace_span("combined_dnf_transaction", "phase"):
+        plan = dnf_planner.collect_dnf_work(app_config, phase_ids, logger=app_logger)
+        con.print_info(f"Planned DNF work: {plan.describe()}.")
+        started_at, start = time.time(), time.monotonic()
+        dnf_results = dnf_planner.execute_plan(
+            plan,
+            print_fn_info=con.print_info,
+            print_fn_error=con.print_error,
+            print_fn_sub_step=con.print_sub_step,
+            logger=app_logger
+        )
+    if not plan.is_empty():
+        run_planner.record_dnf_throughput(started_at, time.monotonic() - start, app_logger) # ETA history for --plan
+    for phase_id, ok in dnf_results.items():
+        if not ok:
+            con.print_warning(f"DNF work for '{PHASES[phase_id]['name']}' is incomplete; the phase will retry it.")
+
+    return _run_phase_graph(app_config, phase_status, phase_ids)
+
+def _run_phase(phase_id: str, app_config: Dict, phase_status: Dict[str, bool]) -> bool:
+    phase_info = PHASES[phase_id]
+    con.print_info(f"\nStarting '{phase_info['name']}'...")
+    with exec_trace.trace_span(phase_id, "phase"):
+        success = phase_info["handler"](app_config)
+    if success:
+        step_records = step_checkpoints.phase_records(phase_id, app_logger) # Cleared by mark_phase_complete
+        mark_phase_complete(phase_id, phase_status)
+        phase_fingerprints.record(phase_id, app_config, step_records, app_logger)
+    else:
+        con.print_error(f"'{phase_info['name']}' encountered an error or was not fully completed.")
+    return bool(success)
+
+def _run_phase_graph(app_config: Dict, phase_status: Dict[str, bool], pending: List[str]) -> Dict[str, ts.TaskResult]:
+    """
+    Runs the pending phases as a dependency graph: a phase starts as soon as all of its
+    dependencies are complete, so phases that do not depend on each other run concurrently.
+    A failed phase skips only the phases that depend on it (directly or transitively).
+    """
+    tasks: List[ts.PhaseTask] = []
+    not_runnable: Dict[str, ts.TaskResult] = {}
+    for phase_id in pending: # PHASES order lists dependencies before their dependents
+        unmet = [dep_id for dep_id in PHASES[phase_id]["dependencies"] if not phase_status.get(dep_id, False)]
+        if any(dep_id not in (task.name for task in tasks) for dep_id in unmet):
+            con.print_warning(f"Skipping '{PHASES[phase_id]['name']}': dependencies not met.")
+            not_runnable[phase_id] = ts.TaskResult(phase_id, "skipped")
+            continue
+        tasks.append(ts.PhaseTask(
+            phase_id, lambda phase_id=phase_id: _run_phase(phase_id, app_config, phase_status), after=unmet
+        ))
+    if not tasks:
+        return not_runnable
+
+    results = ts.run_tasks(tasks, max_workers=len(tasks), logger=app_logger)
+    for phase_id, result in results.items():
+        if result.status == "skipped":
+            blocked_by = [PHASES[dep_id]["name"] for dep_id in PHASES[phase_id]["dependencies"] if not phase_status.get(dep_id, False)]
+            con.print_warning(f"Skipped '{PHASES[phase_id]['name']}': {', '.join(blocked_by)} did not complete.")
+        elif result.error is not None:
+            con.print_error(f"'{PHASES[phase_id]['name']}' failed: {result.error}")
+    results.update(not_runnable)
+    return results
+
+def prepare_rerun(phase_id: str, app_config: Dict, assume_yes: bool = False) -> Tuple[bool, str]:
+    """
+    Decides how to run a phase that is already complete, from its fingerprint. Returns whether
+    to run it and its freshness (phase_fingerprints.UP_TO_DATE, ...). When only its config
+    changed, the steps of the last run are restored so only the changed steps run.
+    assume_yes answers the "run anyway?" questions with yes.
+    """
+    phase_name = PHASES[phase_id]["name"]
+    freshness = phase_fingerprints.check(phase_id, app_config, app_logger)
+    if freshness == phase_fingerprints.UP_TO_DATE:
+        con.print_success(f"'{phase_name}' is up to date: its configuration and the installed state are unchanged.")
+        return assume_yes or con.confirm_action("Run it again anyway?", default=False), freshness
+    if freshness == phase_fingerprints.CONFIG_CHANGED:
+        con.print_info(f"The configuration of '{phase_name}' changed; only the changed steps will run.")
+        phase_fingerprints.restore_steps(phase_id, app_logger)
+        return True, freshness
+    if freshness == phase_fingerprints.STATE_CHANGED:
+        con.print_info(f"The installed state of '{phase_name}' changed since it completed; running it again.")
+        return True, freshness
+    return assume_yes or con.confirm_action(f"'{phase_name}' is already marked as complete. Run again?", default=False), freshness
+
 def main_menu_handler(app_config: Dict, phase_status: Dict[str, bool]):
     """Handles the main menu interaction loop."""
+    prefetcher = prefetch.DnfPrefetcher(app_logger)
     while True:
-        menu_options = display_main_menu(phase_status)
-        valid_choices = list(menu_options.keys()) + ['q', 'Q']
+        if prefetcher.enabled:
+            _queue_prefetch(prefetcher, app_config, phase_status)
+        menu_options = display_main_menu(phase_status, prefetcher)
+        valid_choices = list(menu_options.keys()) + ['a', 'A', 'p', 'P', 'r', 'R', 'q', 'Q']
 
         choice = con.ask_question("Enter your choice:", choices=valid_choices).lower()
 
         if choice == 'q':
+            prefetcher.settle() # Don't cut off a download holding the dnf lock
             con.print_info("Exiting Fedora AutoEnv Setup. Bye!")
             break
+        elif choice == 'p':
+            prefetcher.enabled = not prefetcher.enabled
+            if prefetcher.enabled:
+                con.print_info("Background prefetch enabled: packages for runnable phases will download while you choose.")
+            else:
+                prefetcher.settle()
+                con.print_info("Background prefetch disabled.")
+        elif choice == 'r':
+            _settle_prefetch(prefetcher)
+            build_local_rpm_repo(app_config)
+        elif choice == 'a':
+            run_all_pending_phases(app_config, phase_status, prefetcher)
+            if not con.confirm_action("Return to main menu?", default=True):
+                con.print_info("Exiting Fedora AutoEnv Setup. Bye!")
+                break
         elif choice in menu_options:
             phase_to_run_id = menu_options[choice]
             phase_to_run_info = PHASES[phase_to_run_id]
@@ -67,17 +255,11 @@ def main_menu_handler(app_config: Dict, phase_status: Dict[str, bool]):
                 continue
 
             if phase_status.get(phase_to_run_id, False):
-                if not con.confirm_action(f"'{phase_to_run_info['name']}' is already marked as complete. Run again?", default=False):
+                if not prepare_rerun(phase_to_run_id, app_config)[0]:
                     continue
 
-            con.print_info(f"\nStarting '{phase_to_run_info['name']}'...")
-
-            success = phase_to_run_info["handler"](app_config)
-
-            if success:
-                mark_phase_complete(phase_to_run_id, phase_status)
-            else:
-                con.print_error(f"'{phase_to_run_info['name']}' encountered an error or was not fully completed.")
+            _settle_prefetch(prefetcher)
+            _run_phase(phase_to_run_id, app_config, phase_status)
 
             if not con.confirm_action("Return to main menu?", default=True):
                 con.print_info("Exiting Fedora AutoEnv Setup. Bye!")
@@ -0,0 +1,291 @@
+# Fedora-AutoEnv-Setup/scripts/package_index.py
+
+# In-memory index of installed RPM packages, built from a single snapshot of the rpm database:
+# read in-process from rpmdb.sqlite when possible (scripts/rpmdb_sqlite.py), otherwise from one
+# `rpm -qa`. Phases ask "is X installed?" for dozens of names; the index answers each in O(1)
+# instead of spawning one `rpm -q` per package. After a DNF transaction the index refreshes only the
+# packages the transaction named; names it has not seen since then are confirmed with a
+# targeted `rpm -q` on first lookup, so dependencies pulled in by the transaction are not missed.
+# Each install root (see install_root) has its own index, over the rpm database inside the root.
+
+import contextvars
+import logging
+import re
+import sqlite3
+import subprocess
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set
+
+from scripts import command_cache
+from scripts import exec_trace
+from scripts import install_root
+from scripts import rpmdb_sqlite
+
+# One line per package: name, epoch, version, release, arch, then the space-separated provides
+RPM_QUERY_FORMAT = "%{NAME}\\t%{EPOCHNUM}\\t%{VERSION}\\t%{RELEASE}\\t%{ARCH}\\t[%{PROVIDENAME} ]\\n"
+
+_module_logger = logging.getLogger(__name__)
+
+
+class PackageRecord(NamedTuple):
+    """One installed package as recorded in the rpm database."""
+    name: str
+    epoch: int
+    version: str
+    release: str
+    arch: str
+    provides: tuple
+
+    @property
+    def nevra(self) -> str:
+        epoch = f"{self.epoch}:" if self.epoch else ""
+        return f"{self.name}-{epoch}{self.version}-{self.release}.{self.arch}"
+
+    def aliases(self) -> List[str]:
+        """The spellings `rpm -q` accepts for this package besides the bare name."""
+        vr = f"{self.version}-{self.release}"
+        return [
+            f"{self.name}.{self.arch}",
+            f"{self.name}-{self.version}",
+            f"{self.name}-{vr}",
+            f"{self.name}-{vr}.{self.arch}",
+            f"{self.name}-{self.epoch}:{vr}",
+            f"{self.name}-{self.epoch}:{vr}.{self.arch}",
+        ]
+
+
+def parse_query_output(output: str) -> List[PackageRecord]:
+    """Parses RPM_QUERY_FORMAT output. Lines without the expected fields (e.g. 'package x is not installed') are ignored."""
+    records = []
+    for line in output.splitlines():
+        fields = line.split("\t")
+        if len(fields) != 6 or not fields[0]:
+            continue
+        name, epoch, version, release, arch, provides = fields
+        records.append(PackageRecord(
+            name=name,
+            epoch=int(epoch) if epoch.isdigit() else 0,
+            version=version,
+            release=release,
+            arch=arch,
+            provides=tuple(provides.split()),
+        ))
+    return records
+
+def _query_rpm(specs: Optional[List[str]], logger: logging.Logger, root: Optional[Path] = None) -> List[PackageRecord]:
+    """Runs one rpm query (-qa when specs is None). Raises FileNotFoundError if rpm is missing."""
+    cmd = ["rpm", "-qa"] if specs is None else ["rpm", "-q"]
+    if root is not None:
+        cmd.append(f"--root={root}")
+    cmd += ["--queryformat", RPM_QUERY_FORMAT] + (specs or [])
+    display = " ".join(cmd[:2]) + (f" ({len(specs)} packages)" if specs else "")
+    logger.debug(f"Querying rpm database: {display}")
+    timer = exec_trace.command_timer()
+    try:
+        # Not run through run_command: this is the index's own cache fill, and rpm -q exits
+        # non-zero whenever one of the specs is not installed.
+        proc = subprocess.run(cmd, capture_output=True, text=True, check=False)
+    except FileNotFoundError:
+        exec_trace.record_command(timer, display, None, None, "spawn")
+        raise
+    exec_trace.record_command(timer, display, proc.returncode, None, "spawn")
+    if specs is None and proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output=proc.stdout, stderr=proc.stderr)
+    return parse_query_output(proc.stdout)
+
+def _candidate_names(spec: str) -> List[str]:
+    """Package names spec could refer to: itself, or a prefix ending before a '-' or '.' (name-version, name.arch)."""
+    return [spec] + [spec[:match.start()] for match in re.finditer(r"[-.]", spec) if match.start() > 0]
+
+
+class InstalledPackageIndex:
+    """Name, NEVRA and provides lookups over the installed package set, shared by all phases."""
+
+    def __init__(self, logger: Optional[logging.Logger] = None, db_path: Optional[Path] = None, use_sqlite: bool = True, root: Optional[Path] = None):
+        self._log = logger or _module_logger
+        self.root = root
+        if db_path is None and root is not None:
+            db_path = install_root.path(rpmdb_sqlite.RPMDB_SQLITE_PATH, root)
+        self._sqlite = rpmdb_sqlite.RpmdbSqliteReader(db_path) if use_sqlite else None
+        self.backend = "sqlite" if use_sqlite else "rpm"
+        self._lock = threading.RLock()
+        self._records: Dict[str, List[PackageRecord]] = {}
+        self._aliases: Dict[str, str] = {}
+        self._provides: Dict[str, Set[str]] = {}
+        self._loaded = False
+        self._verify_misses = False # True after an incremental refresh: negatives may be deps we never queried
+        self._confirmed_missing: Set[str] = set()
+        self.full_loads = 0
+        self.incremental_refreshes = 0
+
+    # --- Loading ---
+
+    def _read(self, specs: Optional[List[str]]) -> List[PackageRecord]:
+        """Reads all packages (specs=None) or those matching specs, from sqlite or the rpm CLI."""
+        if self.root is not None and not install_root.path(rpmdb_sqlite.RPMDB_SQLITE_PATH.parent, self.root).is_dir():
+            return [] # A root dnf has not populated yet: nothing installed, and no database to query
+        if self._sqlite is not None:
+            try:
+                with exec_trace.trace_span("rpmdb_sqlite_read", "query", packages=len(specs) if specs else "all"):
+                    if specs is None:
+                        rows = self._sqlite.read_all()
+                    else:
+                        rows = self._sqlite.read_names([name for spec in specs for name in _candidate_names(spec)])
+                return [PackageRecord._make(row) for row in rows]
+            except (OSError, sqlite3.Error, rpmdb_sqlite.RpmdbSchemaError) as e:
+                self._log.warning(f"Cannot read the rpm database directly ({e}); using the rpm CLI instead.")
+                self._sqlite = None
+                self.backend = "rpm"
+        return _query_rpm(specs, self._log, self.root)
+
+    def load(self, records: Optional[Iterable[PackageRecord]] = None) -> None:
+        """Replaces the index contents with records, or with a fresh snapshot of the rpm database."""
+        if records is None:
+            records = self._read(None)
+        with self._lock:
+            self._records, self._aliases, self._provides = {}, {}, {}
+            for record in records:
+                self._add(record)
+            self._loaded = True
+            self._verify_misses = False
+            self._confirmed_missing.clear()
+            self.full_loads += 1
+            self._log.info(f"Installed package index loaded: {len(self._records)} packages (via {self.backend}).")
+
+    def _add(self, record: PackageRecord) -> None:
+        self._records.setdefault(record.name, []).append(record)
+        for alias in record.aliases():
+            self._aliases[alias] = record.name
+        for capability in record.provides:
+            self._provides.setdefault(capability, set()).add(record.name)
+
+    def _drop(self, name: str) -> None:
+        for record in self._records.pop(name, []):
+            for alias in record.aliases():
+                if self._aliases.get(alias) == name:
+                    del self._aliases[alias]
+            for capability in record.provides:
+                providers = self._provides.get(capability)
+                if providers is not None:
+                    providers.discard(name)
+                    if not providers:
+                        del self._provides[capability]
+
+    def _ensure_loaded(self) -> None:
+        with self._lock:
+            if not self._loaded:
+                self.load()
+
+    def mark_stale(self) -> None:
+        """Forces a full snapshot on the next lookup (e.g. after group installs or --allowerasing)."""
+        with self._lock:
+            if self._loaded:
+                self._log.debug("Installed package index marked stale.")
+            self._loaded = False
+
+    def refresh_packages(self, specs: Iterable[str]) -> None:
+        """Re-reads only the given packages from the rpm database (installed, upgraded or removed)."""
+        specs = [spec for spec in dict.fromkeys(specs) if spec]
+        if not specs:
+            return
+        with self._lock:
+            if not self._loaded:
+                return # The next lookup takes a full snapshot anyway
+            fresh = self._read(specs)
+            for spec in specs:
+                self._drop(self._aliases.get(spec, spec))
+            for name in {record.name for record in fresh}:
+                self._drop(name)
+            for record in fresh:
+                self._add(record)
+            self.incremental_refreshes += 1
+
+    @contextmanager
+    def transaction(self, specs: Optional[Iterable[str]] = None) -> Iterator[None]:
+        """
+        Wraps a DNF transaction touching specs. On exit those packages are refreshed incrementally;
+        with specs=None (groups, upgrades, --allowerasing) the index is marked stale instead.
+        """
+        token = _expected_transaction.set(True)
+        try:
+            yield
+        finally:
+            _expected_transaction.reset(token)
+            if specs is None:
+                self.mark_stale()
+            else:
+                try:
+                    self.refresh_packages(list(specs))
+                    with self._lock:
+                        self._verify_misses = True
+                        self._confirmed_missing.clear()
+                except (OSError, subprocess.SubprocessError) as e:
+                    self._log.warning(f"Incremental package index refresh failed ({e}); marking index stale.")
+                    self.mark_stale()
+
+    # --- Lookups ---
+
+    def is_installed(self, spec: str) -> bool:
+        """True if spec (name, name.arch, name-version[-release][.arch] or NEVRA) is installed."""
+        self._ensure_loaded()
+        with self._lock:
+            if spec in self._records or spec in self._aliases:
+                return True
+            if not self._verify_misses or spec in self._confirmed_missing:
+                return False
+        self.refresh_packages([spec])
+        with self._lock:
+            found = spec in self._records or spec in self._aliases
+            if not found:
+                self._confirmed_missing.add(spec)
+            return found
+
+    def satisfies(self, spec: str) -> bool:
+        """True if spec is installed by name/NEVRA or provided by an installed package (as dnf resolves it)."""
+        return self.is_installed(spec) or bool(self.what_provides(spec))
+
+    def get(self, name: str) -> List[PackageRecord]:
+        """All installed records for a name (several for multilib or kernel packages)."""
+        self._ensure_loaded()
+        with self._lock:
+            return list(self._records.get(self._aliases.get(name, name), []))
+
+    def what_provides(self, capability: str) -> Set[str]:
+        """Names of installed packages providing capability."""
+        self._ensure_loaded()
+        with self._lock:
+            return set(self._provides.get(capability, set()))
+
+    def names(self) -> Set[str]:
+        self._ensure_loaded()
+        with self._lock:
+            return set(self._records)
+
+
+# Set while a helper runs a transaction it will refresh itself, so the generic hook below does not
+# throw the whole index away.
+_expected_transaction: contextvars.ContextVar[bool] = contextvars.ContextVar("expected_rpm_transaction", default=False)
+
+_indexes: Dict[str, InstalledPackageIndex] = {} # install_root.key() -> index
+_index_lock = threading.Lock()
+
+
+def get_installed_package_index(logger: Optional[logging.Logger] = None) -> InstalledPackageIndex:
+    """Returns the index of the targeted install root shared by all phases for this run (loaded lazily on first lookup)."""
+    with _index_lock:
+        root_key = install_root.key()
+        if root_key not in _indexes:
+            _indexes[root_key] = InstalledPackageIndex(logger, root=install_root.current())
+        return _indexes[root_key]
+
+def _on_rpmdb_changed() -> None:
+    # Any rpm-changing command run_command saw outside a helper transaction (custom repo shell
+    # commands, rpm --import, ...) may have changed anything: resnapshot lazily. The command
+    # ran in the caller's context, so only the targeted root's index is affected.
+    index = _indexes.get(install_root.key())
+    if index is not None and not _expected_transaction.get():
+        index.mark_stale()
+
+command_cache.query_cache.register_invalidation_hook("rpm", _on_rpmdb_changed)
@@ -0,0 +1,150 @@
+# Fedora-AutoEnv-Setup/scripts/phase_fingerprints.py
+
+# make-style "is this phase up to date?" for phases that are already complete. When a phase
+# completes, two hashes are stored next to the phase status, in install_fingerprints.json:
+#   config  the phase's packages.json section
+#   state   the installed-state facts that section depends on: which of its packages and
+#           Flatpak apps are installed, the dnf.conf it manages
+# together with the facts themselves and the step checkpoints the run left (see
+# step_checkpoints). Running the phase again then compares fresh values against the stored ones:
+#   both equal      -> up to date, nothing to do
+#   only config     -> the stored step checkpoints are restored, so only the steps whose
+#                      entries changed run (the helpers skip what is already installed)
+#   state changed   -> a recorded fact no longer holds (a package was removed, dnf.conf was
+#                      edited): the whole phase runs again; each step still only applies the delta
+# The state facts come from the per-run package and Flatpak indexes, so the check is one
+# rpmdb read and at most one `flatpak list`.
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from scripts import dnf_config
+from scripts import flatpak_index
+from scripts import install_root
+from scripts import package_index
+from scripts import state_files
+from scripts import step_checkpoints
+from scripts import system_utils as util
+from scripts.config import FINGERPRINTS_FILE_PATH, PHASES
+
+UP_TO_DATE = "up_to_date"
+CONFIG_CHANGED = "config_changed"
+STATE_CHANGED = "state_changed"
+UNKNOWN = "unknown" # No fingerprint recorded (never completed with fingerprinting, or file lost)
+
+_module_logger = logging.getLogger(__name__)
+
+_fingerprints_lock = threading.RLock()
+
+
+def _hash(value: Any) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+def _is_dnf_key(key: str) -> bool:
+    """Section keys that describe DNF work (only observed for phases that do it)."""
+    return key in ("dnf_packages", "custom_repo_dnf_packages") or key.startswith(("dnf_swap_", "dnf_groups_"))
+
+def _section_packages(section: Dict) -> list:
+    """Every package name whose presence the section's DNF steps depend on."""
+    packages = list(section.get("dnf_packages", []))
+    for key, value in section.items():
+        if key.startswith("dnf_swap_") and isinstance(value, dict):
+            packages += [pkg for pkg in (value.get("from"), value.get("to")) if pkg]
+    for entry in section.get("custom_repo_dnf_packages", {}).values():
+        packages += [pkg for pkg in (entry.get("check_if_installed_pkg"), entry.get("dnf_package_to_install")) if pkg]
+    return sorted(set(packages))
+
+def observed_state(section: Dict, logger: Optional[logging.Logger] = None) -> Dict[str, Any]:
+    """The installed-state facts of one packages.json phase section, keyed "<kind>:<name>"."""
+    log = logger or _module_logger
+    facts: Dict[str, Any] = {}
+
+    packages = _section_packages(section)
+    if packages:
+        index = package_index.get_installed_package_index(log)
+        facts.update({f"rpm:{pkg}": index.is_installed(pkg) for pkg in packages})
+    # DNF groups have no cheap installed-state query; they are covered by the config hash only
+
+    flatpak_apps = section.get("flatpak_apps", {})
+    if flatpak_apps:
+        try:
+            installed = flatpak_index.get_flatpak_index(log).installed_app_ids()
+        except FileNotFoundError:
+            installed = set()
+        facts.update({f"flatpak:{app_id}": app_id in installed for app_id in flatpak_apps})
+
+    if section.get("dnf_config"):
+        conf_path = install_root.path("/") / dnf_config.DNF_CONF_RELATIVE_PATH
+        try:
+            facts["file:dnf.conf"] = _hash(conf_path.read_text(encoding="utf-8"))
+        except OSError:
+            facts["file:dnf.conf"] = None
+
+    return facts
+
+def compute(phase_id: str, app_config: Dict, logger: Optional[logging.Logger] = None) -> Dict[str, Any]:
+    """Fresh fingerprint of a phase: {"config": hash, "state": hash, "facts": observed_state}."""
+    section = app_config.get(PHASES[phase_id].get("config_section", ""), {})
+    observed = section if PHASES[phase_id].get("dnf_work") else {key: value for key, value in section.items() if not _is_dnf_key(key)}
+    facts = observed_state(observed, logger)
+    return {"config": _hash(section), "state": _hash(facts), "facts": facts}
+
+def _fingerprints_file_path() -> Path:
+    return install_root.state_path(FINGERPRINTS_FILE_PATH)
+
+def _load(log: logging.Logger) -> Dict[str, Dict]:
+    fingerprints_path = _fingerprints_file_path()
+    with _fingerprints_lock:
+        if not fingerprints_path.exists():
+            return {}
+        try:
+            with open(fingerprints_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            log.warning(f"Could not load phase fingerprints '{fingerprints_path.name}': {e}.")
+            return {}
+    return data if isinstance(data, dict) else {}
+
+def _save(data: Dict[str, Dict], log: logging.Logger) -> None:
+    fingerprints_path = _fingerprints_file_path()
+    try:
+        state_files.write_json_atomic(fingerprints_path, data)
+    except (IOError, OSError) as e:
+        log.error(f"Could not save phase fingerprints '{fingerprints_path.name}': {e}")
+
+def record(phase_id: str, app_config: Dict, step_records: Dict[str, Dict], logger: Optional[logging.Logger] = None) -> None:
+    """Stores the fingerprint of a phase that just completed, with the step checkpoints of that run."""
+    log = logger or _module_logger
+    fingerprint = compute(phase_id, app_config, log)
+    with _fingerprints_lock:
+        data = _load(log)
+        data[phase_id] = dict(fingerprint, steps=step_records, recorded_at=time.time())
+        _save(data, log)
+    log.info(f"Recorded fingerprint of '{phase_id}': config {fingerprint['config']}, state {fingerprint['state']}.")
+
+def check(phase_id: str, app_config: Dict, logger: Optional[logging.Logger] = None) -> str:
+    """Compares the phase's current fingerprint with the recorded one (UP_TO_DATE, CONFIG_CHANGED, ...)."""
+    log = logger or _module_logger
+    stored = _load(log).get(phase_id)
+    if not stored:
+        return UNKNOWN
+    current = compute(phase_id, app_config, log)
+    if current["config"] == stored.get("config"):
+        return UP_TO_DATE if current["state"] == stored.get("state") else STATE_CHANGED
+    # Entries added to the config are not installed yet, which is the delta to apply, not drift
+    stored_facts = stored.get("facts", {})
+    if any(key in current["facts"] and current["facts"][key] != value for key, value in stored_facts.items()):
+        return STATE_CHANGED
+    return CONFIG_CHANGED
+
+def restore_steps(phase_id: str, logger: Optional[logging.Logger] = None) -> None:
+    """Seeds the phase's step checkpoints with those of its last complete run (for CONFIG_CHANGED)."""
+    log = logger or _module_logger
+    steps = _load(log).get(phase_id, {}).get("steps", {})
+    if steps:
+        step_checkpoints.restore_phase(phase_id, steps, log)
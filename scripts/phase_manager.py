@@ -1,41 +1,59 @@
 # Fedora-AutoEnv-Setup/scripts/phase_manager.py
 
 import json
+import threading
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Tuple
 
 from scripts import console_output as con
+from scripts import install_root
+from scripts import state_files
+from scripts import step_checkpoints
 from scripts.config import PHASES, STATUS_FILE_PATH, app_logger
 
+# Phases run concurrently by "run all" finish on worker threads; updates to the shared status
+# dict and the status file go through this lock.
+_status_lock = threading.RLock()
+
+def _status_file_path() -> Path:
+    """The status file of the targeted install root (STATUS_FILE_PATH for the live system)."""
+    return install_root.state_path(STATUS_FILE_PATH)
 
 def load_phase_status() -> Dict[str, bool]:
     """Loads the completion status of phases from the status file."""
-    if STATUS_FILE_PATH.exists():
+    status_path = _status_file_path()
+    if status_path.exists():
         try:
-            with open(STATUS_FILE_PATH, 'r', encoding='utf-8') as f:
+            with open(status_path, 'r', encoding='utf-8') as f:
                 status = json.load(f)
                 for phase_id in PHASES:
                     if phase_id not in status:
                         status[phase_id] = False
                 return status
         except (json.JSONDecodeError, IOError) as e:
-            con.print_warning(f"Could not load status file '{STATUS_FILE_PATH.name}': {e}. Starting fresh.")
+            con.print_warning(f"Could not load status file '{status_path.name}': {e}. Starting fresh.")
             return {phase_id: False for phase_id in PHASES}
     return {phase_id: False for phase_id in PHASES}
 
 def save_phase_status(status: Dict[str, bool]):
-    """Saves the completion status of phases to the status file."""
-    try:
-        with open(STATUS_FILE_PATH, 'w', encoding='utf-8') as f:
-            json.dump(status, f, indent=4)
-    except IOError as e:
-        con.print_error(f"Could not save status file '{STATUS_FILE_PATH.name}': {e}")
+    """
+    Saves the completion status of phases to the status file. The file is replaced atomically,
+    so an interrupted save never leaves a truncated status file behind.
+    """
+    status_path = _status_file_path()
+    with _status_lock:
+        try:
+            state_files.write_json_atomic(status_path, dict(status))
+        except (IOError, OSError) as e:
+            con.print_error(f"Could not save status file '{status_path.name}': {e}")
 
 def mark_phase_complete(phase_id: str, status: Dict[str, bool]):
-    """Marks a phase as complete and saves the status."""
+    """Marks a phase as complete and saves the status. Safe to call from several threads."""
     if phase_id in status:
-        status[phase_id] = True
-        save_phase_status(status)
+        with _status_lock:
+            status[phase_id] = True
+            save_phase_status(status)
+        step_checkpoints.clear_phase(phase_id, app_logger) # A complete phase reruns from its first step
         con.print_success(f"'{PHASES[phase_id]['name']}' marked as complete.")
     else:
         con.print_warning(f"Attempted to mark unknown phase '{phase_id}' as complete.")
@@ -49,3 +67,8 @@ def are_dependencies_met(phase_id: str, status: Dict[str, bool]) -> bool:
         if not status.get(dep_id, False):
             return False
     return True
+
+def step_progress(phase_id: str) -> Tuple[int, int]:
+    """(finished steps, total steps) of a phase according to its step checkpoints."""
+    steps = PHASES[phase_id].get("steps", ())
+    return len(step_checkpoints.completed_steps(phase_id, app_logger) & set(steps)), len(steps)
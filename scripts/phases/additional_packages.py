@@ -1,9 +1,49 @@
 # Fedora-AutoEnv-Setup/scripts/phases/additional_packages.py
 
+from scripts import console_output as con
+from scripts import step_checkpoints
+from scripts import system_utils as util
+from scripts.config import app_logger
+
+STEP_NAMES = ("flatpak_apps",)
+
+def _install_flatpak_apps(flatpak_apps):
+    if flatpak_apps:
+        con.print_sub_step("Installing additional Flatpak applications...")
+        if not util.install_flatpak_apps(
+            apps_to_install=flatpak_apps,
+            logger=app_logger,
+            print_fn_info=con.print_info,
+            print_fn_error=con.print_error,
+            print_fn_sub_step=con.print_sub_step
+        ):
+            con.print_error("Failed to install some additional Flatpak applications.")
+            return False
+    return True
+
 def run(app_config):
     """
-    Phase 6: Additional Packages
+    Phase 5: Additional Packages.
+    Installs the user-selected Flatpak applications.
+    Each step is checkpointed, so a rerun after a failure only repeats the steps that failed.
     """
-    print("Running Phase 6: Additional Packages")
-    # Add phase logic here
+    con.print_step("Phase 5: Additional Packages")
+
+    try:
+        phase_config = app_config.get('phase5_additional_packages', {})
+        checkpoints = step_checkpoints.PhaseCheckpoints("additional_packages", app_logger, con.print_info)
+        all_ok = True
+
+        flatpak_apps = phase_config.get('flatpak_apps', {})
+        all_ok &= checkpoints.run_step("flatpak_apps", flatpak_apps, lambda: _install_flatpak_apps(flatpak_apps))
+
+        if not all_ok:
+            return False
+        con.print_success("Phase 5: Additional Packages completed successfully.")
+
+    except Exception as e:
+        con.print_error(f"An unexpected error occurred during Phase 5: {e}")
+        app_logger.error(f"Phase 5 failed with error: {e}", exc_info=True)
+        return False
+
     return True
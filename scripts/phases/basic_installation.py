@@ -1,114 +1,151 @@
 # Fedora-AutoEnv-Setup/scripts/phases/basic_installation.py
 
 from scripts import console_output as con
+from scripts import step_checkpoints
 from scripts import system_utils as util
+from scripts import task_scheduler as ts
 from scripts.config import app_logger
 
+STEP_NAMES = ("dnf_packages", "dnf_swap_ffmpeg", "dnf_groups_sound_video", "flatpak_apps", "ghostty_config")
+
+PRINT_FNS = {
+    "print_fn_info": con.print_info,
+    "print_fn_error": con.print_error,
+    "print_fn_sub_step": con.print_sub_step,
+}
+
+def _install_dnf_packages(dnf_packages):
+    con.print_sub_step("Installing base DNF packages...")
+    if not util.install_dnf_packages(packages=dnf_packages, logger=app_logger, **PRINT_FNS):
+        con.print_error("Failed to install some base DNF packages.")
+        return False
+    return True
+
+def _swap_ffmpeg(ffmpeg_swap):
+    con.print_sub_step("Swapping ffmpeg-free for ffmpeg...")
+    if not util.swap_dnf_packages(from_pkg=ffmpeg_swap.get('from'), to_pkg=ffmpeg_swap.get('to'), logger=app_logger, **PRINT_FNS):
+        con.print_error("Failed to swap ffmpeg packages.")
+        return False
+    return True
+
+def _install_sound_video_group(sound_video_group):
+    con.print_sub_step("Installing sound and video DNF group...")
+    if not util.install_dnf_groups(groups=sound_video_group, logger=app_logger, **PRINT_FNS):
+        con.print_error("Failed to install sound and video DNF group.")
+        return False
+    return True
+
+def _install_flatpak_apps(flatpak_apps):
+    con.print_sub_step("Installing Flatpak applications...")
+    if not util.install_flatpak_apps(apps_to_install=flatpak_apps, logger=app_logger, **PRINT_FNS):
+        con.print_error("Failed to install some Flatpak applications.")
+        return False
+    return True
+
+def _install_nerd_fonts(nerd_fonts):
+    con.print_sub_step("Installing Nerd Fonts...")
+    # This is a placeholder for the actual implementation
+    # You would need to implement a function to download and install fonts
+    con.print_warning("Nerd Fonts installation is not yet implemented.")
+    return True
+
+def _copy_ghostty_config(user):
+    con.print_sub_step("Copying ghostty configuration file...")
+    try:
+        home_dir = util.get_user_home_dir(user)
+        if home_dir:
+            config_dir = home_dir / ".config" / "ghostty"
+            util.ensure_dir_exists(config_dir, target_user=user, logger=app_logger)
+
+            source_path = "assets/ghostty.conf"
+            target_path = config_dir / "config"
+
+            util.run_command(
+                ["cp", source_path, str(target_path)],
+                logger=app_logger,
+                print_fn_info=con.print_info,
+                print_fn_error=con.print_error
+            )
+
+            util.run_command(
+                ["chown", util.owner_spec(user, logger=app_logger), str(target_path)],
+                logger=app_logger,
+                print_fn_info=con.print_info,
+                print_fn_error=con.print_error
+            )
+
+            con.print_success("Successfully copied ghostty configuration file.")
+    except Exception as e:
+        con.print_error(f"Failed to copy ghostty configuration file: {e}")
+    return True # Not fatal, as before
+
+def build_tasks(phase_config, user, checkpoints):
+    """
+    The steps of Phase 2 as scheduler tasks. DNF steps share the rpm lock and run in order;
+    Flatpak installs and the user-level file copy overlap with them.
+    Steps already done with the same inputs (see step_checkpoints) return at once, and steps
+    with nothing configured are recorded as done without a task.
+    """
+    tasks = []
+    dnf_steps = []
+
+    def add_step(step, inputs, fn, **task_args):
+        if not inputs:
+            checkpoints.mark_done(step, inputs)
+            return False
+        tasks.append(ts.PhaseTask(step, checkpoints.step(step, inputs, fn), **task_args))
+        return True
+
+    dnf_packages = phase_config.get('dnf_packages', [])
+    if add_step("dnf_packages", dnf_packages, lambda: _install_dnf_packages(dnf_packages),
+                resources=[ts.RESOURCE_RPM, ts.RESOURCE_NETWORK], critical=True):
+        dnf_steps.append("dnf_packages")
+
+    # Swap ffmpeg-free with ffmpeg (a failure is not fatal)
+    ffmpeg_swap = phase_config.get('dnf_swap_ffmpeg', {})
+    add_step("dnf_swap_ffmpeg", ffmpeg_swap, lambda: _swap_ffmpeg(ffmpeg_swap),
+             resources=[ts.RESOURCE_RPM, ts.RESOURCE_NETWORK], after=list(dnf_steps))
+
+    sound_video_group = phase_config.get('dnf_groups_sound_video', [])
+    add_step("dnf_groups_sound_video", sound_video_group, lambda: _install_sound_video_group(sound_video_group),
+             resources=[ts.RESOURCE_RPM, ts.RESOURCE_NETWORK], after=list(dnf_steps), critical=True)
+
+    # Flatpak apps (a failure is not fatal)
+    flatpak_apps = phase_config.get('flatpak_apps', {})
+    add_step("flatpak_apps", flatpak_apps, lambda: _install_flatpak_apps(flatpak_apps),
+             resources=[ts.RESOURCE_FLATPAK_SYSTEM, ts.RESOURCE_NETWORK])
+
+    nerd_fonts = phase_config.get('nerd_fonts_to_install', {})
+    if nerd_fonts:
+        tasks.append(ts.PhaseTask("nerd_fonts", lambda: _install_nerd_fonts(nerd_fonts)))
+
+    if user:
+        add_step("ghostty_config", {"user": user}, lambda: _copy_ghostty_config(user), resources=[ts.RESOURCE_USER_HOME])
+
+    return tasks
+
 def run(app_config):
     """
     Phase 2: Basic Installation.
     This phase is responsible for installing essential packages for the system.
+    Its steps run through the task scheduler, so steps that do not conflict overlap.
     """
     con.print_step("Phase 2: Basic Installation")
 
     try:
         # Retrieve the list of packages to install from the configuration
         phase_config = app_config.get('phase2_basic_configuration', {})
+        user = util.get_target_user()
 
-        # Install dnf packages
-        dnf_packages = phase_config.get('dnf_packages', [])
-        if dnf_packages:
-            con.print_sub_step("Installing base DNF packages...")
-            if not util.install_dnf_packages(
-                packages=dnf_packages,
-                logger=app_logger,
-                print_fn_info=con.print_info,
-                print_fn_error=con.print_error,
-                print_fn_sub_step=con.print_sub_step
-            ):
-                con.print_error("Failed to install some base DNF packages.")
-                return False
-
-        # Swap ffmpeg-free with ffmpeg
-        ffmpeg_swap = phase_config.get('dnf_swap_ffmpeg', {})
-        if ffmpeg_swap:
-            con.print_sub_step("Swapping ffmpeg-free for ffmpeg...")
-            if not util.swap_dnf_packages(
-                from_pkg=ffmpeg_swap.get('from'),
-                to_pkg=ffmpeg_swap.get('to'),
-                logger=app_logger,
-                print_fn_info=con.print_info,
-                print_fn_error=con.print_error,
-                print_fn_sub_step=con.print_sub_step
-            ):
-                con.print_error("Failed to swap ffmpeg packages.")
-                # This may not be a fatal error, so we can continue
-
-        # Install sound and video group
-        sound_video_group = phase_config.get('dnf_groups_sound_video', [])
-        if sound_video_group:
-            con.print_sub_step("Installing sound and video DNF group...")
-            if not util.install_dnf_groups(
-                groups=sound_video_group,
-                logger=app_logger,
-                print_fn_info=con.print_info,
-                print_fn_error=con.print_error,
-                print_fn_sub_step=con.print_sub_step
-            ):
-                con.print_error("Failed to install sound and video DNF group.")
-                return False
-
-        # Install flatpak apps
-        flatpak_apps = phase_config.get('flatpak_apps', {})
-        if flatpak_apps:
-            con.print_sub_step("Installing Flatpak applications...")
-            if not util.install_flatpak_apps(
-                apps_to_install=flatpak_apps,
-                logger=app_logger,
-                print_fn_info=con.print_info,
-                print_fn_error=con.print_error,
-                print_fn_sub_step=con.print_sub_step
-            ):
-                con.print_error("Failed to install some Flatpak applications.")
-                # This may not be a fatal error, so we can continue
-
-        # Install nerd fonts
-        nerd_fonts = phase_config.get('nerd_fonts_to_install', {})
-        if nerd_fonts:
-            con.print_sub_step("Installing Nerd Fonts...")
-            # This is a placeholder for the actual implementation
-            # You would need to implement a function to download and install fonts
-            con.print_warning("Nerd Fonts installation is not yet implemented.")
-
-        con.print_sub_step("Copying ghostty configuration file...")
-        try:
-            user = util.get_target_user()
-            if user:
-                home_dir = util.get_user_home_dir(user)
-                if home_dir:
-                    config_dir = home_dir / ".config" / "ghostty"
-                    util.ensure_dir_exists(config_dir, target_user=user, logger=app_logger)
-
-                    source_path = "assets/ghostty.conf"
-                    target_path = config_dir / "config"
-
-                    util.run_command(
-                        ["cp", source_path, str(target_path)],
-                        logger=app_logger,
-                        print_fn_info=con.print_info,
-                        print_fn_error=con.print_error
-                    )
-
-                    util.run_command(
-                        ["chown", f"{user}:{user}", str(target_path)],
-                        logger=app_logger,
-                        print_fn_info=con.print_info,
-                        print_fn_error=con.print_error
-                    )
-
-                    con.print_success("Successfully copied ghostty configuration file.")
-        except Exception as e:
-            con.print_error(f"Failed to copy ghostty configuration file: {e}")
+        checkpoints = step_checkpoints.PhaseCheckpoints("basic_installation", app_logger, con.print_info)
+        tasks = build_tasks(phase_config, user, checkpoints)
+        results = ts.run_tasks(tasks, logger=app_logger)
+
+        not_ok = [name for name, result in results.items() if not result.ok]
+        if not_ok:
+            app_logger.warning(f"Phase 2 steps that did not succeed: {', '.join(not_ok)}")
+        if not ts.all_critical_ok(tasks, results):
+            return False
 
         con.print_success("Phase 2: Basic Installation completed successfully.")
 
@@ -1,16 +1,39 @@
 # Fedora-AutoEnv-Setup/scripts/phases/gnome_configuration.py
-import json
+
+from scripts import console_output as con
+from scripts import step_checkpoints
+from scripts import system_utils as util
+from scripts.config import app_logger
+
+STEP_NAMES = ("flatpak_apps",)
+
+def _install_flatpak_apps(flatpak_apps):
+    if flatpak_apps:
+        con.print_sub_step("Installing GNOME Flatpak applications...")
+        if not util.install_flatpak_apps(
+            apps_to_install=flatpak_apps,
+            logger=app_logger,
+            print_fn_info=con.print_info,
+            print_fn_error=con.print_error,
+            print_fn_sub_step=con.print_sub_step
+        ):
+            con.print_error("Failed to install some GNOME Flatpak applications.")
+            return False # Not fatal for the phase, as in Phase 2, but the step is retried on the next run
+    return True
 
 def run(app_config):
     """
     Phase 4: GNOME Configuration
     """
     print("Running Phase 4: GNOME Configuration")
+    phase_config = app_config.get('phase3_gnome_configuration', {})
+    checkpoints = step_checkpoints.PhaseCheckpoints("gnome_configuration", app_logger, con.print_info)
 
-    with open('packages.json', 'r') as f:
-        packages = json.load(f)
+    # Install flatpak apps
+    flatpak_apps = phase_config.get('flatpak_apps', {})
+    checkpoints.run_step("flatpak_apps", flatpak_apps, lambda: _install_flatpak_apps(flatpak_apps))
 
-    gnome_extensions = packages.get('phase3_gnome_configuration', {}).get('gnome_extensions', {})
+    gnome_extensions = phase_config.get('gnome_extensions', {})
 
     if gnome_extensions:
         print("The following GNOME extensions are available:")
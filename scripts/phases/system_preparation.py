@@ -1,9 +1,47 @@
 # Fedora-AutoEnv-Setup/scripts/phases/system_preparation.py
 
 from scripts import console_output as con
+from scripts import dnf_config
+from scripts import step_checkpoints
 from scripts import system_utils as util
 from scripts.config import app_logger
 
+STEP_NAMES = ("dnf_config", "dnf_packages")
+
+def _configure_dnf(dnf_settings):
+    if not dnf_settings:
+        return True
+    con.print_sub_step("Configuring DNF...")
+    if not dnf_config.configure_dnf(
+        dnf_settings,
+        logger=app_logger,
+        print_fn_info=con.print_info,
+        print_fn_error=con.print_error,
+        print_fn_sub_step=con.print_sub_step
+    ):
+        con.print_error("Failed to apply the DNF configuration.")
+        return False
+    return True
+
+def _install_packages(packages_to_install):
+    if not packages_to_install:
+        con.print_warning("No packages listed for installation in Phase 1.")
+        return True
+
+    # install_dnf_packages skips the packages that are already installed (installed-package index)
+    con.print_sub_step("Installing system preparation packages...")
+    if not util.install_dnf_packages(
+        packages=packages_to_install,
+        logger=app_logger,
+        print_fn_info=con.print_info,
+        print_fn_error=con.print_error,
+        print_fn_sub_step=con.print_sub_step
+    ):
+        con.print_error("Failed to install some system preparation packages.")
+        return False
+    con.print_success("All system preparation packages are installed.")
+    return True
+
 def run(app_config):
     """
     Phase 1: System Preparation.
@@ -12,39 +50,19 @@ def run(app_config):
     con.print_step("Phase 1: System Preparation")
 
     try:
+        phase_config = app_config.get('phase1_system_preparation', {})
+
+        checkpoints = step_checkpoints.PhaseCheckpoints("system_preparation", app_logger, con.print_info)
+
+        # Configure DNF first so the installs below already use the download settings
+        dnf_settings = phase_config.get('dnf_config', {})
+        if not checkpoints.run_step("dnf_config", dnf_settings, lambda: _configure_dnf(dnf_settings)):
+            return False
+
         # Retrieve the list of packages to install from the configuration
-        packages_to_install = app_config.get('phase1_system_preparation', {}).get('dnf_packages', [])
-
-        if not packages_to_install:
-            con.print_warning("No packages listed for installation in Phase 1.")
-            return True
-
-        # Check which packages are already installed
-        con.print_sub_step("Checking for installed packages...")
-
-        needed_packages = []
-        for package in packages_to_install:
-            if not util.is_package_installed_rpm(package, logger=app_logger):
-                needed_packages.append(package)
-            else:
-                con.print_info(f"Package '{package}' is already installed.")
-
-        # Install the missing packages
-        if needed_packages:
-            con.print_sub_step("Installing missing packages...")
-            if util.install_dnf_packages(
-                packages=needed_packages,
-                logger=app_logger,
-                print_fn_info=con.print_info,
-                print_fn_error=con.print_error,
-                print_fn_sub_step=con.print_sub_step
-            ):
-                con.print_success("Successfully installed all required system preparation packages.")
-            else:
-                con.print_error("Failed to install some system preparation packages.")
-                return False
-        else:
-            con.print_success("All system preparation packages are already installed.")
+        packages_to_install = phase_config.get('dnf_packages', [])
+        if not checkpoints.run_step("dnf_packages", packages_to_install, lambda: _install_packages(packages_to_install)):
+            return False
 
     except Exception as e:
         con.print_error(f"An unexpected error occurred during Phase 1: {e}")
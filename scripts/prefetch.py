@@ -0,0 +1,117 @@
+# Fedora-AutoEnv-Setup/scripts/prefetch.py
+
+# Background download-only prefetch. While the main menu waits for input, a single worker thread
+# runs `dnf install --downloadonly` for each runnable phase in turn, so the real install later only
+# unpacks from the local cache. Downloads run one at a time because dnf serialises on its own lock.
+# Before a phase runs, settle() drops queued prefetches and waits for the one in progress, so a
+# download that is already underway is reused rather than started a second time.
+
+import contextvars
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+from scripts import dnf_planner
+from scripts import system_utils as util
+from scripts.config import PHASES
+
+_module_logger = logging.getLogger(__name__)
+
+_QUIET = lambda msg: None
+
+
+class PhasePrefetch:
+    """State of the prefetch for one phase."""
+
+    def __init__(self, phase_id: str):
+        self.phase_id = phase_id
+        self.status = "queued" # queued -> downloading -> done | failed | nothing to fetch
+        self.package_count = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.finished = threading.Event()
+
+    def describe(self) -> str:
+        label = PHASES[self.phase_id]["name"]
+        if self.status == "downloading":
+            return f"{label}: downloading {self.package_count} packages ({time.monotonic() - self.started_at:.0f}s)"
+        if self.status in ("done", "failed") and self.started_at is not None:
+            return f"{label}: {self.status} ({self.package_count} packages, {self.finished_at - self.started_at:.0f}s)"
+        return f"{label}: {self.status}"
+
+
+class DnfPrefetcher:
+    """Queues download-only DNF runs for phases and executes them on one background thread."""
+
+    def __init__(self, logger: Optional[logging.Logger] = None):
+        self._log = logger or _module_logger
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, PhasePrefetch] = {}
+        self._queue: List[str] = []
+        self._current: Optional[PhasePrefetch] = None
+        self._worker_running = False
+        self.enabled = False
+
+    def queue_phases(self, app_config: Dict, phase_ids: List[str]) -> None:
+        """Queues phases not prefetched yet and starts the worker thread if it is idle."""
+        with self._lock:
+            for phase_id in phase_ids:
+                if phase_id not in self._jobs:
+                    self._jobs[phase_id] = PhasePrefetch(phase_id)
+                    self._queue.append(phase_id)
+            if self._queue and not self._worker_running:
+                self._worker_running = True
+                # In the caller's context, so downloads go to the same install root as the phases
+                threading.Thread(target=contextvars.copy_context().run, args=(self._run_queue, app_config), name="dnf-prefetch", daemon=True).start()
+
+    def _run_queue(self, app_config: Dict) -> None:
+        while True:
+            with self._lock:
+                if not self._queue:
+                    self._current = None
+                    self._worker_running = False
+                    return
+                job = self._jobs[self._queue.pop(0)]
+                self._current = job
+            try:
+                plan = dnf_planner.collect_dnf_work(app_config, [job.phase_id], logger=self._log)
+                specs = list(plan.packages) + [to_pkg for _, to_pkg, _ in plan.swaps] + [f"@{group}" for group in plan.groups]
+                job.package_count = len(specs)
+                if not specs:
+                    job.status = "nothing to fetch"
+                else:
+                    job.status = "downloading"
+                    job.started_at = time.monotonic()
+                    ok = util.download_dnf_packages(specs, print_fn_info=_QUIET, print_fn_error=_QUIET, print_fn_sub_step=_QUIET, logger=self._log)
+                    job.finished_at = time.monotonic()
+                    job.status = "done" if ok else "failed"
+            except Exception as e:
+                self._log.warning(f"Prefetch for {job.phase_id} failed: {e}", exc_info=True)
+                job.status = "failed"
+            finally:
+                job.finished.set()
+
+    def settle(self) -> Optional[PhasePrefetch]:
+        """
+        Cancels queued prefetches and blocks until the running one (if any) finishes, so the caller
+        can use dnf. Cancelled phases can be queued again later. Returns the job that was waited for.
+        """
+        with self._lock:
+            for phase_id in self._queue:
+                del self._jobs[phase_id]
+            self._queue.clear()
+            current = self._current
+        if current is not None and not current.finished.is_set():
+            self._log.info(f"Waiting for the background download of {current.phase_id} to finish.")
+            current.finished.wait()
+            return current
+        return None
+
+    def is_busy(self) -> bool:
+        with self._lock:
+            return self._current is not None and not self._current.finished.is_set()
+
+    def status_lines(self) -> List[str]:
+        with self._lock:
+            return [job.describe() for job in self._jobs.values()]
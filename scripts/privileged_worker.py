@@ -0,0 +1,392 @@
+# Fedora-AutoEnv-Setup/scripts/privileged_worker.py
+
+# A long-lived helper process that executes commands and file operations on behalf of the
+# main script, so a run pays for one sudo handshake per identity instead of one per command.
+#
+# The same file holds both sides:
+#   * the client (PrivilegedWorker), used by system_utils.run_command and friends;
+#   * the server loop (_serve), which the client bootstraps inside `sudo python3 -I -c ...`.
+# The server half only uses the standard library, because it is sent to the child over
+# its stdin and executed there (the child may not be able to read this checkout, e.g.
+# a per-user worker when the repository lives under /root).
+#
+# Protocol: newline-delimited JSON over the child's stdin/stdout.
+#   request:  {"id": 1, "op": "run", "argv": [...], ...}
+#   replies:  {"id": 1, "type": "line", "stream": "stdout", "data": "..."}   (only for streamed runs)
+#             {"id": 1, "type": "result", "ok": true, ...}
+# Requests are served concurrently, one thread each, so callers on several threads
+# (or in an asyncio executor) do not queue behind each other.
+
+import atexit
+import json
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class WorkerUnavailableError(RuntimeError):
+    """The worker is not running or the request could not be sent; it is safe to fall back."""
+
+
+class PrivilegedWorkerError(RuntimeError):
+    """The worker died or failed while a request was in flight."""
+
+
+def wait_with_rusage(proc: subprocess.Popen) -> Tuple[int, Any]:
+    """
+    Reaps proc with os.wait4 and returns (returncode, struct_rusage): user/sys CPU and max RSS,
+    including grandchildren the child waited for (e.g. sudo -> dnf). Call it instead of
+    proc.wait()/communicate(), after the child's pipes are drained. The rusage is None if the
+    child was already reaped elsewhere.
+    Defined here because the worker must stay self-contained; system_utils uses it too.
+    """
+    try:
+        _, status, rusage = os.wait4(proc.pid, 0)
+    except ChildProcessError:
+        return proc.wait(), None
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return proc.returncode, rusage
+
+def communicate_with_rusage(proc: subprocess.Popen, input_text: Optional[str] = None) -> Tuple[Any, Any, Any]:
+    """
+    Like proc.communicate(input_text), but reaps the child with wait_with_rusage.
+    Returns (stdout, stderr, rusage); the output is None for streams that were not piped.
+    """
+    output: Dict[str, Any] = {"stdout": None, "stderr": None}
+
+    def _drain(name: str, stream) -> None:
+        with stream:
+            output[name] = stream.read()
+
+    # One reader per pipe so neither can block the child on a full pipe
+    readers = [threading.Thread(target=_drain, args=(name, stream), daemon=True)
+               for name, stream in (("stdout", proc.stdout), ("stderr", proc.stderr)) if stream is not None]
+    try:
+        for reader in readers:
+            reader.start()
+        if proc.stdin is not None:
+            with proc.stdin:
+                if input_text:
+                    try:
+                        proc.stdin.write(input_text)
+                    except BrokenPipeError:
+                        pass # The child exited without reading its input, as communicate() tolerates
+        for reader in readers:
+            reader.join()
+        _, rusage = wait_with_rusage(proc)
+    except BaseException: # Same cleanup as subprocess.run, e.g. on KeyboardInterrupt
+        proc.kill()
+        proc.wait()
+        raise
+    return output["stdout"], output["stderr"], rusage
+
+
+def rusage_summary(rusage) -> Optional[Dict[str, float]]:
+    """Reduces a struct_rusage to the JSON-friendly fields the execution trace records."""
+    if rusage is None:
+        return None
+    return {
+        "user_cpu_s": round(rusage.ru_utime, 4),
+        "sys_cpu_s": round(rusage.ru_stime, 4),
+        "max_rss_kb": rusage.ru_maxrss,
+    }
+
+
+# --- Server side (runs inside the privileged child) ---
+
+def _serve() -> None:
+    """Reads requests from stdin and answers on stdout until EOF or a shutdown request."""
+    # Keep the protocol channel private: children must never write into it.
+    protocol_out = os.fdopen(os.dup(sys.stdout.fileno()), "w", buffering=1)
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    out_lock = threading.Lock()
+
+    def emit(message: Dict[str, Any]) -> None:
+        with out_lock:
+            protocol_out.write(json.dumps(message) + "\n")
+            protocol_out.flush()
+
+    def handle(request: Dict[str, Any]) -> None:
+        req_id = request.get("id")
+        try:
+            result = _dispatch(request, lambda msg: emit({"id": req_id, **msg}))
+            emit({"id": req_id, "type": "result", "ok": True, **result})
+        except Exception as e:
+            emit({
+                "id": req_id, "type": "result", "ok": False,
+                "error_type": type(e).__name__, "error": getattr(e, "strerror", None) or str(e),
+                "errno": getattr(e, "errno", None), "filename": getattr(e, "filename", None),
+            })
+
+    for raw_line in sys.stdin:
+        raw_line = raw_line.strip()
+        if not raw_line:
+            continue
+        request = json.loads(raw_line)
+        if request.get("op") == "shutdown":
+            emit({"id": request.get("id"), "type": "result", "ok": True})
+            break
+        threading.Thread(target=handle, args=(request,), daemon=True).start()
+
+
+def _dispatch(request: Dict[str, Any], emit: Callable[[Dict[str, Any]], None]) -> Dict[str, Any]:
+    """Executes one request inside the worker and returns the result payload."""
+    op = request["op"]
+    if op == "ping":
+        return {"euid": os.geteuid(), "pid": os.getpid()}
+    if op == "run":
+        return _op_run(request, emit)
+
+    path = Path(request["path"])
+    if op == "isdir":
+        return {"value": path.is_dir()}
+    if op == "exists":
+        return {"value": path.exists()}
+    if op == "read":
+        return {"content": path.read_text(encoding="utf-8")}
+    if op == "mkdir":
+        path.mkdir(parents=request.get("parents", True), exist_ok=True)
+        if request.get("mode"):
+            os.chmod(path, int(str(request["mode"]), 8))
+        return {}
+    if op == "chmod":
+        os.chmod(path, int(str(request["mode"]), 8))
+        return {}
+    if op == "chown":
+        shutil.chown(path, user=request.get("user"), group=request.get("group"))
+        return {}
+    if op == "copy":
+        destination = Path(request["dest"])
+        shutil.copy2(path, destination)
+        if request.get("preserve_owner", True):
+            st = path.stat()
+            os.chown(destination, st.st_uid, st.st_gid)
+        return {}
+    if op == "write":
+        with open(path, "a" if request.get("append") else "w", encoding="utf-8") as f:
+            f.write(request.get("content", ""))
+        if request.get("mode"):
+            os.chmod(path, int(str(request["mode"]), 8))
+        return {}
+    raise ValueError(f"Unknown worker operation '{op}'.")
+
+
+def _op_run(request: Dict[str, Any], emit: Callable[[Dict[str, Any]], None]) -> Dict[str, Any]:
+    """Runs argv directly (no shell) and returns its exit status and, if captured, its output."""
+    env = os.environ.copy()
+    env.update(request.get("env") or {})
+    popen_kwargs = {"cwd": request.get("cwd"), "env": env, "text": True, "errors": "replace"}
+    input_text = request.get("input")
+    stdin = subprocess.PIPE if input_text is not None else subprocess.DEVNULL
+
+    if request.get("stream"):
+        proc = subprocess.Popen(request["argv"], stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=1, **popen_kwargs)
+        if input_text is not None:
+            proc.stdin.write(input_text)
+            proc.stdin.close()
+
+        def pump(stream, name):
+            with stream:
+                for line in stream:
+                    emit({"type": "line", "stream": name, "data": line})
+
+        readers = [threading.Thread(target=pump, args=(proc.stdout, "stdout")), threading.Thread(target=pump, args=(proc.stderr, "stderr"))]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+        returncode, rusage = wait_with_rusage(proc)
+        return {"returncode": returncode, "stdout": None, "stderr": None, "rusage": rusage_summary(rusage)}
+
+    if request.get("capture"):
+        stdout, stderr = subprocess.PIPE, subprocess.PIPE
+    else:
+        # Not captured: let output reach the terminal through the worker's stderr, as it would
+        # have through the parent's own stdout/stderr.
+        stdout, stderr = sys.stderr.fileno(), None
+    proc = subprocess.Popen(request["argv"], stdin=stdin, stdout=stdout, stderr=stderr, **popen_kwargs)
+    out, err, rusage = communicate_with_rusage(proc, input_text)
+    return {"returncode": proc.returncode, "stdout": out, "stderr": err, "rusage": rusage_summary(rusage)}
+
+
+# --- Client side ---
+
+# Executed by `python3 -I -c`; reads this module's source from the first stdin line.
+_BOOTSTRAP = "import sys,json;exec(compile(json.loads(sys.stdin.readline()),'<privileged_worker>','exec'))"
+
+
+class PrivilegedWorker:
+    """Client for one worker process running as root (user=None) or as a given user."""
+
+    def __init__(self, user: Optional[str] = None, logger: Optional[logging.Logger] = None):
+        self.user = user
+        self.log = logger or logging.getLogger(__name__)
+        self._proc: Optional[subprocess.Popen] = None
+        self._pending: Dict[int, "queue.Queue[Dict[str, Any]]"] = {}
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._reader: Optional[threading.Thread] = None
+
+    @property
+    def label(self) -> str:
+        return f"user '{self.user}'" if self.user else "root"
+
+    def _launch_argv(self) -> List[str]:
+        python_argv = [sys.executable, "-I", "-c", _BOOTSTRAP]
+        if self.user:
+            return ["sudo", "-Hn", "-u", self.user, "--"] + python_argv
+        if os.geteuid() == 0:
+            return python_argv
+        return ["sudo", "--"] + python_argv # May prompt for a password once, on the terminal
+
+    def start(self) -> bool:
+        """Launches the worker and waits for it to answer a ping. Returns False if it could not start."""
+        try:
+            self._proc = subprocess.Popen(
+                self._launch_argv(),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                text=True,
+                bufsize=1
+            )
+            self._proc.stdin.write(json.dumps(Path(__file__).read_text(encoding="utf-8")) + "\n")
+            self._proc.stdin.flush()
+        except (OSError, ValueError) as e:
+            self.log.warning(f"Could not launch privileged worker for {self.label}: {e}")
+            self._proc = None
+            return False
+
+        self._reader = threading.Thread(target=self._read_loop, name=f"privileged-worker-{self.user or 'root'}", daemon=True)
+        self._reader.start()
+        try:
+            info = self.request("ping")
+        except (WorkerUnavailableError, PrivilegedWorkerError) as e:
+            self.log.warning(f"Privileged worker for {self.label} did not start: {e}")
+            self.stop()
+            return False
+        self.log.info(f"Privileged worker for {self.label} started (pid {info.get('pid')}, euid {info.get('euid')}).")
+        return True
+
+    def is_alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def _read_loop(self) -> None:
+        assert self._proc is not None and self._proc.stdout is not None
+        for raw_line in self._proc.stdout:
+            try:
+                message = json.loads(raw_line)
+            except json.JSONDecodeError:
+                self.log.debug(f"Ignoring non-protocol output from privileged worker ({self.label}): {raw_line.rstrip()}")
+                continue
+            with self._lock:
+                waiter = self._pending.get(message.get("id"))
+            if waiter is not None:
+                waiter.put(message)
+        # EOF: wake up everyone still waiting
+        with self._lock:
+            waiters = list(self._pending.values())
+        for waiter in waiters:
+            waiter.put({"type": "eof"})
+
+    def request(self, op: str, on_line: Optional[Callable[[str, str], None]] = None, **payload: Any) -> Dict[str, Any]:
+        """Sends one request and blocks until its result arrives. on_line(stream, line) receives streamed output."""
+        if not self.is_alive():
+            raise WorkerUnavailableError(f"Privileged worker for {self.label} is not running.")
+        waiter: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        with self._lock:
+            self._next_id += 1
+            req_id = self._next_id
+            self._pending[req_id] = waiter
+            try:
+                self._proc.stdin.write(json.dumps({"id": req_id, "op": op, **payload}) + "\n")
+                self._proc.stdin.flush()
+            except (OSError, ValueError) as e:
+                del self._pending[req_id]
+                raise WorkerUnavailableError(f"Could not send request to privileged worker for {self.label}: {e}") from e
+        try:
+            while True:
+                message = waiter.get()
+                if message.get("type") == "line":
+                    if on_line:
+                        on_line(message.get("stream", "stdout"), message.get("data", ""))
+                    continue
+                if message.get("type") == "eof":
+                    raise PrivilegedWorkerError(f"Privileged worker for {self.label} exited during '{op}'.")
+                if not message.get("ok"):
+                    _raise_remote_error(message)
+                return message
+        finally:
+            with self._lock:
+                self._pending.pop(req_id, None)
+
+    def stop(self) -> None:
+        """Asks the worker to exit and reaps it."""
+        if self._proc is None:
+            return
+        if self.is_alive():
+            try:
+                self._proc.stdin.write(json.dumps({"id": 0, "op": "shutdown"}) + "\n")
+                self._proc.stdin.close()
+                self._proc.wait(timeout=5)
+            except (OSError, ValueError, subprocess.TimeoutExpired):
+                self._proc.kill()
+                self._proc.wait()
+        self.log.info(f"Privileged worker for {self.label} stopped.")
+        self._proc = None
+
+
+def _raise_remote_error(message: Dict[str, Any]) -> None:
+    """Re-raises an exception reported by the worker as the closest local type."""
+    error_type, error = message.get("error_type"), message.get("error", "")
+    if error_type in ("FileNotFoundError", "PermissionError", "FileExistsError", "NotADirectoryError", "IsADirectoryError", "OSError"):
+        exc_class = getattr(__import__("builtins"), error_type)
+        if message.get("errno") is not None:
+            raise exc_class(message["errno"], error, message.get("filename"))
+        raise exc_class(error)
+    if error_type in ("ValueError", "LookupError", "KeyError"):
+        raise ValueError(error)
+    raise PrivilegedWorkerError(f"{error_type}: {error}")
+
+
+# --- Per-run registry ---
+
+_workers: Dict[Optional[str], PrivilegedWorker] = {}
+_registry_lock = threading.Lock()
+
+def start_worker(user: Optional[str] = None, logger: Optional[logging.Logger] = None) -> bool:
+    """Starts (once per run) the worker for root (user=None) or for the given user."""
+    with _registry_lock:
+        existing = _workers.get(user)
+        if existing is not None and existing.is_alive():
+            return True
+        worker = PrivilegedWorker(user, logger)
+        if not worker.start():
+            return False
+        _workers[user] = worker
+        return True
+
+def get_worker(user: Optional[str] = None) -> Optional[PrivilegedWorker]:
+    """Returns the running worker for root (user=None) or for the given user, if any."""
+    worker = _workers.get(user)
+    if worker is not None and worker.is_alive():
+        return worker
+    return None
+
+def stop_workers() -> None:
+    """Stops every worker started in this run."""
+    with _registry_lock:
+        for worker in list(_workers.values()):
+            worker.stop()
+        _workers.clear()
+
+atexit.register(stop_workers)
+
+
+if __name__ == "__main__":
+    _serve()
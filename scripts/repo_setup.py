@@ -0,0 +1,333 @@
+# Fedora-AutoEnv-Setup/scripts/repo_setup.py
+
+# Batched, idempotent setup of third-party DNF repositories (custom_repo_dnf_packages).
+# Instead of running each entry's shell strings (one sudo, shell and dnf process per line),
+# all entries are handled together:
+#   - repositories whose ids already exist in /etc/yum.repos.d are skipped;
+#   - .repo files are written natively (or downloaded from the vendor's URL);
+#   - GPG keys are fingerprinted locally and only keys missing from the installed
+#     gpg-pubkey set are imported, all with a single `rpm --import`;
+#   - repository metadata is refreshed once for all new repositories.
+# Entries that only have "repo_setup_commands" still run those commands.
+#
+# packages.json entry (either "repo" or "repo_file_url"; "gpg_keys" is optional):
+#   "visual_studio_code": {
+#       "name": "Visual Studio Code",
+#       "check_if_installed_pkg": "code",
+#       "repo": {"id": "code", "name": "Visual Studio Code", "baseurl": "https://...", "gpgkey": "https://....asc"},
+#       "dnf_package_to_install": "code"
+#   },
+#   "brave_browser": {
+#       "repo_file_url": "https://.../brave-browser.repo",
+#       "gpg_keys": ["https://.../brave-core.asc"],
+#       ...
+#   }
+
+import base64
+import configparser
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from scripts import exec_trace
+from scripts import install_root
+from scripts import package_index
+from scripts import system_utils as util
+
+YUM_REPOS_DIR = Path("/etc/yum.repos.d")
+DOWNLOAD_TIMEOUT_SECONDS = 30
+_MAX_PARALLEL_DOWNLOADS = 8
+
+# Defaults for the keys of a native "repo" definition that are not given explicitly
+_REPO_DEFAULTS = {"enabled": "1", "gpgcheck": "1", "type": "rpm-md"}
+
+_ARMOR_RE = re.compile(r"-----BEGIN PGP PUBLIC KEY BLOCK-----(.*?)-----END PGP PUBLIC KEY BLOCK-----", re.S)
+
+_module_logger = logging.getLogger(__name__)
+
+
+class RepoDefinition(NamedTuple):
+    """A repository to add: the file to write, its content, the repo ids it defines and its GPG key URLs."""
+    repo_key: str
+    file_name: str
+    content: str
+    repo_ids: List[str]
+    key_urls: List[str]
+
+
+def is_native_entry(entry: Dict) -> bool:
+    return bool(entry.get("repo") or entry.get("repo_file_url"))
+
+def _fetch(url: str) -> bytes:
+    """Reads an http(s)/file URL or a local path."""
+    if "://" not in url:
+        return Path(url).read_bytes()
+    with urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT_SECONDS) as response:
+        return response.read()
+
+def _fetch_all(urls: List[str], log: logging.Logger) -> Dict[str, Optional[bytes]]:
+    """Downloads urls concurrently. Failed downloads map to None."""
+    def fetch_one(url: str) -> Optional[bytes]:
+        try:
+            return _fetch(url)
+        except Exception as e:
+            log.error(f"Could not download {url}: {e}")
+            return None
+    if not urls:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(_MAX_PARALLEL_DOWNLOADS, len(urls))) as pool:
+        return dict(zip(urls, pool.map(fetch_one, urls)))
+
+def _parse_repo_text(text: str) -> configparser.ConfigParser:
+    parser = configparser.ConfigParser(interpolation=None, strict=False)
+    parser.read_string(text)
+    return parser
+
+def existing_repo_ids(repos_dir: Optional[Path] = None, logger: Optional[logging.Logger] = None) -> Set[str]:
+    """Ids of every repository defined in repos_dir/*.repo (default: YUM_REPOS_DIR of the targeted install root)."""
+    log = logger or _module_logger
+    repos_dir = repos_dir or install_root.path(YUM_REPOS_DIR)
+    repo_ids: Set[str] = set()
+    for repo_file in sorted(Path(repos_dir).glob("*.repo")):
+        try:
+            repo_ids.update(_parse_repo_text(repo_file.read_text(encoding="utf-8")).sections())
+        except (OSError, configparser.Error) as e:
+            log.warning(f"Cannot parse {repo_file}: {e}")
+    return repo_ids
+
+def render_repo_file(repo: Dict) -> str:
+    """.repo file text for a native "repo" definition ("id" names the section)."""
+    options = {key: value for key, value in repo.items() if key != "id"}
+    for key, value in _REPO_DEFAULTS.items():
+        options.setdefault(key, value)
+    lines = [f"[{repo['id']}]"]
+    for key, value in options.items():
+        if isinstance(value, bool):
+            value = int(value)
+        elif isinstance(value, list):
+            value = " ".join(value)
+        lines.append(f"{key}={value}")
+    return "\n".join(lines) + "\n"
+
+def _gpgkey_urls(parser: configparser.ConfigParser, sections: List[str]) -> List[str]:
+    urls = []
+    for section in sections:
+        urls += parser.get(section, "gpgkey", fallback="").split()
+    return urls
+
+# --- OpenPGP key fingerprints ---
+
+def dearmor(armored_text: str) -> List[bytes]:
+    """Binary packet data of every public key block in an ASCII-armored text."""
+    blocks = []
+    for body in _ARMOR_RE.findall(armored_text):
+        # Armor headers ("Version: ...") end at the first blank line; "=XXXX" is the CRC24 line
+        lines = body.strip().splitlines()
+        if any(not line.strip() for line in lines):
+            lines = lines[next(i for i, line in enumerate(lines) if not line.strip()) + 1:]
+        data = "".join(line.strip() for line in lines if line.strip() and not line.startswith("="))
+        blocks.append(base64.b64decode(data))
+    return blocks
+
+def _iter_packets(data: bytes):
+    """Yields (tag, body) for each OpenPGP packet (RFC 4880 section 4.2, old and new formats)."""
+    pos = 0
+    while pos < len(data):
+        header = data[pos]
+        if not header & 0x80:
+            raise ValueError(f"invalid OpenPGP packet header at offset {pos}")
+        if header & 0x40: # New format
+            tag = header & 0x3F
+            first = data[pos + 1]
+            if first < 192:
+                length, pos = first, pos + 2
+            elif first < 224:
+                length, pos = ((first - 192) << 8) + data[pos + 2] + 192, pos + 3
+            elif first == 255:
+                length, pos = int.from_bytes(data[pos + 2:pos + 6], "big"), pos + 6
+            else:
+                raise ValueError("partial-length OpenPGP packets are not valid in keys")
+        else: # Old format
+            tag = (header >> 2) & 0x0F
+            length_type = header & 0x03
+            if length_type == 3:
+                length, pos = len(data) - pos - 1, pos + 1
+            else:
+                size = 1 << length_type
+                length, pos = int.from_bytes(data[pos + 1:pos + 1 + size], "big"), pos + 1 + size
+        yield tag, data[pos:pos + length]
+        pos += length
+
+def primary_key_fingerprints(armored_text: str) -> List[str]:
+    """Lowercase hex fingerprints of the primary public keys in an armored key file (v4, v5 and v6 keys)."""
+    fingerprints = []
+    for block in dearmor(armored_text):
+        for tag, body in _iter_packets(block):
+            if tag != 6 or not body: # 6 = public key packet; subkeys (14) are not separate gpg-pubkeys
+                continue
+            if body[0] == 4:
+                fingerprints.append(hashlib.sha1(b"\x99" + len(body).to_bytes(2, "big") + body).hexdigest())
+            elif body[0] in (5, 6):
+                prefix = b"\x9a" if body[0] == 5 else b"\x9b"
+                fingerprints.append(hashlib.sha256(prefix + len(body).to_bytes(4, "big") + body).hexdigest())
+    return fingerprints
+
+def installed_key_versions(logger: Optional[logging.Logger] = None) -> Set[str]:
+    """
+    VERSION of every installed gpg-pubkey package: the last 8 hex digits of a v4 fingerprint
+    (the short key id), or the full fingerprint with newer rpm versions.
+    """
+    index = package_index.get_installed_package_index(logger or _module_logger)
+    return {record.version.lower() for record in index.get("gpg-pubkey")}
+
+def key_is_installed(fingerprint: str, installed_versions: Set[str]) -> bool:
+    return any(version and (fingerprint.endswith(version) or fingerprint.startswith(version)) for version in installed_versions)
+
+# --- Batched setup ---
+
+def pending_entries(custom_repos: Dict[str, Dict], logger: Optional[logging.Logger] = None) -> Dict[str, Dict]:
+    """Entries whose check_if_installed_pkg is not installed, resolved against one installed-package snapshot."""
+    index = package_index.get_installed_package_index(logger or _module_logger)
+    return {
+        repo_key: entry for repo_key, entry in custom_repos.items()
+        if not index.is_installed(entry.get("check_if_installed_pkg") or entry.get("dnf_package_to_install", ""))
+    }
+
+def _definition_for(repo_key: str, entry: Dict, downloads: Dict[str, Optional[bytes]], log: logging.Logger) -> Optional[RepoDefinition]:
+    """Builds the RepoDefinition of a native entry (repo_file_url content must be in downloads)."""
+    try:
+        if entry.get("repo"):
+            repo = entry["repo"]
+            content = render_repo_file(repo)
+            file_name = f"{repo['id']}.repo"
+        else:
+            url = entry["repo_file_url"]
+            if downloads.get(url) is None:
+                return None
+            content = downloads[url].decode("utf-8")
+            file_name = entry.get("repo_file_name") or os.path.basename(url.split("?", 1)[0])
+        parser = _parse_repo_text(content)
+    except (KeyError, UnicodeDecodeError, configparser.Error) as e:
+        log.error(f"Invalid repository definition for '{repo_key}': {e}")
+        return None
+    repo_ids = parser.sections()
+    if not repo_ids or not file_name.endswith(".repo"):
+        log.error(f"Repository definition for '{repo_key}' has no repository sections or no .repo file name.")
+        return None
+    key_urls = list(dict.fromkeys(entry.get("gpg_keys", []) + _gpgkey_urls(parser, repo_ids)))
+    return RepoDefinition(repo_key, file_name, content, repo_ids, key_urls)
+
+def _import_missing_keys(
+    key_urls: List[str],
+    log: logging.Logger,
+    print_fn_info: Optional[Callable[[str], None]],
+    print_fn_error: Optional[Callable[[str], None]]
+) -> Set[str]:
+    """Imports the keys from key_urls that are not installed yet, in one rpm call. Returns the URLs that failed."""
+    _p_info = print_fn_info or (lambda msg: None)
+    downloads = _fetch_all(key_urls, log)
+    failed = {url for url, data in downloads.items() if data is None}
+    installed = installed_key_versions(log)
+
+    to_import: List[Tuple[str, bytes]] = []
+    for url, data in downloads.items():
+        if data is None:
+            continue
+        try:
+            fingerprints = primary_key_fingerprints(data.decode("ascii", errors="replace"))
+        except (ValueError, IndexError) as e:
+            log.warning(f"Cannot parse the GPG key at {url} ({e}); importing it anyway.")
+            fingerprints = []
+        if fingerprints and all(key_is_installed(fp, installed) for fp in fingerprints):
+            log.info(f"GPG key {url} is already imported ({', '.join(fp[-16:] for fp in fingerprints)}).")
+            continue
+        to_import.append((url, data))
+
+    if not to_import:
+        return failed
+
+    key_dir = tempfile.mkdtemp(prefix="autoenv-keys-")
+    try:
+        key_files = []
+        for position, (_, data) in enumerate(to_import):
+            key_file = Path(key_dir) / f"key{position}.asc"
+            key_file.write_bytes(data)
+            key_files.append(str(key_file))
+        os.chmod(key_dir, 0o755)
+        _p_info(f"Importing {len(key_files)} repository GPG key(s)...")
+        util.run_command(["sudo", "rpm", "--import"] + key_files, capture_output=True, check=True, print_fn_info=None, print_fn_error=print_fn_error, logger=log)
+    except Exception as e:
+        log.error(f"Importing GPG keys failed: {e}", exc_info=True)
+        failed.update(url for url, _ in to_import)
+    finally:
+        for name in os.listdir(key_dir):
+            os.unlink(os.path.join(key_dir, name))
+        os.rmdir(key_dir)
+    return failed
+
+@exec_trace.traced_helper
+def setup_custom_repos(
+    custom_repos: Dict[str, Dict],
+    repos_dir: Optional[Path] = None,
+    print_fn_info: Optional[Callable[[str], None]] = None,
+    print_fn_error: Optional[Callable[[str], None]] = None,
+    print_fn_sub_step: Optional[Callable[[str], None]] = None,
+    logger: Optional[logging.Logger] = None
+) -> Dict[str, bool]:
+    """Sets up the repositories of custom_repos (repo key -> entry) together. Returns, per repo key, whether it is usable."""
+    log = logger or _module_logger
+    _p_info = print_fn_info or (lambda msg: None)
+    _p_error = print_fn_error or (lambda msg: None)
+    _p_sub = print_fn_sub_step or (lambda msg: None)
+    results: Dict[str, bool] = {}
+    repos_dir = repos_dir or install_root.path(YUM_REPOS_DIR)
+
+    native = {key: entry for key, entry in custom_repos.items() if is_native_entry(entry)}
+    if native:
+        present = existing_repo_ids(repos_dir, log)
+        downloads = _fetch_all([entry["repo_file_url"] for entry in native.values() if not entry.get("repo")], log)
+        new_definitions: List[RepoDefinition] = []
+        for repo_key, entry in native.items():
+            definition = _definition_for(repo_key, entry, downloads, log)
+            if definition is None:
+                _p_error(f"Could not prepare the repository for {entry.get('name', repo_key)}.")
+                results[repo_key] = False
+            elif all(repo_id in present for repo_id in definition.repo_ids):
+                log.info(f"Repository {', '.join(definition.repo_ids)} for '{repo_key}' already exists.")
+                _p_info(f"Repository for {entry.get('name', repo_key)} is already configured.")
+                results[repo_key] = True
+            else:
+                new_definitions.append(definition)
+
+        failed_keys = _import_missing_keys(
+            list(dict.fromkeys(url for definition in new_definitions for url in definition.key_urls)),
+            log, print_fn_info, print_fn_error
+        )
+        for definition in new_definitions:
+            app_name = native[definition.repo_key].get("name", definition.repo_key)
+            if failed_keys.intersection(definition.key_urls):
+                _p_error(f"The GPG key for {app_name} could not be imported; not adding its repository.")
+                results[definition.repo_key] = False
+                continue
+            _p_sub(f"Adding repository for {app_name} ({Path(repos_dir) / definition.file_name})")
+            results[definition.repo_key] = util.write_system_file(
+                Path(repos_dir) / definition.file_name, definition.content, logger=log, print_fn_error=print_fn_error
+            )
+
+        if any(results.get(definition.repo_key) for definition in new_definitions):
+            util.invalidate_dnf_metadata() # Also covers repos_dir outside /etc (tests, install roots)
+            util.ensure_dnf_metadata(log) # One refresh for every repository added above
+
+    for repo_key, entry in custom_repos.items():
+        if repo_key not in native:
+            results[repo_key] = util.setup_custom_repo(
+                entry.get("name", repo_key), entry.get("repo_setup_commands", []),
+                print_fn_info=print_fn_info, print_fn_error=print_fn_error, print_fn_sub_step=print_fn_sub_step, logger=log
+            )
+    return results
@@ -0,0 +1,164 @@
+# Fedora-AutoEnv-Setup/scripts/rpmdb_sqlite.py
+
+# Reads installed packages straight from rpm's sqlite database (Fedora 33+), with no subprocess.
+# The database is opened read-only (no root needed) with mmap I/O. Each row of the Packages table
+# is an rpm header blob:
+#
+#   int32 il | int32 dl | il * (int32 tag, int32 type, int32 offset, int32 count) | dl bytes of data
+#
+# all big-endian. Only the few tags the installed-package index needs are decoded. Anything that
+# does not look like this layout raises RpmdbSchemaError so callers can fall back to the rpm CLI.
+
+import sqlite3
+import struct
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+RPMDB_SQLITE_PATH = Path("/var/lib/rpm/rpmdb.sqlite")
+
+# (name, epoch, version, release, arch, provides), in package_index.PackageRecord field order
+HeaderFields = Tuple[str, int, str, str, str, Tuple[str, ...]]
+
+MMAP_SIZE_BYTES = 256 * 1024 * 1024
+
+# Header tags (rpmtag.h)
+RPMTAG_NAME = 1000
+RPMTAG_VERSION = 1001
+RPMTAG_RELEASE = 1002
+RPMTAG_EPOCH = 1003
+RPMTAG_ARCH = 1022
+RPMTAG_PROVIDENAME = 1047
+
+# Header data types
+_TYPE_INT32 = 4
+_TYPE_STRING = 6
+_TYPE_STRING_ARRAY = 8
+_TYPE_I18NSTRING = 9
+
+_WANTED_TAGS = {RPMTAG_NAME, RPMTAG_VERSION, RPMTAG_RELEASE, RPMTAG_EPOCH, RPMTAG_ARCH, RPMTAG_PROVIDENAME}
+_ENTRY = struct.Struct(">iiii")
+_MAX_INDEX_ENTRIES = 0xFFFF
+_MAX_DATA_BYTES = 256 * 1024 * 1024
+
+
+class RpmdbSchemaError(Exception):
+    """The database or one of its header blobs is not in the layout this reader understands."""
+    pass
+
+
+def _read_strings(data: bytes, offset: int, count: int) -> List[str]:
+    strings = []
+    for _ in range(count):
+        end = data.find(b"\0", offset)
+        if end < 0:
+            raise RpmdbSchemaError("Unterminated string in header data.")
+        strings.append(data[offset:end].decode("utf-8", errors="replace"))
+        offset = end + 1
+    return strings
+
+def parse_header_blob(blob: bytes) -> HeaderFields:
+    """Decodes the name/EVR/arch/provides of one Packages.blob value."""
+    if len(blob) < 8:
+        raise RpmdbSchemaError("Header blob too short.")
+    index_count, data_length = struct.unpack_from(">ii", blob, 0)
+    data_start = 8 + index_count * _ENTRY.size
+    if not (0 < index_count <= _MAX_INDEX_ENTRIES and 0 <= data_length <= _MAX_DATA_BYTES) or data_start + data_length > len(blob):
+        raise RpmdbSchemaError(f"Implausible header sizes (il={index_count}, dl={data_length}, blob={len(blob)} bytes).")
+    data = blob[data_start:data_start + data_length]
+
+    values: Dict[int, object] = {}
+    for i in range(index_count):
+        tag, tag_type, offset, count = _ENTRY.unpack_from(blob, 8 + i * _ENTRY.size)
+        if tag not in _WANTED_TAGS:
+            continue
+        if not 0 <= offset < data_length:
+            raise RpmdbSchemaError(f"Tag {tag} points outside the header data.")
+        if tag_type == _TYPE_INT32:
+            if offset + 4 * count > data_length:
+                raise RpmdbSchemaError(f"Tag {tag} overruns the header data.")
+            values[tag] = struct.unpack_from(f">{count}i", data, offset)
+        elif tag_type in (_TYPE_STRING, _TYPE_I18NSTRING):
+            values[tag] = _read_strings(data, offset, 1)[0]
+        elif tag_type == _TYPE_STRING_ARRAY:
+            values[tag] = _read_strings(data, offset, count)
+        else:
+            raise RpmdbSchemaError(f"Unexpected type {tag_type} for tag {tag}.")
+
+    if not isinstance(values.get(RPMTAG_NAME), str):
+        raise RpmdbSchemaError("Header has no name.")
+    epoch = values.get(RPMTAG_EPOCH)
+    return (
+        values[RPMTAG_NAME],
+        epoch[0] if epoch else 0,
+        values.get(RPMTAG_VERSION, ""),
+        values.get(RPMTAG_RELEASE, ""),
+        values.get(RPMTAG_ARCH, "(none)"), # gpg-pubkey headers have no arch, as in `rpm -q`
+        tuple(values.get(RPMTAG_PROVIDENAME, ())),
+    )
+
+
+class RpmdbSqliteReader:
+    """Read-only access to rpmdb.sqlite. Raises RpmdbSchemaError when the tables are not recognised."""
+
+    def __init__(self, db_path: Optional[Path] = None):
+        self.db_path = Path(db_path or RPMDB_SQLITE_PATH)
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self.db_path.is_file():
+            raise FileNotFoundError(f"rpm sqlite database not found: {self.db_path}")
+        uri = self.db_path.resolve().as_uri()
+        conn = sqlite3.connect(f"{uri}?mode=ro", uri=True)
+        try:
+            conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+        except sqlite3.OperationalError:
+            # Without write access to the directory a WAL database cannot create its -shm file;
+            # immutable=1 skips locking entirely, which is fine for a snapshot read.
+            conn.close()
+            conn = sqlite3.connect(f"{uri}?immutable=1", uri=True)
+        except sqlite3.DatabaseError as e: # e.g. "file is not a database" (an old Berkeley DB rpmdb)
+            conn.close()
+            raise RpmdbSchemaError(f"Cannot read {self.db_path} as sqlite: {e}") from e
+        try:
+            conn.execute(f"PRAGMA mmap_size={MMAP_SIZE_BYTES}")
+            conn.execute("PRAGMA query_only=1")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(Packages)")}
+        except sqlite3.DatabaseError as e: # e.g. "file is not a database" (an old Berkeley DB rpmdb)
+            conn.close()
+            raise RpmdbSchemaError(f"Cannot read {self.db_path} as sqlite: {e}") from e
+        if not {"hnum", "blob"} <= columns:
+            conn.close()
+            raise RpmdbSchemaError("No Packages(hnum, blob) table in the rpm database.")
+        return conn
+
+    def read_all(self) -> List[HeaderFields]:
+        """Every installed package."""
+        conn = self._connect()
+        try:
+            return [parse_header_blob(bytes(blob)) for (blob,) in conn.execute("SELECT blob FROM Packages")]
+        except sqlite3.DatabaseError as e:
+            raise RpmdbSchemaError(f"Could not read Packages: {e}") from e
+        finally:
+            conn.close()
+
+    def read_names(self, names: Iterable[str]) -> List[HeaderFields]:
+        """Installed packages with exactly these names, using the Name index table when present."""
+        names = list(dict.fromkeys(names))
+        if not names:
+            return []
+        conn = self._connect()
+        try:
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            if "Name" not in tables:
+                wanted = set(names)
+                return [fields for (blob,) in conn.execute("SELECT blob FROM Packages")
+                        if (fields := parse_header_blob(bytes(blob)))[0] in wanted]
+            placeholders = ",".join("?" * len(names))
+            rows = conn.execute(
+                f"SELECT blob FROM Packages WHERE hnum IN (SELECT hnum FROM Name WHERE key IN ({placeholders}))",
+                names
+            )
+            return [parse_header_blob(bytes(blob)) for (blob,) in rows]
+        except sqlite3.DatabaseError as e:
+            raise RpmdbSchemaError(f"Could not query Packages by name: {e}") from e
+        finally:
+            conn.close()
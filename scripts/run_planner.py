@@ -0,0 +1,320 @@
+# Fedora-AutoEnv-Setup/scripts/run_planner.py
+
+# Dry-run planner behind `install.py --plan`. Resolves what the selected phases would do
+# without changing the system:
+#   - DNF: the combined transaction plan (dnf_planner) against the installed-package index,
+#     sized by letting dnf resolve it with --assumeno and reading its transaction summary;
+#   - Flatpak: apps not installed yet and the runtimes they need, sized with `flatpak remote-info`;
+#   - disk space: download and installed sizes per filesystem, against the free space there;
+#   - ETA: the sizes divided by the throughput of earlier combined DNF transactions
+#     (installed bytes per second, recorded in LOG_DIR/throughput_history.json after each one).
+# Packages from third-party repositories that are not configured yet cannot be resolved by dnf
+# before their repository exists, so they are listed but not sized.
+
+import json
+import logging
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import time
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from scripts import console_output as con
+from scripts import dnf_planner
+from scripts import flatpak_index
+from scripts import install_root
+from scripts import system_utils as util
+from scripts.config import LOG_DIR, PHASES
+
+THROUGHPUT_HISTORY_PATH = LOG_DIR / "throughput_history.json"
+THROUGHPUT_HISTORY_LENGTH = 20
+# Used for the ETA until a combined DNF transaction has been measured on this machine
+DEFAULT_THROUGHPUT_BYTES_PER_SEC = 8 * 1024 * 1024
+# Extra free space required on top of the planned sizes (metadata, scriptlets, rounding)
+DISK_SPACE_MARGIN = 0.10
+
+DNF_CACHE_DIR = Path("/var/cache")
+FLATPAK_SYSTEM_DIR = Path("/var/lib/flatpak")
+
+_SIZE_UNITS = {
+    "": 1, "b": 1, "byte": 1, "bytes": 1,
+    "k": 1000, "kb": 1000, "m": 1000 ** 2, "mb": 1000 ** 2, "g": 1000 ** 3, "gb": 1000 ** 3, "t": 1000 ** 4, "tb": 1000 ** 4,
+    "kib": 1024, "mib": 1024 ** 2, "gib": 1024 ** 3, "tib": 1024 ** 4,
+}
+# dnf4 prints "1.2 M" with binary multiples; dnf5 and flatpak spell their units out
+_DNF4_UNITS = {"k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4}
+
+_module_logger = logging.getLogger(__name__)
+
+
+class FlatpakRef(NamedTuple):
+    ref: str                       # app id, or "runtime/<id>/<arch>/<branch>"
+    remote: str
+    download_bytes: Optional[int]
+    installed_bytes: Optional[int]
+
+
+class RunPlan:
+    """What a run of the selected phases would do, and what it would cost."""
+
+    def __init__(self, phase_ids: List[str]):
+        self.phase_ids = phase_ids
+        self.dnf = dnf_planner.DnfTransactionPlan()
+        self.unsized_packages: List[str] = []           # Packages from repositories not configured yet
+        self.dnf_download_bytes: Optional[int] = None
+        self.dnf_installed_bytes: Optional[int] = None
+        self.flatpak_refs: List[FlatpakRef] = []
+        self.flatpak_skipped: List[str] = []
+        self.disk_shortfalls: List[Tuple[str, int, int]] = [] # (mount point, required bytes, free bytes)
+
+    @property
+    def download_bytes(self) -> int:
+        return (self.dnf_download_bytes or 0) + sum(ref.download_bytes or 0 for ref in self.flatpak_refs)
+
+    @property
+    def installed_bytes(self) -> int:
+        return (self.dnf_installed_bytes or 0) + sum(ref.installed_bytes or 0 for ref in self.flatpak_refs)
+
+    @property
+    def disk_space_ok(self) -> bool:
+        return not self.disk_shortfalls
+
+
+def parse_size(text: str, dnf4: bool = False) -> Optional[int]:
+    """Bytes in a size like '45 M' (dnf4), '45.1 MiB' (dnf5) or '12.3 MB' (flatpak)."""
+    match = re.match(r"\s*([\d.,]+)\s*([A-Za-z]*)", text)
+    if not match:
+        return None
+    number, unit = float(match.group(1).replace(",", ".")), match.group(2).lower()
+    multiplier = _DNF4_UNITS.get(unit) if dnf4 and unit in _DNF4_UNITS else _SIZE_UNITS.get(unit)
+    return int(number * multiplier) if multiplier else None
+
+def parse_dnf_sizes(output: str) -> Tuple[Optional[int], Optional[int]]:
+    """(download bytes, installed bytes) from a dnf4 or dnf5 transaction summary."""
+    download = installed = None
+    match = re.search(r"Total download size:\s*(.+)", output)                 # dnf4
+    if match:
+        download = parse_size(match.group(1), dnf4=True)
+    match = re.search(r"Installed size:\s*(.+)", output)                      # dnf4
+    if match:
+        installed = parse_size(match.group(1), dnf4=True)
+    match = re.search(r"Need to download\s+([\d.,]+\s*\w+)", output)         # dnf5
+    if match:
+        download = parse_size(match.group(1))
+    match = re.search(r"After this operation,\s+([\d.,]+\s*\w+)\s+extra", output) # dnf5
+    if match:
+        installed = parse_size(match.group(1))
+    if download is None and re.search(r"Nothing to do", output):
+        download = installed = 0
+    return download, installed
+
+def _size_dnf_plan(plan: RunPlan, log: logging.Logger) -> None:
+    sizing_plan = dnf_planner.DnfTransactionPlan()
+    sizing_plan.packages = {pkg: phase_id for pkg, phase_id in plan.dnf.packages.items() if pkg not in plan.unsized_packages}
+    sizing_plan.groups = dict(plan.dnf.groups)
+    sizing_plan.swaps = list(plan.dnf.swaps)
+    if sizing_plan.is_empty():
+        plan.dnf_download_bytes = plan.dnf_installed_bytes = 0
+        return
+    cmd, script_path = dnf_planner.build_transaction_command(sizing_plan, log, assume_no=True)
+    try:
+        # --assumeno exits non-zero after printing the summary ("Operation aborted")
+        proc = util.run_command(cmd, capture_output=True, check=False, logger=log, print_fn_error=lambda msg: None, read_only=True)
+        plan.dnf_download_bytes, plan.dnf_installed_bytes = parse_dnf_sizes(proc.stdout + proc.stderr)
+        if plan.dnf_download_bytes is None:
+            log.warning(f"Could not read the transaction size from dnf: {proc.stderr.strip()[-500:]}")
+    except (subprocess.SubprocessError, OSError) as e:
+        log.warning(f"Sizing the DNF transaction failed: {e}")
+    finally:
+        if script_path:
+            os.unlink(script_path)
+
+def _collect_flatpak_work(plan: RunPlan, app_config: Dict, log: logging.Logger) -> None:
+    index = flatpak_index.get_flatpak_index(log)
+    try:
+        installed_apps = index.installed_app_ids()
+        installed_runtimes = index.installed_runtime_refs()
+    except FileNotFoundError:
+        installed_apps, installed_runtimes = set(), set()
+
+    apps: List[str] = []
+    for phase_id in plan.phase_ids:
+        section = app_config.get(PHASES[phase_id].get("config_section", ""), {})
+        for app_id in section.get("flatpak_apps", {}):
+            if app_id in installed_apps:
+                plan.flatpak_skipped.append(app_id)
+            elif app_id not in apps:
+                apps.append(app_id)
+
+    runtimes: List[str] = []
+    for app_id in apps:
+        info = index.remote_info("flathub", app_id) or {}
+        plan.flatpak_refs.append(FlatpakRef(app_id, "flathub", parse_size(info.get("Download", "")), parse_size(info.get("Installed", ""))))
+        runtime = info.get("Runtime")
+        if runtime and runtime not in installed_runtimes and runtime not in runtimes:
+            runtimes.append(runtime)
+    for runtime in runtimes:
+        ref = f"runtime/{runtime}"
+        info = index.remote_info("flathub", ref) or {}
+        plan.flatpak_refs.append(FlatpakRef(ref, "flathub", parse_size(info.get("Download", "")), parse_size(info.get("Installed", ""))))
+
+def _mount_point(path: Path) -> Path:
+    path = Path(path)
+    while not path.exists() and path != path.parent:
+        path = path.parent
+    while not os.path.ismount(path):
+        path = path.parent
+    return path
+
+def _check_disk_space(plan: RunPlan) -> None:
+    """Fills plan.disk_shortfalls with the filesystems that lack room for the planned sizes."""
+    # Inside an install root, packages land under the root and downloads in the cache all roots share
+    cache_dir = install_root.SHARED_DNF_CACHE_DIR if install_root.current() is not None else DNF_CACHE_DIR
+    needs = [
+        (install_root.path("/usr"), plan.dnf_installed_bytes or 0),
+        (cache_dir, plan.dnf_download_bytes or 0),
+        (install_root.path(FLATPAK_SYSTEM_DIR), sum((ref.installed_bytes or 0) + (ref.download_bytes or 0) for ref in plan.flatpak_refs)),
+    ]
+    required: Dict[Path, int] = {}
+    for path, size in needs:
+        mount = _mount_point(path)
+        required[mount] = required.get(mount, 0) + size
+    for mount, size in required.items():
+        size = int(size * (1 + DISK_SPACE_MARGIN))
+        free = shutil.disk_usage(mount).free
+        if size > free:
+            plan.disk_shortfalls.append((str(mount), size, free))
+
+def build_run_plan(app_config: Dict, phase_ids: List[str], logger: Optional[logging.Logger] = None) -> RunPlan:
+    """Resolves what running phase_ids would install, its sizes and whether the disks have room."""
+    log = logger or _module_logger
+    plan = RunPlan(phase_ids)
+    plan.dnf = dnf_planner.collect_dnf_work(app_config, phase_ids, logger=log)
+    plan.unsized_packages = [entry["dnf_package_to_install"] for _, _, entry in plan.dnf.custom_repos if entry.get("dnf_package_to_install")]
+    _size_dnf_plan(plan, log)
+    _collect_flatpak_work(plan, app_config, log)
+    _check_disk_space(plan)
+    return plan
+
+# --- Throughput history ---
+
+def load_throughput_history(logger: Optional[logging.Logger] = None) -> List[float]:
+    """Installed bytes per second of the last combined DNF transactions on this machine."""
+    try:
+        samples = json.loads(THROUGHPUT_HISTORY_PATH.read_text(encoding="utf-8")).get("dnf_installed_bytes_per_sec", [])
+        return [float(sample) for sample in samples if sample > 0]
+    except FileNotFoundError:
+        return []
+    except (OSError, ValueError, AttributeError, TypeError) as e:
+        (logger or _module_logger).warning(f"Ignoring unreadable throughput history {THROUGHPUT_HISTORY_PATH}: {e}")
+        return []
+
+def record_dnf_throughput(started_at: float, duration: float, logger: Optional[logging.Logger] = None) -> None:
+    """
+    Records the throughput of a DNF transaction that started at started_at (epoch seconds) and
+    took duration seconds: the installed size of the packages rpm stamped since then, per second.
+    """
+    log = logger or _module_logger
+    if duration <= 0:
+        return
+    try:
+        proc = util.run_command(["rpm", "-qa", "--queryformat", "%{INSTALLTIME} %{SIZE}\\n"], capture_output=True, check=False, logger=log, print_fn_error=lambda msg: None)
+    except (subprocess.SubprocessError, OSError) as e:
+        log.debug(f"Cannot measure DNF throughput: {e}")
+        return
+    installed = 0
+    for line in proc.stdout.splitlines():
+        fields = line.split()
+        if len(fields) == 2 and fields[0].isdigit() and fields[1].isdigit() and int(fields[0]) >= int(started_at):
+            installed += int(fields[1])
+    if not installed:
+        return
+    samples = (load_throughput_history(log) + [installed / duration])[-THROUGHPUT_HISTORY_LENGTH:]
+    try:
+        THROUGHPUT_HISTORY_PATH.parent.mkdir(parents=True, exist_ok=True)
+        THROUGHPUT_HISTORY_PATH.write_text(json.dumps({"dnf_installed_bytes_per_sec": samples, "updated_at": time.time()}, indent=4), encoding="utf-8")
+    except OSError as e:
+        log.warning(f"Could not save throughput history {THROUGHPUT_HISTORY_PATH}: {e}")
+    log.info(f"DNF transaction throughput: {installed / duration / 1024 / 1024:.1f} MiB/s installed.")
+
+def estimate_seconds(plan: RunPlan, logger: Optional[logging.Logger] = None) -> Tuple[float, bool]:
+    """(ETA in seconds, whether it is based on measured history rather than the default throughput)."""
+    samples = load_throughput_history(logger)
+    throughput = statistics.median(samples) if samples else DEFAULT_THROUGHPUT_BYTES_PER_SEC
+    return plan.installed_bytes / throughput, bool(samples)
+
+# --- Report ---
+
+def plan_to_dict(plan: RunPlan, logger: Optional[logging.Logger] = None) -> Dict:
+    """The plan as a JSON-serializable dict (install.py --plan --json). Sizes are in bytes, None if unknown."""
+    eta, measured = estimate_seconds(plan, logger)
+    return {
+        "phases": plan.phase_ids,
+        "dnf": {
+            "packages": list(plan.dnf.packages),
+            "groups": list(plan.dnf.groups),
+            "swaps": [{"from": from_pkg, "to": to_pkg} for from_pkg, to_pkg, _ in plan.dnf.swaps],
+            "skipped": sorted({pkg for packages in plan.dnf.already_installed.values() for pkg in packages}),
+            "unsized_packages": plan.unsized_packages,
+            "download_bytes": plan.dnf_download_bytes,
+            "installed_bytes": plan.dnf_installed_bytes,
+        },
+        "flatpak": {
+            "refs": [ref._asdict() for ref in plan.flatpak_refs],
+            "skipped": plan.flatpak_skipped,
+        },
+        "download_bytes": plan.download_bytes,
+        "installed_bytes": plan.installed_bytes,
+        "eta_seconds": round(eta),
+        "eta_from_history": measured,
+        "disk_space_ok": plan.disk_space_ok,
+        "disk_shortfalls": [{"mount": mount, "required_bytes": required, "free_bytes": free} for mount, required, free in plan.disk_shortfalls],
+    }
+
+def _format_size(size: Optional[int]) -> str:
+    if size is None:
+        return "unknown"
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024 or unit == "GiB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+def print_run_plan(plan: RunPlan, logger: Optional[logging.Logger] = None) -> None:
+    con.print_step("Run plan (dry run, nothing is changed)")
+    con.print_info(f"Phases: {', '.join(PHASES[phase_id]['name'] for phase_id in plan.phase_ids) or 'none'}")
+
+    con.print_rule("DNF")
+    if plan.dnf.packages:
+        con.print_sub_step(f"Packages to add ({len(plan.dnf.packages)}): {', '.join(plan.dnf.packages)}")
+    if plan.dnf.groups:
+        con.print_sub_step(f"Groups to add ({len(plan.dnf.groups)}): {', '.join(plan.dnf.groups)}")
+    for from_pkg, to_pkg, _ in plan.dnf.swaps:
+        con.print_sub_step(f"Swap: {from_pkg} -> {to_pkg}")
+    skipped = [pkg for packages in plan.dnf.already_installed.values() for pkg in packages]
+    if skipped:
+        con.print_sub_step(f"Already installed, skipped ({len(skipped)}): {', '.join(skipped)}")
+    if plan.unsized_packages:
+        con.print_sub_step(f"From repositories not configured yet (not sized): {', '.join(plan.unsized_packages)}")
+    con.print_sub_step(f"Download {_format_size(plan.dnf_download_bytes)}, installed size {_format_size(plan.dnf_installed_bytes)}")
+
+    con.print_rule("Flatpak")
+    for ref in plan.flatpak_refs:
+        con.print_sub_step(f"Pull {ref.ref} from {ref.remote}: download {_format_size(ref.download_bytes)}, installed {_format_size(ref.installed_bytes)}")
+    if plan.flatpak_skipped:
+        con.print_sub_step(f"Already installed, skipped ({len(plan.flatpak_skipped)}): {', '.join(plan.flatpak_skipped)}")
+    if not plan.flatpak_refs and not plan.flatpak_skipped:
+        con.print_sub_step("No Flatpak applications in the selected phases.")
+
+    con.print_rule("Totals")
+    eta, measured = estimate_seconds(plan, logger)
+    basis = "from earlier runs on this machine" if measured else f"assuming {_format_size(DEFAULT_THROUGHPUT_BYTES_PER_SEC)}/s, no history yet"
+    con.print_info(f"Download {_format_size(plan.download_bytes)}, installed size {_format_size(plan.installed_bytes)}.")
+    con.print_info(f"Estimated time: {eta / 60:.0f} min ({basis}).")
+    for mount, required, free in plan.disk_shortfalls:
+        con.print_error(f"Not enough disk space on {mount}: {_format_size(required)} needed, {_format_size(free)} free.")
+    if plan.disk_space_ok:
+        con.print_success("Enough disk space for the planned work.")
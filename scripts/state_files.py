@@ -0,0 +1,28 @@
+# Fedora-AutoEnv-Setup/scripts/state_files.py
+
+# Helpers for the JSON state files of a run (install_status.json, install_steps.json, ...).
+
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any
+
+
+def write_json_atomic(path: Path, data: Any) -> None:
+    """
+    Writes data as JSON to path by replacing the file atomically, so an interrupted save never
+    leaves a truncated file behind. On failure the temporary file is removed and the error re-raised.
+    """
+    path = Path(path)
+    temp_path = None
+    try:
+        fd, temp_path = tempfile.mkstemp(prefix=f".{path.name}.", dir=path.parent)
+        os.fchmod(fd, 0o644) # mkstemp creates 0600; keep the permissions of a normally written file
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=4)
+        os.replace(temp_path, path)
+    except BaseException: # Also e.g. TypeError from json.dump or KeyboardInterrupt
+        if temp_path is not None and os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
@@ -0,0 +1,126 @@
+# Fedora-AutoEnv-Setup/scripts/step_checkpoints.py
+
+# Step-level checkpoints inside a phase. install_status.json only knows whether a whole phase
+# is complete; this module records, per phase, which named steps (phase module STEP_NAMES)
+# have finished and the hash of the inputs they ran with, in install_steps.json:
+#   {"basic_installation": {"dnf_packages": {"input_hash": "3f2a...", "completed_at": 1760000000.0}}}
+# A rerun of a failed phase skips every step that already finished with the same inputs and
+# resumes at the first incomplete one; a step whose packages.json entries changed runs again.
+# A phase's checkpoints are cleared once the whole phase is marked complete (a copy is kept
+# with its fingerprint, see phase_fingerprints).
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Set
+
+from scripts import install_root
+from scripts import state_files
+from scripts.config import STEPS_FILE_PATH
+
+_module_logger = logging.getLogger(__name__)
+
+# Steps of concurrently running phases finish on different threads
+_checkpoints_lock = threading.RLock()
+
+
+def input_hash(inputs: Any) -> str:
+    """Stable hash of a step's inputs (JSON-serializable config values)."""
+    encoded = json.dumps(inputs, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+def _steps_file_path() -> Path:
+    """The checkpoints file of the targeted install root (STEPS_FILE_PATH for the live system)."""
+    return install_root.state_path(STEPS_FILE_PATH)
+
+def load_checkpoints(logger: Optional[logging.Logger] = None) -> Dict[str, Dict[str, Dict]]:
+    """All recorded checkpoints: phase id -> step name -> {"input_hash", "completed_at"}."""
+    log = logger or _module_logger
+    steps_path = _steps_file_path()
+    with _checkpoints_lock:
+        if not steps_path.exists():
+            return {}
+        try:
+            with open(steps_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            log.warning(f"Could not load step checkpoints '{steps_path.name}': {e}. Starting fresh.")
+            return {}
+    return data if isinstance(data, dict) else {}
+
+def _save_checkpoints(data: Dict[str, Dict[str, Dict]], log: logging.Logger) -> None:
+    steps_path = _steps_file_path()
+    try:
+        state_files.write_json_atomic(steps_path, data)
+    except (IOError, OSError) as e:
+        log.error(f"Could not save step checkpoints '{steps_path.name}': {e}")
+
+def completed_steps(phase_id: str, logger: Optional[logging.Logger] = None) -> Set[str]:
+    """Names of the steps of phase_id recorded as finished (with any inputs)."""
+    return set(load_checkpoints(logger).get(phase_id, {}))
+
+def is_step_done(phase_id: str, step: str, inputs: Any, logger: Optional[logging.Logger] = None) -> bool:
+    """True if the step finished before with the same inputs."""
+    record = load_checkpoints(logger).get(phase_id, {}).get(step)
+    return bool(record) and record.get("input_hash") == input_hash(inputs)
+
+def mark_step_done(phase_id: str, step: str, inputs: Any, logger: Optional[logging.Logger] = None) -> None:
+    log = logger or _module_logger
+    with _checkpoints_lock:
+        data = load_checkpoints(log)
+        data.setdefault(phase_id, {})[step] = {"input_hash": input_hash(inputs), "completed_at": time.time()}
+        _save_checkpoints(data, log)
+    log.debug(f"Checkpoint: step '{step}' of '{phase_id}' finished.")
+
+def phase_records(phase_id: str, logger: Optional[logging.Logger] = None) -> Dict[str, Dict]:
+    """The raw checkpoint records of phase_id (step name -> record)."""
+    return dict(load_checkpoints(logger).get(phase_id, {}))
+
+def restore_phase(phase_id: str, records: Dict[str, Dict], logger: Optional[logging.Logger] = None) -> None:
+    """Replaces the checkpoints of phase_id with records saved earlier (see phase_fingerprints)."""
+    log = logger or _module_logger
+    with _checkpoints_lock:
+        data = load_checkpoints(log)
+        data[phase_id] = dict(records)
+        _save_checkpoints(data, log)
+
+def clear_phase(phase_id: str, logger: Optional[logging.Logger] = None) -> None:
+    """Forgets the step checkpoints of phase_id (called once the whole phase is complete)."""
+    log = logger or _module_logger
+    with _checkpoints_lock:
+        data = load_checkpoints(log)
+        if data.pop(phase_id, None) is not None:
+            _save_checkpoints(data, log)
+
+
+class PhaseCheckpoints:
+    """The checkpoints of one phase run: runs steps that are not done yet and records those that succeed."""
+
+    def __init__(self, phase_id: str, logger: Optional[logging.Logger] = None, print_fn_info: Optional[Callable[[str], None]] = None):
+        self.phase_id = phase_id
+        self._log = logger or _module_logger
+        self._p_info = print_fn_info or (lambda msg: None)
+
+    def is_done(self, step: str, inputs: Any) -> bool:
+        return is_step_done(self.phase_id, step, inputs, self._log)
+
+    def mark_done(self, step: str, inputs: Any) -> None:
+        mark_step_done(self.phase_id, step, inputs, self._log)
+
+    def run_step(self, step: str, inputs: Any, fn: Callable[[], bool]) -> bool:
+        """Runs fn unless step already finished with these inputs. A successful run is recorded."""
+        if self.is_done(step, inputs):
+            self._log.info(f"Step '{step}' of '{self.phase_id}' already done with the same inputs; skipping it.")
+            self._p_info(f"Step '{step}' already done; skipping.")
+            return True
+        ok = bool(fn())
+        if ok:
+            self.mark_done(step, inputs)
+        return ok
+
+    def step(self, step: str, inputs: Any, fn: Callable[[], bool]) -> Callable[[], bool]:
+        """run_step as a callable, e.g. for a task_scheduler.PhaseTask."""
+        return lambda: self.run_step(step, inputs, fn)
@@ -1,14 +1,26 @@
 # Fedora-AutoEnv-Setup/scripts/system_utils.py
 
+import asyncio
+import contextlib
 import subprocess
 import os
+import pwd
 import shlex
 import sys
+import threading
 import time # Added for backup_system_file
+from collections import deque
 from pathlib import Path
-from typing import List, Optional, Union, Dict, Callable
+from typing import List, Optional, Union, Dict, Callable, Tuple, Deque, IO, Iterable, NamedTuple, Set
 import logging
 
+from scripts import command_cache
+from scripts import exec_trace
+from scripts import flatpak_index
+from scripts import install_root
+from scripts import package_index
+from scripts import privileged_worker
+
 try:
     from scripts.logger_utils import app_logger as default_script_logger
 except ImportError:
@@ -22,26 +34,29 @@ PRINT_FN_SUB_STEP_DEFAULT: Callable[[str], None] = lambda msg: print(f"  SUB: {m
 PRINT_FN_WARNING_DEFAULT: Callable[[str], None] = lambda msg: print(f"WARNING: {msg}", file=sys.stderr)
 PRINT_FN_SUCCESS_DEFAULT: Callable[[str], None] = lambda msg: print(f"SUCCESS: {msg}")
 
+# Number of trailing output lines kept per stream when a command runs with stream_output=True.
+# Only this tail is held in memory and attached to CalledProcessError.
+STREAM_TAIL_LINES = 200
 
-def run_command(
-    command: Union[str, List[str]],
-    capture_output: bool = False,
-    check: bool = True,
-    shell: bool = False,
-    run_as_user: Optional[str] = None,
-    cwd: Optional[Union[str, Path]] = None,
-    env_vars: Optional[Dict[str, str]] = None,
-    print_fn_info: Optional[Callable[[str], None]] = None,
-    print_fn_error: Optional[Callable[[str], None]] = None,
-    print_fn_sub_step: Optional[Callable[[str], None]] = None,
-    logger: Optional[logging.Logger] = None
-) -> subprocess.CompletedProcess:
-    log = logger or default_script_logger
-    _p_info = print_fn_info or PRINT_FN_INFO_DEFAULT
-    _p_error = print_fn_error or PRINT_FN_ERROR_DEFAULT
-    _p_sub = print_fn_sub_step or PRINT_FN_SUB_STEP_DEFAULT
-    # _p_warning and _p_success are not used directly in this function but this pattern would apply.
+# Held by run_command around every command that writes the rpm database (see command_cache).
+# One lock per install root: each root has its own rpm database, so roots do not queue behind each other.
+_RPMDB_LOCKS: Dict[str, threading.RLock] = {}
+_rpmdb_locks_guard = threading.Lock()
+
+def _rpmdb_lock() -> threading.RLock:
+    with _rpmdb_locks_guard:
+        return _RPMDB_LOCKS.setdefault(install_root.key(), threading.RLock())
 
+
+def _prepare_command(
+    command: Union[str, List[str]],
+    shell: bool,
+    run_as_user: Optional[str],
+    env_vars: Optional[Dict[str, str]],
+    log: logging.Logger,
+    _p_error: Callable[[str], None]
+) -> Tuple[Union[str, List[str]], bool, str, Dict[str, str]]:
+    """Builds the command, shell flag, display string and environment shared by the sync and async runners."""
     command_to_execute: Union[str, List[str]]
     effective_shell = shell
     display_command_str: str
@@ -62,7 +77,17 @@ def run_command(
             if _p_error: _p_error("Invalid command type for 'run_as_user'. Must be string or list.")
             raise TypeError("Command must be a string or list of strings for run_as_user execution via bash -c.")
 
-        command_to_execute = ["sudo", "-Hn", "-u", run_as_user, "bash", "-c", cmd_str_for_bash_c]
+        root = install_root.current()
+        if root is not None:
+            # The user exists in the root's passwd, not necessarily on the host: switch to its ids directly
+            entry = install_root.passwd_entry(root, run_as_user)
+            if entry is None:
+                log.error(f"User '{run_as_user}' does not exist in install root '{root}'.")
+                if _p_error: _p_error(f"User '{run_as_user}' does not exist in install root '{root}'.")
+                raise ValueError(f"User '{run_as_user}' does not exist in install root '{root}'.")
+            command_to_execute = install_root.user_command_prefix(entry, root) + ["bash", "-c", cmd_str_for_bash_c]
+        else:
+            command_to_execute = ["sudo", "-Hn", "-u", run_as_user, "bash", "-c", cmd_str_for_bash_c]
         effective_shell = False # sudo -u bash -c handles the shell part for the user command
         display_command_str = f"(as {run_as_user}) {cmd_str_for_bash_c}"
     else:
@@ -78,81 +103,530 @@ def run_command(
             if _p_error: _p_error("Invalid command type. Must be string or list.")
             raise TypeError("Command must be a string or list of strings.")
 
-    log.info(f"Executing: {display_command_str}")
-    _p_info(f"Executing: {display_command_str}") # This will be a no-op if _p_info is PRINT_FN_INFO_DEFAULT
-
-
-    try:
-        process = subprocess.run(
-            command_to_execute,
-            check=False, # We will check manually to provide better error logging via CalledProcessError
-            capture_output=capture_output,
-            text=True,
-            shell=effective_shell,
-            cwd=str(cwd) if cwd else None,
-            env=current_env
-        )
-
-        if process.stdout and process.stdout.strip():
-            log.debug(f"CMD STDOUT for '{display_command_str}':\n{process.stdout.strip()}")
-            if capture_output: # Check if output should be captured (and thus potentially printed)
-                stdout_summary = (process.stdout.strip()[:150] + '...') if len(process.stdout.strip()) > 150 else process.stdout.strip()
-                _p_sub(f"STDOUT: {stdout_summary}") # This will be a no-op if _p_sub is PRINT_FN_SUB_STEP_DEFAULT
-
-
-        if process.stderr and process.stderr.strip():
-            # Log stderr as warning, as some commands use stderr for non-fatal info
-            log.warning(f"CMD STDERR for '{display_command_str}':\n{process.stderr.strip()}")
-            if capture_output: # Check if output should be captured
-                stderr_summary = (process.stderr.strip()[:150] + '...') if len(process.stderr.strip()) > 150 else process.stderr.strip()
-                _p_sub(f"STDERR: {stderr_summary}") # This will be a no-op if _p_sub is PRINT_FN_SUB_STEP_DEFAULT
-
-
+    return command_to_execute, effective_shell, display_command_str, current_env
+
+def _check_command_result(
+    process: subprocess.CompletedProcess,
+    command_to_execute: Union[str, List[str]],
+    display_command_str: str,
+    capture_output: bool,
+    check: bool,
+    log: logging.Logger,
+    _p_sub: Callable[[str], None],
+    streamed: bool = False
+) -> None:
+    """
+    Logs a finished command's output and raises CalledProcessError if check is set and it failed.
+    For streamed commands the output was already logged line by line, and process.stdout/stderr
+    only hold the tail kept in the ring buffer.
+    """
+    if streamed:
         if check and process.returncode != 0:
-            # Construct a more informative error message for CalledProcessError
-            error_message = f"Command '{display_command_str}' returned non-zero exit status {process.returncode}."
-            log.error(error_message)
+            log.error(f"Command '{display_command_str}' returned non-zero exit status {process.returncode}.")
             if process.stderr:
-                log.error(f"STDERR: {process.stderr.strip()}")
-            if process.stdout: # Also log stdout on error if it exists
-                log.error(f"STDOUT: {process.stdout.strip()}")
-            
-            # Raise the exception so callers can handle it if needed
-            # The cmd attribute of CalledProcessError is args, which is command_to_execute
+                log.error(f"STDERR (tail):\n{process.stderr.strip()}")
+            if process.stdout:
+                log.error(f"STDOUT (tail):\n{process.stdout.strip()}")
             raise subprocess.CalledProcessError(
                 returncode=process.returncode,
-                cmd=command_to_execute, # Use the actual command list/string passed to Popen
+                cmd=command_to_execute,
                 output=process.stdout,
                 stderr=process.stderr
             )
+        return
 
-        return process
+    if process.stdout and process.stdout.strip():
+        log.debug(f"CMD STDOUT for '{display_command_str}':\n{process.stdout.strip()}")
+        if capture_output: # Check if output should be captured (and thus potentially printed)
+            stdout_summary = (process.stdout.strip()[:150] + '...') if len(process.stdout.strip()) > 150 else process.stdout.strip()
+            _p_sub(f"STDOUT: {stdout_summary}") # This will be a no-op if _p_sub is PRINT_FN_SUB_STEP_DEFAULT
 
-    except subprocess.CalledProcessError as e: # This will re-raise if check=True caused it above
-        # If check=False and we manually raise, this block might not be hit as expected unless subprocess.run(check=True) itself is used.
-        # The above manual raise should be sufficient. This is a fallback.
-        if not (check and process.returncode !=0) : # Avoid double logging if already handled by manual check.
-            log.error(f"Command failed: '{subprocess.list2cmdline(e.cmd) if isinstance(e.cmd, list) else e.cmd}' (Exit code: {e.returncode})") 
-            if e.stdout: log.error(f"Failed command STDOUT from exception:\n{e.stdout.strip()}")
-            if e.stderr: log.error(f"Failed command STDERR from exception:\n{e.stderr.strip()}")
-        if _p_error: _p_error(f"Command failed: '{subprocess.list2cmdline(e.cmd) if isinstance(e.cmd, list) else e.cmd}' (Exit code: {e.returncode}). Check logs.")
-        raise
-    except FileNotFoundError:
+
+    if process.stderr and process.stderr.strip():
+        # Log stderr as warning, as some commands use stderr for non-fatal info
+        log.warning(f"CMD STDERR for '{display_command_str}':\n{process.stderr.strip()}")
+        if capture_output: # Check if output should be captured
+            stderr_summary = (process.stderr.strip()[:150] + '...') if len(process.stderr.strip()) > 150 else process.stderr.strip()
+            _p_sub(f"STDERR: {stderr_summary}") # This will be a no-op if _p_sub is PRINT_FN_SUB_STEP_DEFAULT
+
+
+    if check and process.returncode != 0:
+        # Construct a more informative error message for CalledProcessError
+        error_message = f"Command '{display_command_str}' returned non-zero exit status {process.returncode}."
+        log.error(error_message)
+        if process.stderr:
+            log.error(f"STDERR: {process.stderr.strip()}")
+        if process.stdout: # Also log stdout on error if it exists
+            log.error(f"STDOUT: {process.stdout.strip()}")
+
+        # Raise the exception so callers can handle it if needed
+        # The cmd attribute of CalledProcessError is args, which is command_to_execute
+        raise subprocess.CalledProcessError(
+            returncode=process.returncode,
+            cmd=command_to_execute, # Use the actual command list/string passed to Popen
+            output=process.stdout,
+            stderr=process.stderr
+        )
+
+def _report_command_exception(
+    exc: BaseException,
+    command_to_execute: Union[str, List[str]],
+    display_command_str: str,
+    log: logging.Logger,
+    _p_error: Callable[[str], None]
+) -> None:
+    """Logs and prints an exception raised while running a command. The caller re-raises it."""
+    if isinstance(exc, subprocess.CalledProcessError):
+        # Output was already logged by _check_command_result before the exception was raised.
+        if _p_error: _p_error(f"Command failed: '{subprocess.list2cmdline(exc.cmd) if isinstance(exc.cmd, list) else exc.cmd}' (Exit code: {exc.returncode}). Check logs.")
+    elif isinstance(exc, FileNotFoundError):
         cmd_part_not_found = ""
         # Try to determine which part of the command was not found
         if isinstance(command_to_execute, list) and command_to_execute:
             cmd_part_not_found = str(command_to_execute[0])
         elif isinstance(command_to_execute, str):
             cmd_part_not_found = shlex.split(command_to_execute)[0] if command_to_execute else ""
-        
-        log.error(f"Command executable not found: '{cmd_part_not_found}' (Full command attempted: '{display_command_str}')", exc_info=True)
+
+        log.error(f"Command executable not found: '{cmd_part_not_found}' (Full command attempted: '{display_command_str}')", exc_info=exc)
         if _p_error: _p_error(f"Command executable not found: '{cmd_part_not_found}'. Ensure it's installed and in PATH.")
-        raise
-    except Exception as e: # Catch-all for other unexpected issues
-        log.error(f"An unexpected error occurred while executing command '{display_command_str}': {e}", exc_info=True)
+    else: # Catch-all for other unexpected issues
+        log.error(f"An unexpected error occurred while executing command '{display_command_str}': {exc}", exc_info=exc)
         if _p_error: _p_error(f"An unexpected error occurred while executing '{display_command_str}'. Check logs.")
-        raise
 
+def _make_stream_line_handler(
+    display_command_str: str,
+    stream_name: str,
+    tail: Deque[str],
+    log: logging.Logger,
+    _p_sub: Callable[[str], None]
+) -> Callable[[str], None]:
+    """
+    Returns a callback that logs, prints and keeps the tail of one output stream, line by line.
+    Lines are always logged; they are forwarded to print_fn_sub_step only when the caller passed one.
+    """
+    log_fn = log.debug if stream_name == "STDOUT" else log.warning # Same levels as the buffered path
+    forward = _p_sub is not None and _p_sub is not PRINT_FN_SUB_STEP_DEFAULT
+
+    def _handle_line(line: str) -> None:
+        tail.append(line)
+        stripped = line.rstrip()
+        if not stripped:
+            return
+        log_fn(f"CMD {stream_name} for '{display_command_str}': {stripped}")
+        if forward:
+            _p_sub((stripped[:150] + '...') if len(stripped) > 150 else stripped)
+
+    return _handle_line
+
+def _run_streaming(
+    command_to_execute: Union[str, List[str]],
+    effective_shell: bool,
+    cwd: Optional[Union[str, Path]],
+    current_env: Dict[str, str],
+    display_command_str: str,
+    tail_lines: int,
+    log: logging.Logger,
+    _p_sub: Callable[[str], None]
+) -> Tuple[subprocess.CompletedProcess, Optional[Dict[str, float]]]:
+    """
+    Runs a command while forwarding its output line by line, keeping only a bounded tail in memory.
+    Returns the CompletedProcess and the child's resource usage.
+    """
+    stdout_tail: Deque[str] = deque(maxlen=tail_lines)
+    stderr_tail: Deque[str] = deque(maxlen=tail_lines)
+
+    proc = subprocess.Popen(
+        command_to_execute,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        errors="replace",
+        bufsize=1,
+        shell=effective_shell,
+        cwd=str(cwd) if cwd else None,
+        env=current_env
+    )
+
+    def _pump(stream: IO[str], handler: Callable[[str], None]) -> None:
+        with stream:
+            for line in stream:
+                handler(line)
+
+    # One reader per pipe so a chatty stderr can never block on a full stdout pipe (or vice versa)
+    readers = [
+        threading.Thread(target=_pump, args=(proc.stdout, _make_stream_line_handler(display_command_str, "STDOUT", stdout_tail, log, _p_sub)), daemon=True),
+        threading.Thread(target=_pump, args=(proc.stderr, _make_stream_line_handler(display_command_str, "STDERR", stderr_tail, log, _p_sub)), daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+    for reader in readers:
+        reader.join()
+    returncode, rusage = privileged_worker.wait_with_rusage(proc)
+
+    return subprocess.CompletedProcess(
+        args=command_to_execute,
+        returncode=returncode,
+        stdout="".join(stdout_tail),
+        stderr="".join(stderr_tail)
+    ), privileged_worker.rusage_summary(rusage)
+
+def _run_buffered(
+    command_to_execute: Union[str, List[str]],
+    capture_output: bool,
+    effective_shell: bool,
+    cwd: Optional[Union[str, Path]],
+    current_env: Dict[str, str]
+) -> Tuple[subprocess.CompletedProcess, Optional[Dict[str, float]]]:
+    """subprocess.run equivalent that also returns the child's resource usage (reaped with wait4)."""
+    pipe = subprocess.PIPE if capture_output else None
+    proc = subprocess.Popen(
+        command_to_execute,
+        stdout=pipe,
+        stderr=pipe,
+        text=True,
+        shell=effective_shell,
+        cwd=str(cwd) if cwd else None,
+        env=current_env
+    )
+    stdout, stderr, rusage = privileged_worker.communicate_with_rusage(proc)
+    return subprocess.CompletedProcess(proc.args, proc.returncode, stdout, stderr), privileged_worker.rusage_summary(rusage)
+
+# --- Privileged Workers ---
+# When started, commands of the form ["sudo", <argv>...] go to a long-lived root worker and
+# run_as_user commands go to a per-user worker, both executing argv directly. See
+# scripts/privileged_worker.py. Without workers everything spawns sudo as before.
+# enable_privileged_workers only arms them: they start (and sudo asks for the password) on the
+# first privileged command or when phases start running, never just for showing the menu.
+
+_worker_settings: Dict[str, Optional[str]] = {}
+_workers_started = False
+_workers_start_lock = threading.Lock()
+
+def enable_privileged_workers(
+    target_user: Optional[str] = None,
+    logger: Optional[logging.Logger] = None
+) -> None:
+    """Arms the workers for this run; they start lazily, see ensure_privileged_workers."""
+    global _workers_started
+    with _workers_start_lock:
+        _worker_settings.clear()
+        _worker_settings["target_user"] = target_user
+        _workers_started = False
+    (logger or default_script_logger).debug("Privileged workers enabled; they start on first privileged use.")
+
+def ensure_privileged_workers(logger: Optional[logging.Logger] = None) -> None:
+    """Starts the enabled workers, once per run. A no-op if they were not enabled or were already started."""
+    global _workers_started
+    if _workers_started or not _worker_settings:
+        return
+    with _workers_start_lock:
+        if _workers_started or not _worker_settings:
+            return
+        start_privileged_workers(_worker_settings.get("target_user"), logger=logger)
+        _workers_started = True # Also when sudo failed: commands then spawn sudo individually
+
+def start_privileged_workers(
+    target_user: Optional[str] = None,
+    logger: Optional[logging.Logger] = None
+) -> bool:
+    """Starts the root worker and, if given, the worker for target_user. Returns True if the root worker runs."""
+    log = logger or default_script_logger
+    root_ok = privileged_worker.start_worker(None, logger=log)
+    if not root_ok:
+        log.warning("Root privileged worker unavailable; privileged commands will spawn sudo individually.")
+    if target_user and target_user != _current_username():
+        if not privileged_worker.start_worker(target_user, logger=log):
+            log.warning(f"Privileged worker for '{target_user}' unavailable; user commands will spawn sudo individually.")
+    return root_ok
+
+def stop_privileged_workers() -> None:
+    """Stops all privileged workers started in this run."""
+    global _workers_started
+    with _workers_start_lock:
+        _worker_settings.clear()
+        _workers_started = False
+    privileged_worker.stop_workers()
+
+def get_query_cache_stats() -> Dict[str, int]:
+    """Hit/miss counters of the read-only query cache, for tuning which commands to mark read_only."""
+    return command_cache.query_cache.stats()
+
+def _current_username() -> Optional[str]:
+    try:
+        return pwd.getpwuid(os.geteuid()).pw_name
+    except KeyError:
+        return None
+
+def _worker_route(
+    command: Union[str, List[str]],
+    shell: bool,
+    run_as_user: Optional[str]
+) -> Optional[Tuple[privileged_worker.PrivilegedWorker, List[str]]]:
+    """Returns the worker and argv to use for a command, or None if it should be spawned directly."""
+    if run_as_user and install_root.current() is not None:
+        return None # Per-user workers run as the host's user; users of a root get setpriv (_prepare_command)
+    if run_as_user:
+        ensure_privileged_workers()
+        worker = privileged_worker.get_worker(run_as_user)
+        if worker is None:
+            return None
+        if isinstance(command, list):
+            return worker, [str(item) for item in command] # argv as-is, no bash -c re-joining
+        return worker, ["bash", "-c", command]
+
+    if shell or not isinstance(command, list) or len(command) < 2:
+        return None
+    # Only a plain "sudo <cmd>" prefix; sudo options (e.g. -u) keep their own semantics
+    if str(command[0]) != "sudo" or str(command[1]).startswith("-"):
+        return None
+    ensure_privileged_workers()
+    worker = privileged_worker.get_worker(None)
+    if worker is None:
+        return None
+    return worker, [str(item) for item in command[1:]]
+
+def _run_via_worker(
+    worker: privileged_worker.PrivilegedWorker,
+    argv: List[str],
+    command_to_execute: Union[str, List[str]],
+    cwd: Optional[Union[str, Path]],
+    env_vars: Optional[Dict[str, str]],
+    capture_output: bool,
+    stream_output: bool,
+    tail_lines: int,
+    display_command_str: str,
+    log: logging.Logger,
+    _p_sub: Callable[[str], None]
+) -> Tuple[subprocess.CompletedProcess, Optional[Dict[str, float]]]:
+    """Executes argv in a privileged worker. Returns a CompletedProcess like subprocess.run would, and the child's resource usage."""
+    log.debug(f"Dispatching to privileged worker ({worker.label}): {subprocess.list2cmdline(argv)}")
+    on_line = None
+    stdout_tail: Deque[str] = deque(maxlen=tail_lines)
+    stderr_tail: Deque[str] = deque(maxlen=tail_lines)
+    if stream_output:
+        handlers = {
+            "stdout": _make_stream_line_handler(display_command_str, "STDOUT", stdout_tail, log, _p_sub),
+            "stderr": _make_stream_line_handler(display_command_str, "STDERR", stderr_tail, log, _p_sub),
+        }
+        on_line = lambda stream_name, line: handlers[stream_name](line)
+
+    result = worker.request(
+        "run", on_line=on_line, argv=argv,
+        cwd=str(cwd) if cwd else None,
+        env=env_vars or {}, # The worker already has the environment sudo gave it
+        capture=capture_output, stream=stream_output
+    )
+    if stream_output:
+        stdout_text, stderr_text = "".join(stdout_tail), "".join(stderr_tail)
+    else:
+        stdout_text, stderr_text = result.get("stdout"), result.get("stderr")
+    return subprocess.CompletedProcess(
+        args=command_to_execute,
+        returncode=result["returncode"],
+        stdout=stdout_text,
+        stderr=stderr_text
+    ), result.get("rusage")
+
+def _worker_file_op(
+    user: Optional[str],
+    op: str,
+    log: logging.Logger,
+    **payload
+) -> Optional[Dict]:
+    """
+    Runs a file operation in the root (user=None) or per-user worker.
+    Returns None when no worker is available so the caller can use its subprocess path.
+    Errors from the operation itself (e.g. PermissionError) propagate.
+    """
+    if user and install_root.current() is not None:
+        return None
+    ensure_privileged_workers(log)
+    worker = privileged_worker.get_worker(user)
+    if worker is None:
+        return None
+    try:
+        log.debug(f"Privileged worker ({worker.label}) file operation '{op}': {payload.get('path')}")
+        return worker.request(op, **payload)
+    except privileged_worker.WorkerUnavailableError as e_worker:
+        log.warning(f"{e_worker} Falling back to spawning commands for '{op}'.")
+        return None
+
+def run_command(
+    command: Union[str, List[str]],
+    capture_output: bool = False,
+    check: bool = True,
+    shell: bool = False,
+    run_as_user: Optional[str] = None,
+    cwd: Optional[Union[str, Path]] = None,
+    env_vars: Optional[Dict[str, str]] = None,
+    print_fn_info: Optional[Callable[[str], None]] = None,
+    print_fn_error: Optional[Callable[[str], None]] = None,
+    print_fn_sub_step: Optional[Callable[[str], None]] = None,
+    logger: Optional[logging.Logger] = None,
+    stream_output: bool = False,
+    tail_lines: int = STREAM_TAIL_LINES,
+    read_only: bool = False
+) -> subprocess.CompletedProcess:
+    """
+    Runs a command with logging and optional CalledProcessError on failure.
+    With stream_output=True the output is always piped, forwarded to the logger and
+    print_fn_sub_step as it arrives, and only the last tail_lines lines per stream are kept.
+    With read_only=True (queries like 'rpm -q') a captured result is memoized for the run and
+    reused until a mutating command (dnf install, flatpak remote-add, ...) invalidates it.
+    """
+    log = logger or default_script_logger
+    _p_info = print_fn_info or PRINT_FN_INFO_DEFAULT
+    _p_error = print_fn_error or PRINT_FN_ERROR_DEFAULT
+    _p_sub = print_fn_sub_step or PRINT_FN_SUB_STEP_DEFAULT
+    # _p_warning and _p_success are not used directly in this function but this pattern would apply.
+
+    command = install_root.adapt_command(command) # dnf/rpm/flatpak target the install root, if any
+    command_to_execute, effective_shell, display_command_str, current_env = _prepare_command(
+        command, shell, run_as_user, env_vars, log, _p_error
+    )
+
+    cache_key = None
+    if read_only and capture_output and not stream_output and cwd is None and not env_vars:
+        cache_key = command_cache.make_key(command, run_as_user)
+        cached = command_cache.query_cache.get(cache_key)
+        if cached is not None:
+            log.debug(f"Query cache hit: {display_command_str} (exit code {cached.returncode})")
+            try: # Same logging and error reporting as an uncached run
+                _check_command_result(cached, command_to_execute, display_command_str, capture_output, check, log, _p_sub)
+            except subprocess.CalledProcessError as e:
+                _report_command_exception(e, command_to_execute, display_command_str, log, _p_error)
+                raise
+            return cached
+
+    log.info(f"Executing: {display_command_str}")
+    _p_info(f"Executing: {display_command_str}") # This will be a no-op if _p_info is PRINT_FN_INFO_DEFAULT
+
+
+    # Commands that write the rpm database (dnf transactions, rpm --import) run one at a time per root, so
+    # phases running concurrently queue here instead of failing on or interleaving with dnf's lock.
+    rpmdb_lock = _rpmdb_lock() if not read_only and "rpm" in command_cache.command_families(command, shell) else contextlib.nullcontext()
+    with rpmdb_lock:
+        timer = exec_trace.command_timer()
+        process = None
+        via = "spawn"
+        try:
+            route = _worker_route(command, shell, run_as_user)
+            if route:
+                try:
+                    process, rusage = _run_via_worker(
+                        route[0], route[1], command_to_execute, cwd, env_vars, capture_output,
+                        stream_output, tail_lines, display_command_str, log, _p_sub
+                    )
+                    via = "worker"
+                except privileged_worker.WorkerUnavailableError as e_worker:
+                    log.warning(f"{e_worker} Spawning '{display_command_str}' directly.")
+
+            if process is None and stream_output:
+                process, rusage = _run_streaming(
+                    command_to_execute, effective_shell, cwd, current_env,
+                    display_command_str, tail_lines, log, _p_sub
+                )
+            elif process is None:
+                # check=False semantics: we check manually to provide better error logging via CalledProcessError
+                process, rusage = _run_buffered(command_to_execute, capture_output, effective_shell, cwd, current_env)
+            exec_trace.record_command(timer, display_command_str, process.returncode, rusage, via)
+            if cache_key is not None:
+                command_cache.query_cache.put(cache_key, process)
+            elif not read_only:
+                command_cache.query_cache.note_executed(command, shell) # Even failed transactions may have changed state
+            _check_command_result(process, command_to_execute, display_command_str, capture_output, check, log, _p_sub, streamed=stream_output)
+            return process
+
+        except Exception as e:
+            if process is None:
+                exec_trace.record_command(timer, display_command_str, None, None, via)
+            _report_command_exception(e, command_to_execute, display_command_str, log, _p_error)
+            raise
+
+# --- User Identity ---
+# Identity lookups are answered in-process through pwd (NSS, same source as getent) and
+# memoized for the run, so helpers asking for the same user's home or shell do not fork.
+# Inside an install root they come from the root's /etc/passwd, with the home under the root.
+
+class UserIdentity(NamedTuple):
+    """The passwd facts the phases need about a user."""
+    user: str
+    uid: int
+    gid: int
+    home: Path
+    shell: str
+
+# Identities by (install_root.key(), username); target users by install_root.key()
+_identity_cache: Dict[Tuple[str, str], UserIdentity] = {}
+_identity_lock = threading.Lock()
+_target_user_cache: Dict[str, str] = {}
+
+def _lookup_identity(username: str) -> Optional[UserIdentity]:
+    root = install_root.current()
+    if root is not None:
+        entry = install_root.passwd_entry(root, username)
+        if entry is None:
+            return None
+        return UserIdentity(entry.user, entry.uid, entry.gid, install_root.path(entry.home, root), entry.shell)
+    try:
+        entry = pwd.getpwnam(username)
+    except KeyError:
+        return None
+    return UserIdentity(entry.pw_name, entry.pw_uid, entry.pw_gid, Path(entry.pw_dir), entry.pw_shell)
+
+def get_user_identity(
+    username: str,
+    refresh: bool = False,
+    logger: Optional[logging.Logger] = None
+) -> Optional[UserIdentity]:
+    """Returns the memoized identity record for username, or None if the user does not exist."""
+    log = logger or default_script_logger
+    cache_key = (install_root.key(), username)
+    with _identity_lock:
+        if not refresh and cache_key in _identity_cache:
+            return _identity_cache[cache_key]
+    identity = _lookup_identity(username)
+    if identity is None:
+        log.debug(f"User '{username}' not found in the passwd database of '{install_root.key() or '/'}'.")
+        return None
+    with _identity_lock:
+        _identity_cache[cache_key] = identity
+    return identity
+
+def owner_spec(username: str, logger: Optional[logging.Logger] = None) -> str:
+    """'uid:gid' of username for chown (numeric, so it also holds for users of an install root)."""
+    identity = get_user_identity(username, logger=logger)
+    return f"{identity.uid}:{identity.gid}" if identity is not None else f"{username}:{username}"
+
+def clear_identity_cache(username: Optional[str] = None) -> None:
+    """Forgets memoized identities (all, or one user's), e.g. after chsh or usermod."""
+    with _identity_lock:
+        if username is None:
+            _identity_cache.clear()
+            _target_user_cache.clear()
+        else:
+            for cache_key in [cache_key for cache_key in _identity_cache if cache_key[1] == username]:
+                del _identity_cache[cache_key]
+
+# Account-changing commands run through run_command (usermod, chsh, ...) also drop memoized identities
+command_cache.query_cache.register_invalidation_hook("getent", clear_identity_cache)
+
+def _root_target_user(root: Path, log: logging.Logger, _p_warning: Callable[[str], None]) -> Optional[str]:
+    """The user whose home is provisioned inside an install root: the invoking user if the root has
+    an account of that name, otherwise the root's first login account."""
+    invoking_user = os.environ.get("SUDO_USER") if os.geteuid() == 0 else _current_username()
+    if invoking_user and invoking_user != "root" and install_root.passwd_entry(root, invoking_user) is not None:
+        log.info(f"Target user in install root '{root}': {invoking_user} (same name as the invoking user)")
+        return invoking_user
+    regular_users = install_root.regular_users(root)
+    if regular_users:
+        log.info(f"Target user in install root '{root}': {regular_users[0].user} (its first login account)")
+        return regular_users[0].user
+    log.warning(f"Install root '{root}' has no login account; user-level steps (dotfiles) are skipped.")
+    if _p_warning: _p_warning(f"Install root '{root}' has no login account; user-level steps are skipped.")
+    return None
+
+@exec_trace.traced_helper
 def get_target_user(
     logger: Optional[logging.Logger] = None,
     print_fn_info: Optional[Callable[[str], None]] = None,
@@ -164,51 +638,60 @@ def get_target_user(
     _p_error = print_fn_error or PRINT_FN_ERROR_DEFAULT
     _p_warning = print_fn_warning or PRINT_FN_WARNING_DEFAULT
 
+    cache_key = install_root.key()
+    if cache_key in _target_user_cache:
+        return _target_user_cache[cache_key]
+
+    root = install_root.current()
+    if root is not None:
+        target_user = _root_target_user(root, log, _p_warning)
+        if target_user:
+            _target_user_cache[cache_key] = target_user
+        return target_user
+
     if os.geteuid() == 0: 
         target_user = os.environ.get("SUDO_USER")
         if not target_user:
             log.error("Script is running as root, but SUDO_USER environment variable is not set.")
             if _p_error: _p_error("Script is running as root, but SUDO_USER environment variable is not set. Cannot determine the target user.")
             return None
-        try:
-            # Verify SUDO_USER is a real user
-            run_command(
-                ["id", "-u", target_user],
-                capture_output=True, check=True, logger=log,
-                print_fn_info=None, print_fn_error=_p_error 
-            )
-            log.info(f"Target user determined: {target_user} (from SUDO_USER with root privileges)")
-            return target_user
-        except (subprocess.CalledProcessError, FileNotFoundError):
+        # Verify SUDO_USER is a real user
+        if get_user_identity(target_user, logger=log) is None:
             log.error(f"The user '{target_user}' (from SUDO_USER) does not appear to be a valid system user.")
             if _p_error: _p_error(f"The user '{target_user}' (from SUDO_USER) does not appear to be a valid system user.")
             return None
+        log.info(f"Target user determined: {target_user} (from SUDO_USER with root privileges)")
+        _target_user_cache[cache_key] = target_user
+        return target_user
     else: # Not root
         try:
             current_user = os.getlogin()
         except OSError: 
             # Fallback if os.getlogin() fails (e.g., in some non-interactive environments)
-            import pwd
-            try:
-                current_user = pwd.getpwuid(os.getuid())[0]
-                log.info(f"os.getlogin() failed, using UID's username: {current_user}")
-            except Exception as e_pwd:
-                log.error(f"Could not determine current user: os.getlogin() failed and pwd.getpwuid() failed: {e_pwd}")
+            current_user = _current_username()
+            if current_user is None:
+                log.error("Could not determine current user: os.getlogin() failed and pwd.getpwuid() failed.")
                 if _p_error: _p_error("Could not determine current user.")
                 return None
+            log.info(f"os.getlogin() failed, using UID's username: {current_user}")
         
         log.warning(f"Script is not running as root. Operations will target the current user ({current_user}).")
         if _p_warning and _p_warning is not PRINT_FN_WARNING_DEFAULT: _p_warning(f"Script is not running as root. Operations will target the current user ({current_user}).")
+        _target_user_cache[cache_key] = current_user
         return current_user
 
 # --- Filesystem & User Info ---
 
+@exec_trace.traced_helper
 def is_package_installed_rpm(
     package_name: str,
     logger: Optional[logging.Logger] = None,
     print_fn_info: Optional[Callable[[str], None]] = None # Note: Changed from default PRINT_FN_INFO_DEFAULT to None for quieter internal use
 ) -> bool:
-    """Checks if a DNF package is already installed using 'rpm -q'."""
+    """
+    Checks if a DNF package is already installed. Answered from the shared installed-package
+    index (one rpm database snapshot per run); falls back to 'rpm -q' if the index cannot load.
+    """
     log = logger or default_script_logger
     _p_info = print_fn_info or (lambda msg: None) 
 
@@ -216,13 +699,31 @@ def is_package_installed_rpm(
         log.debug("Empty package name passed to is_package_installed_rpm.")
         return False
     log.debug(f"Checking if package '{package_name}' is installed via RPM.")
+    try:
+        installed = package_index.get_installed_package_index(log).is_installed(package_name)
+    except FileNotFoundError:
+        log.error("'rpm' command not found. Cannot accurately check if package is installed.", exc_info=True)
+        raise
+    except Exception as e_index:
+        log.warning(f"Installed package index unavailable ({e_index}); falling back to 'rpm -q'.")
+        installed = None
+    if installed is not None:
+        if installed:
+            log.info(f"RPM package '{package_name}' is already installed.")
+            if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None:
+                 _p_info(f"Package '{package_name}' is already installed.")
+        else:
+            log.info(f"RPM package '{package_name}' is not installed.")
+        return installed
+
     try:
         proc = run_command(
             ["rpm", "-q", package_name],
             capture_output=True,
             check=False, # Non-zero means not installed or error
             print_fn_info=None, # Be quiet for this internal check, _p_info below is conditional
-            logger=log
+            logger=log,
+            read_only=True
         )
         if proc.returncode == 0:
             log.info(f"RPM package '{package_name}' is already installed.")
@@ -242,51 +743,30 @@ def is_package_installed_rpm(
         log.warning(f"Error checking if RPM package '{package_name}' is installed: {e}", exc_info=True)
         return False # Assume not installed on other errors to be safe for install logic.
 
+@exec_trace.traced_helper
 def get_user_home_dir(
     username: str,
     logger: Optional[logging.Logger] = None,
     print_fn_error: Optional[Callable[[str], None]] = None
 ) -> Optional[Path]:
-    """Gets the home directory for the specified username using getent."""
+    """Gets the home directory for the specified username from the memoized passwd identity."""
     log = logger or default_script_logger
     _p_error = print_fn_error or PRINT_FN_ERROR_DEFAULT
     
     log.debug(f"Getting home directory for user '{username}'.")
-    try:
-        cmd = f"getent passwd {shlex.quote(username)}"
-        process = run_command(
-            cmd, shell=True, # Using shell=True as getent is simple and username is quoted
-            capture_output=True, check=True,
-            print_fn_info=None, # Quiet for this internal check
-            print_fn_error=_p_error, # Pass error printer for run_command
-            logger=log
-        )
-        passwd_line = process.stdout.strip()
-        if not passwd_line: # Should be caught by check=True if user not found
-            log.error(f"User '{username}' not found via getent (empty output after successful command).")
-            if _p_error: _p_error(f"Could not find user '{username}' via getent.")
-            return None
-
-        home_dir_str = passwd_line.split(":")[5]
-        if not home_dir_str:
-            log.error(f"Empty home directory field from getent for '{username}'.")
-            if _p_error: _p_error(f"Could not determine home directory for user '{username}' from getent output.")
-            return None
-        log.info(f"Home directory for '{username}' is '{home_dir_str}'.")
-        return Path(home_dir_str)
-    except subprocess.CalledProcessError:
-        # run_command already logs and calls _p_error
-        log.warning(f"Failed to get home directory for user '{username}' (getent probably failed or user not found).")
+    identity = get_user_identity(username, logger=log)
+    if identity is None:
+        log.warning(f"Failed to get home directory for user '{username}' (user not found).")
+        if _p_error: _p_error(f"Could not find user '{username}' in the passwd database.")
         return None
-    except IndexError:
-        log.error(f"IndexError parsing getent output for home directory of '{username}'. Output: {passwd_line if 'passwd_line' in locals() else 'N/A'}")
-        if _p_error: _p_error(f"Could not parse home directory for user '{username}' from getent output.")
-        return None
-    except Exception as e:
-        log.error(f"Unexpected error getting home dir for '{username}': {e}", exc_info=True)
-        if _p_error: _p_error(f"An unexpected error occurred while getting home directory for user '{username}': {e}")
+    if not str(identity.home):
+        log.error(f"Empty home directory field in passwd entry for '{username}'.")
+        if _p_error: _p_error(f"Could not determine home directory for user '{username}'.")
         return None
+    log.info(f"Home directory for '{username}' is '{identity.home}'.")
+    return identity.home
 
+@exec_trace.traced_helper
 def backup_system_file(
     filepath: Path,
     sudo_required: bool = True,
@@ -324,6 +804,9 @@ def backup_system_file(
         cmd.insert(0, "sudo")
     
     try:
+        if sudo_required and _worker_file_op(None, "copy", log, path=str(filepath), dest=str(backup_path)) is not None:
+            log.info(f"Successfully backed up {filepath} to {backup_path}")
+            return True
         run_command(
             cmd,
             # Show "Executing..." only if a custom info printer is explicitly passed
@@ -339,6 +822,59 @@ def backup_system_file(
         if _p_warning: _p_warning(f"Could not back up {filepath}. Error: {e}")
         return False
 
+def path_writable(filepath: Path) -> bool:
+    """True if filepath can be written without privileges (existing file, or a new file in a writable directory)."""
+    if filepath.exists():
+        return os.access(filepath, os.W_OK)
+    return filepath.parent.is_dir() and os.access(filepath.parent, os.W_OK)
+
+@exec_trace.traced_helper
+def write_system_file(
+    filepath: Path,
+    content: str,
+    sudo_required: Optional[bool] = None,
+    logger: Optional[logging.Logger] = None,
+    print_fn_info: Optional[Callable[[str], None]] = None,
+    print_fn_error: Optional[Callable[[str], None]] = None
+) -> bool:
+    """
+    Replaces the content of a (system) file. sudo_required=None decides from the file's permissions,
+    so the same call works on /etc and on a scratch copy of it.
+    """
+    log = logger or default_script_logger
+    _p_info = print_fn_info or (lambda msg: None)
+    _p_error = print_fn_error or PRINT_FN_ERROR_DEFAULT
+
+    if sudo_required is None:
+        sudo_required = not path_writable(filepath)
+    if str(filepath).startswith("/etc/yum.repos.d"):
+        invalidate_dnf_metadata() # A new or changed repository needs fresh metadata
+
+    log.info(f"Writing {filepath} ({len(content)} bytes{', via sudo' if sudo_required else ''}).")
+    if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None: _p_info(f"Writing {filepath}...")
+    try:
+        if not sudo_required:
+            filepath.write_text(content, encoding="utf-8")
+            return True
+        if _worker_file_op(None, "write", log, path=str(filepath), content=content) is not None:
+            return True
+        process = subprocess.run(
+            ["sudo", "tee", str(filepath)],
+            input=content, text=True, check=True, capture_output=True
+        )
+        if process.stderr:
+            log.warning(f"Stderr from tee command for '{filepath}': {process.stderr.strip()}")
+        return True
+    except subprocess.CalledProcessError as e:
+        log.error(f"Failed to write '{filepath}'. Error: {e.stderr or e}", exc_info=True)
+        if _p_error: _p_error(f"Failed to write '{filepath}': {e.stderr or e}")
+        return False
+    except Exception as e:
+        log.error(f"An unexpected error occurred while writing '{filepath}': {e}", exc_info=True)
+        if _p_error: _p_error(f"An unexpected error occurred while writing '{filepath}': {e}")
+        return False
+
+@exec_trace.traced_helper
 def create_file_as_user(
     file_path: Path,
     content: str,
@@ -357,6 +893,10 @@ def create_file_as_user(
         _p_info(f"Creating file '{file_path}' as user '{target_user}'.")
 
     try:
+        if _worker_file_op(target_user, "write", log, path=str(file_path), content=content) is not None:
+            log.info(f"Successfully created file '{file_path}' for user '{target_user}'.")
+            return True
+
         # Use shell redirection to write the file content
         # This is a common and effective way to write a file as another user with sudo
         # The content is passed via stdin to `tee`
@@ -364,6 +904,12 @@ def create_file_as_user(
 
         # We need to run this with `sudo -u` and `bash -c` to handle the redirection correctly
         full_cmd = ["sudo", "-u", target_user, "bash", "-c", cmd]
+        root = install_root.current()
+        if root is not None:
+            entry = install_root.passwd_entry(root, target_user)
+            if entry is None:
+                raise ValueError(f"User '{target_user}' does not exist in install root '{root}'.")
+            full_cmd = install_root.user_command_prefix(entry, root) + ["bash", "-c", cmd]
 
         process = subprocess.run(
             full_cmd,
@@ -389,6 +935,37 @@ def create_file_as_user(
             _p_error(f"An unexpected error occurred while creating file '{file_path}': {e}")
         return False
 
+def _dir_needs_sudo(dir_path: Path, target_user: Optional[str]) -> bool:
+    """Heuristic: a system-like dir, a non-root script and no target user (who would get sudo -u) means sudo."""
+    if target_user or os.geteuid() == 0:
+        return False
+    system_dirs_prefixes = ("/etc", "/opt", "/usr/local", "/var")
+    return str(dir_path).startswith(system_dirs_prefixes)
+
+def _build_dir_create_cmds(
+    dir_path: Path,
+    target_user: Optional[str],
+    mode: Optional[str],
+    log: logging.Logger
+) -> Tuple[List[str], Optional[List[str]]]:
+    """Returns the mkdir and optional chmod commands used by ensure_dir_exists and its async variant."""
+    mkdir_cmd_parts = ["mkdir", "-p", str(dir_path)]
+
+    # Determine if sudo is needed for mkdir/chmod itself (not via run_as_user)
+    # run_as_user handles its own sudo for user context.
+    # This is only needed if the script isn't root and making a system dir.
+    needs_sudo = _dir_needs_sudo(dir_path, target_user)
+    if needs_sudo:
+        log.info("Prepending sudo for mkdir as it's a system directory and script is not root (and not targeting a specific user for the command).")
+
+    mkdir_cmd = ["sudo"] + mkdir_cmd_parts if needs_sudo else mkdir_cmd_parts
+    chmod_cmd = None
+    if mode:
+        chmod_cmd_parts = ["chmod", mode, str(dir_path)]
+        chmod_cmd = ["sudo"] + chmod_cmd_parts if needs_sudo else chmod_cmd_parts
+    return mkdir_cmd, chmod_cmd
+
+@exec_trace.traced_helper
 def ensure_dir_exists(
     dir_path: Path,
     target_user: Optional[str] = None,
@@ -406,6 +983,24 @@ def ensure_dir_exists(
 
     log.info(f"Ensuring directory exists: {dir_path} (User: {target_user or 'current/root'}, Mode: {mode or 'default'})")
 
+    # Privileged worker path: check and create in-process in the user's (or root's) worker
+    if target_user or _dir_needs_sudo(dir_path, target_user):
+        try:
+            is_dir_result = _worker_file_op(target_user, "isdir", log, path=str(dir_path))
+            if is_dir_result is not None:
+                if is_dir_result["value"]:
+                    log.info(f"Directory '{dir_path}' already exists.")
+                    if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None : _p_info(f"Directory '{dir_path}' already exists.")
+                    return True
+                _worker_file_op(target_user, "mkdir", log, path=str(dir_path), mode=mode)
+                log.info(f"Successfully created/verified directory: {dir_path}")
+                if _p_success and _p_success is not PRINT_FN_SUCCESS_DEFAULT and _p_success is not None : _p_success(f"Successfully ensured directory exists: {dir_path}")
+                return True
+        except Exception as e:
+            log.error(f"Failed to create directory {dir_path} (User: {target_user}, Mode: {mode}): {e}", exc_info=True)
+            if _p_error : _p_error(f"Failed to create directory {dir_path}: {e}")
+            return False
+
     # Check if directory exists (as the target user if specified, otherwise as current euid)
     check_cmd = f"test -d {shlex.quote(str(dir_path))}"
     try:
@@ -426,25 +1021,11 @@ def ensure_dir_exists(
 
     if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None : _p_info(f"Directory '{dir_path}' not found. Attempting to create it...")
 
-    mkdir_cmd_parts = ["mkdir", "-p", str(dir_path)]
-    
-    # Determine if sudo is needed for mkdir itself (not via run_as_user)
-    # run_as_user handles its own sudo for user context.
-    # This 'sudo_for_mkdir' is if the script isn't root and making a system dir.
-    sudo_for_mkdir = False
-    if not target_user and os.geteuid() != 0:
-        # Heuristic: if path starts with system-like dirs, and we are not root, and not targeting a user (who would get sudo -u)
-        # then mkdir itself needs sudo.
-        system_dirs_prefixes = ("/etc", "/opt", "/usr/local", "/var")
-        if str(dir_path).startswith(system_dirs_prefixes):
-            log.info("Prepending sudo for mkdir as it's a system directory and script is not root (and not targeting a specific user for the command).")
-            sudo_for_mkdir = True
-            
-    final_mkdir_cmd = ["sudo"] + mkdir_cmd_parts if sudo_for_mkdir else mkdir_cmd_parts
+    mkdir_cmd, chmod_cmd = _build_dir_create_cmds(dir_path, target_user, mode, log)
 
     try:
         run_command(
-            final_mkdir_cmd if not target_user else mkdir_cmd_parts, # If target_user, run_command adds sudo -u
+            mkdir_cmd, # If target_user, run_command adds sudo -u
             run_as_user=target_user,
             shell=bool(target_user), # Use shell if running as user for `mkdir -p` via bash -c
             check=True,
@@ -452,18 +1033,9 @@ def ensure_dir_exists(
             print_fn_error=_p_error,
             logger=log
         )
-        if mode:
-            chmod_cmd_parts = ["chmod", mode, str(dir_path)]
-            sudo_for_chmod = False
-            if not target_user and os.geteuid() != 0:
-                 system_dirs_prefixes = ("/etc", "/opt", "/usr/local", "/var")
-                 if str(dir_path).startswith(system_dirs_prefixes):
-                    sudo_for_chmod = True
-            
-            final_chmod_cmd = ["sudo"] + chmod_cmd_parts if sudo_for_chmod else chmod_cmd_parts
-
+        if chmod_cmd:
             run_command(
-                final_chmod_cmd if not target_user else chmod_cmd_parts,
+                chmod_cmd,
                 run_as_user=target_user, 
                 shell=bool(target_user), 
                 check=True,
@@ -480,48 +1052,30 @@ def ensure_dir_exists(
 
 # --- User Shell Management ---
 
+@exec_trace.traced_helper
 def get_user_shell(
     username: str,
     logger: Optional[logging.Logger] = None,
     print_fn_warning: Optional[Callable[[str], None]] = None
 ) -> Optional[str]:
-    """Gets the current login shell for a specified user using getent."""
+    """Gets the current login shell for a specified user from the memoized passwd identity."""
     log = logger or default_script_logger
     _p_warning = print_fn_warning or (lambda msg: None)
 
     log.debug(f"Getting login shell for user '{username}'.")
-    try:
-        cmd = f"getent passwd {shlex.quote(username)}"
-        process = run_command(
-            cmd, shell=True, 
-            capture_output=True,
-            check=True, # Will raise CalledProcessError if user not found
-            print_fn_info=None, # Quiet for this internal check
-            logger=log
-        )
-        passwd_line = process.stdout.strip()
-        # No need to check for empty passwd_line if check=True
-        
-        shell_path = passwd_line.split(":")[-1]
-        if not shell_path: # Should not happen if format is correct, but good to check
-            log.warning(f"Empty shell path from getent for user '{username}' despite successful command.")
-            if _p_warning and _p_warning is not PRINT_FN_WARNING_DEFAULT and _p_warning is not None: _p_warning(f"Could not determine shell for user '{username}' from getent output (empty field).")
-            return None
-        log.info(f"Login shell for '{username}' is '{shell_path}'.")
-        return shell_path
-    except subprocess.CalledProcessError: # User not found or other getent error
-        log.warning(f"Failed to get login shell for user '{username}' (getent failed or user not found).")
-        if _p_warning and _p_warning is not PRINT_FN_WARNING_DEFAULT and _p_warning is not None: _p_warning(f"Could not find user '{username}' via getent to determine shell.")
-        return None
-    except IndexError: # Malformed passwd line from getent (unlikely)
-        log.warning(f"IndexError parsing getent output for shell of '{username}'. Output: {passwd_line if 'passwd_line' in locals() else 'N/A'}")
-        if _p_warning and _p_warning is not PRINT_FN_WARNING_DEFAULT and _p_warning is not None: _p_warning(f"Could not determine shell for user '{username}' from getent output (parse error).")
+    identity = get_user_identity(username, logger=log)
+    if identity is None:
+        log.warning(f"Failed to get login shell for user '{username}' (user not found).")
+        if _p_warning and _p_warning is not PRINT_FN_WARNING_DEFAULT and _p_warning is not None: _p_warning(f"Could not find user '{username}' in the passwd database to determine shell.")
         return None
-    except Exception as e: # Catch-all for other unexpected issues
-        log.error(f"Unexpected error getting shell for user '{username}': {e}", exc_info=True)
-        if _p_warning and _p_warning is not PRINT_FN_WARNING_DEFAULT and _p_warning is not None: _p_warning(f"Could not determine the current shell for user '{username}': {e}")
+    if not identity.shell:
+        log.warning(f"Empty shell field in passwd entry for user '{username}'.")
+        if _p_warning and _p_warning is not PRINT_FN_WARNING_DEFAULT and _p_warning is not None: _p_warning(f"Could not determine shell for user '{username}' (empty passwd field).")
         return None
+    log.info(f"Login shell for '{username}' is '{identity.shell}'.")
+    return identity.shell
 
+@exec_trace.traced_helper
 def ensure_shell_in_etc_shells(
     shell_path: str,
     logger: Optional[logging.Logger] = None,
@@ -553,10 +1107,10 @@ def ensure_shell_in_etc_shells(
             if os.geteuid() == 0: # If script is root, try to create it
                 try:
                     if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None: _p_info(f"Attempting to create {etc_shells_path} as root.")
-                    # Use run_command for atomicity and logging
-                    run_command(["sudo", "touch", str(etc_shells_path)], logger=log, print_fn_info=_p_info if (_p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None) else None)
-                    run_command(["sudo", "chown", "root:root", str(etc_shells_path)], logger=log, print_fn_info=_p_info if (_p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None) else None)
-                    run_command(["sudo", "chmod", "644", str(etc_shells_path)], logger=log, print_fn_info=_p_info if (_p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None) else None)
+                    # Already root: create, chown and chmod in-process
+                    etc_shells_path.touch(mode=0o644, exist_ok=True)
+                    os.chown(etc_shells_path, 0, 0)
+                    os.chmod(etc_shells_path, 0o644)
                     log.info(f"Created {etc_shells_path}.")
                 except Exception as e_create:
                     log.error(f"Failed to create {etc_shells_path}: {e_create}", exc_info=True)
@@ -567,14 +1121,15 @@ def ensure_shell_in_etc_shells(
                 if _p_error: _p_error(f"Cannot create or modify {etc_shells_path} without root privileges as it does not exist.")
                 return False
 
-        # Read /etc/shells content with sudo cat to handle permissions if not root.
-        # If root, can read directly, but sudo cat is safer for consistency if perms are weird.
-        cat_cmd = ["sudo", "cat", str(etc_shells_path)] if os.geteuid() != 0 else ["cat", str(etc_shells_path)]
-        cat_proc = run_command(
-            cat_cmd,
-            capture_output=True, check=True, logger=log, print_fn_info=None # Quiet read
-        )
-        current_shells_content = cat_proc.stdout
+        # /etc/shells is world-readable; only fall back to sudo cat if its permissions are unusual
+        try:
+            current_shells_content = etc_shells_path.read_text(encoding="utf-8")
+        except PermissionError:
+            cat_proc = run_command(
+                ["sudo", "cat", str(etc_shells_path)],
+                capture_output=True, check=True, logger=log, print_fn_info=None # Quiet read
+            )
+            current_shells_content = cat_proc.stdout
         current_shells = [line.strip() for line in current_shells_content.splitlines() if line.strip() and not line.startswith('#')]
 
         if shell_path in current_shells:
@@ -584,6 +1139,18 @@ def ensure_shell_in_etc_shells(
         
         if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None: _p_info(f"Shell '{shell_path}' not found in {etc_shells_path}. Attempting to add it (requires sudo)...")
         
+        appended = False
+        if os.geteuid() == 0:
+            with open(etc_shells_path, "a", encoding="utf-8") as f:
+                f.write(f"{shell_path}\n")
+            appended = True
+        elif _worker_file_op(None, "write", log, path=str(etc_shells_path), content=f"{shell_path}\n", append=True) is not None:
+            appended = True
+        if appended:
+            log.info(f"Added '{shell_path}' to {etc_shells_path}.")
+            if _p_success and _p_success is not PRINT_FN_SUCCESS_DEFAULT and _p_success is not None : _p_success(f"Successfully added '{shell_path}' to {etc_shells_path}.")
+            return True
+
         # Use sudo tee to append. This requires the script to have sudo rights or the user to enter password.
         quoted_shell_path = shlex.quote(shell_path)
         # The `echo ... | sudo tee -a ...` pattern is robust.
@@ -607,6 +1174,7 @@ def ensure_shell_in_etc_shells(
         if _p_error: _p_error(f"Failed to process /etc/shells for '{shell_path}': {e}")
         return False
 
+@exec_trace.traced_helper
 def set_default_shell(
     username: str,
     shell_path: str,
@@ -636,7 +1204,7 @@ def set_default_shell(
     
     is_root = os.geteuid() == 0
     # Determine the actual user running the script (even if via sudo)
-    script_runner_user = os.environ.get("SUDO_USER") if "SUDO_USER" in os.environ else os.getlogin()
+    script_runner_user = os.environ.get("SUDO_USER") or _current_username()
     is_changing_own_shell = script_runner_user == username
 
     # Ensure shell is in /etc/shells (always needs sudo for modification)
@@ -663,7 +1231,8 @@ def set_default_shell(
             logger=log
         )
         
-        time.sleep(0.5) # Give a moment for system changes to potentially propagate to getent
+        clear_identity_cache(username) # The memoized passwd entry is stale after chsh
+        time.sleep(0.5) # Give a moment for system changes to potentially propagate through NSS caches
         new_shell_check = get_user_shell(username, logger=log, print_fn_warning=_p_warning)
         
         if new_shell_check == shell_path:
@@ -671,9 +1240,9 @@ def set_default_shell(
             if _p_success and _p_success is not PRINT_FN_SUCCESS_DEFAULT and _p_success is not None : _p_success(f"Successfully set '{shell_path}' as default shell for '{username}'.")
             if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None : _p_info("Note: The shell change will take effect upon the user's next login.")
         else:
-            log.warning(f"chsh command for '{username}' to '{shell_path}' executed. Verification via getent currently shows shell as: '{new_shell_check or 'unknown'}'. This is sometimes delayed after chsh.")
+            log.warning(f"chsh command for '{username}' to '{shell_path}' executed. Verification via the passwd database currently shows shell as: '{new_shell_check or 'unknown'}'. This is sometimes delayed after chsh.")
             if _p_warning and _p_warning is not PRINT_FN_WARNING_DEFAULT and _p_warning is not None :
-                _p_warning(f"chsh for '{username}' to '{shell_path}' ran. Verification (getent) shows: '{new_shell_check or 'unknown'}'.")
+                _p_warning(f"chsh for '{username}' to '{shell_path}' ran. Verification (passwd) shows: '{new_shell_check or 'unknown'}'.")
                 _p_info("Shell change likely takes effect on next login. Please verify then.")
         
         return True # chsh command itself succeeded
@@ -689,15 +1258,148 @@ def set_default_shell(
 
 
 # --- DNF Operations ---
+# Groups installed by this run (per-phase or through the combined transaction planner);
+# asking for them again is a no-op instead of another dnf startup. Kept per install root.
+_INSTALLED_GROUPS_THIS_RUN: Dict[str, Set[str]] = {}
+
+def _installed_groups_this_run() -> Set[str]:
+    return _INSTALLED_GROUPS_THIS_RUN.setdefault(install_root.key(), set())
+
+def is_group_installed_this_run(group: str) -> bool:
+    """True if this run already installed group (in the targeted install root)."""
+    return group in _installed_groups_this_run()
+
+def mark_groups_installed(groups: Iterable[str]) -> None:
+    """Records groups installed outside install_dnf_groups (e.g. by the combined transaction)."""
+    _installed_groups_this_run().update(groups)
+
+# Global options added to every dnf command this script runs (e.g. a local RPM repository)
+_DNF_GLOBAL_ARGS: List[str] = []
+
+def set_dnf_global_args(args: List[str]) -> None:
+    """Sets the global options every subsequent dnf command starts with."""
+    _DNF_GLOBAL_ARGS[:] = args
+
+# Repository metadata is refreshed once per run (lazily, before the first dnf command that needs it)
+# and later dnf calls reuse it without re-checking the mirrors. It is refreshed again when a
+# repository is added or when it is older than DNF_METADATA_MAX_AGE_SECONDS.
+DNF_METADATA_MAX_AGE_SECONDS = 3600
+_dnf_metadata_refreshed_at: Optional[float] = None
+_dnf_metadata_lock = threading.Lock()
+
+def set_dnf_metadata_max_age(seconds: int) -> None:
+    """Sets how long metadata from this run's makecache is reused before refreshing it again."""
+    global DNF_METADATA_MAX_AGE_SECONDS
+    DNF_METADATA_MAX_AGE_SECONDS = max(0, int(seconds))
+
+def _dnf_metadata_is_fresh() -> bool:
+    refreshed_at = _dnf_metadata_refreshed_at
+    return refreshed_at is not None and time.monotonic() - refreshed_at <= DNF_METADATA_MAX_AGE_SECONDS
+
+def invalidate_dnf_metadata() -> None:
+    """Forgets this run's makecache, e.g. after a repository was added; the next dnf command refreshes."""
+    global _dnf_metadata_refreshed_at
+    with _dnf_metadata_lock:
+        _dnf_metadata_refreshed_at = None
+
+# Commands that add repositories (config-manager, copr, *-release packages, tee into yum.repos.d)
+command_cache.query_cache.register_invalidation_hook("dnf-repos", invalidate_dnf_metadata)
+
+def ensure_dnf_metadata(logger: Optional[logging.Logger] = None) -> bool:
+    """Runs 'dnf makecache' unless this run already did recently. Returns False if the refresh failed."""
+    global _dnf_metadata_refreshed_at
+    log = logger or default_script_logger
+    with _dnf_metadata_lock:
+        if _dnf_metadata_is_fresh():
+            return True
+        log.info("Refreshing DNF repository metadata (once per run).")
+        try:
+            run_command(build_dnf_cmd(["makecache"], use_cached_metadata=False), capture_output=True, check=True, logger=log)
+        except Exception as e:
+            # dnf commands then check freshness themselves, as without this optimization
+            log.warning(f"'dnf makecache' failed ({e}); dnf commands will refresh metadata on their own.")
+            return False
+        _dnf_metadata_refreshed_at = time.monotonic()
+        return True
+
+def build_dnf_cmd(
+    args: List[str],
+    dnf_binary: str = "dnf",
+    sudo: bool = True,
+    global_args: bool = True,
+    use_cached_metadata: bool = True
+) -> List[str]:
+    """
+    Builds '[sudo] <dnf_binary> <global options> <args>'; every dnf command line goes through here.
+    While this run's makecache is fresh, metadata_expire=-1 makes dnf use the cached metadata without
+    asking the mirrors again. (Not -C/--cacheonly: that would also forbid downloading packages.)
+    """
+    cmd = (["sudo"] if sudo else []) + [dnf_binary] + (_DNF_GLOBAL_ARGS if global_args else [])
+    if use_cached_metadata and _dnf_metadata_is_fresh():
+        cmd.append("--setopt=metadata_expire=-1")
+    return cmd + args
+
+def _build_dnf_install_cmd(
+    packages: List[str],
+    allow_erasing: bool = False,
+    extra_args: Optional[List[str]] = None
+) -> List[str]:
+    """Builds the 'sudo dnf install -y' command list shared by the sync and async installers."""
+    cmd = build_dnf_cmd(["install", "-y"])
+    if allow_erasing:
+        cmd.append("--allowerasing")
+    if extra_args:
+        cmd.extend(extra_args)
+    cmd.extend(packages)
+    return cmd
+
+def filter_installed_packages(
+    packages: List[str],
+    log: logging.Logger
+) -> Tuple[List[str], List[str]]:
+    """
+    Splits packages into (to_install, already_installed) using the installed-package index.
+    Local files, URLs, globs and @groups are always kept for dnf. If the index cannot be
+    read, everything is kept.
+    """
+    try:
+        index = package_index.get_installed_package_index(log)
+        to_install, already_installed = [], []
+        for pkg in packages:
+            if any(marker in pkg for marker in ("/", "*", "?", "[")) or pkg.startswith("@") or pkg.endswith(".rpm"):
+                to_install.append(pkg)
+            elif index.satisfies(pkg):
+                already_installed.append(pkg)
+            else:
+                to_install.append(pkg)
+        return to_install, already_installed
+    except Exception as e:
+        log.warning(f"Could not check installed packages before dnf ({e}); passing the full list to dnf.")
+        return list(packages), []
+
+def _report_skipped_packages(
+    already_installed: List[str],
+    log: logging.Logger,
+    _p_info: Callable[[str], None]
+) -> None:
+    if not already_installed:
+        return
+    skipped_str = ', '.join(already_installed)
+    log.info(f"DNF packages already installed, skipping: {skipped_str}")
+    if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None: _p_info(f"Already installed, skipping: {skipped_str}")
+
+@exec_trace.traced_helper
 def install_dnf_packages(
     packages: List[str],
     allow_erasing: bool = False,
     capture_output: bool = True,
+    stream_output: bool = True, # Forward dnf output line by line, keeping only a bounded tail
     print_fn_info: Optional[Callable[[str], None]] = None, # Changed default
     print_fn_error: Optional[Callable[[str], None]] = None, # Changed default
     print_fn_sub_step: Optional[Callable[[str], None]] = None, # Changed default
     logger: Optional[logging.Logger] = None,
-    extra_args: Optional[List[str]] = None
+    extra_args: Optional[List[str]] = None,
+    skip_installed: bool = True # Don't start dnf (metadata load + depsolve) for packages already present
 ) -> bool:
     log = logger or default_script_logger
     _p_info = print_fn_info or (lambda msg: None)
@@ -709,12 +1411,16 @@ def install_dnf_packages(
         if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None: _p_info("No DNF packages specified for installation.")
         return True
 
-    cmd = ["sudo", "dnf", "install", "-y"]
-    if allow_erasing:
-        cmd.append("--allowerasing")
-    if extra_args:
-        cmd.extend(extra_args)
-    cmd.extend(packages)
+    if skip_installed:
+        packages, already_installed = filter_installed_packages(packages, log)
+        _report_skipped_packages(already_installed, log, _p_info)
+        if not packages:
+            log.info("All requested DNF packages are already installed; not running dnf.")
+            if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None: _p_info("All requested DNF packages are already installed.")
+            return True
+
+    ensure_dnf_metadata(log)
+    cmd = _build_dnf_install_cmd(packages, allow_erasing, extra_args)
 
     action_verb = "Installing"
     if allow_erasing:
@@ -725,25 +1431,64 @@ def install_dnf_packages(
     if _p_sub and _p_sub is not PRINT_FN_SUB_STEP_DEFAULT and _p_sub is not None: _p_sub(f"{action_verb} DNF packages: {packages_str}") 
 
     try:
-        run_command(
-            cmd, capture_output=capture_output, check=True,
-            print_fn_info=_p_info if (_p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None) else None, 
-            print_fn_error=_p_error, 
-            print_fn_sub_step=_p_sub if (_p_sub and _p_sub is not PRINT_FN_SUB_STEP_DEFAULT and _p_sub is not None) else None,
-            logger=log
-        )
-        if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None: _p_info(f"DNF packages processed successfully: {packages_str}") 
-        log.info(f"DNF packages processed successfully: {packages_str}")
+        # --allowerasing may remove packages we did not name, so resnapshot instead of refreshing
+        with package_index.get_installed_package_index(log).transaction(None if allow_erasing else packages):
+            run_command(
+                cmd, capture_output=capture_output, check=True, stream_output=stream_output,
+                print_fn_info=_p_info if (_p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None) else None, 
+                print_fn_error=_p_error, 
+                print_fn_sub_step=_p_sub if (_p_sub and _p_sub is not PRINT_FN_SUB_STEP_DEFAULT and _p_sub is not None) else None,
+                logger=log
+            )
+        if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None: _p_info(f"DNF packages installed: {packages_str}") 
+        log.info(f"DNF packages installed: {packages_str}")
         return True
     except Exception as e: # run_command raises CalledProcessError on failure
         log.error(f"Failed to process DNF packages: {packages_str}. Error: {e}", exc_info=True)
         # _p_error is called by run_command on failure
         return False
 
+@exec_trace.traced_helper
+def download_dnf_packages(
+    packages: List[str],
+    print_fn_info: Optional[Callable[[str], None]] = None,
+    print_fn_error: Optional[Callable[[str], None]] = None,
+    print_fn_sub_step: Optional[Callable[[str], None]] = None,
+    logger: Optional[logging.Logger] = None
+) -> bool:
+    """
+    Resolves and downloads packages (and '@group' specs) into the DNF cache without installing them.
+    dnf keeps download-only packages in its cache, so a later install of the same set only unpacks.
+    """
+    log = logger or default_script_logger
+    _p_info = print_fn_info or (lambda msg: None)
+    _p_error = print_fn_error or (lambda msg: None)
+    _p_sub = print_fn_sub_step or (lambda msg: None)
+
+    if not packages:
+        return True
+
+    ensure_dnf_metadata(log)
+    cmd = _build_dnf_install_cmd(packages, allow_erasing=True, extra_args=["--downloadonly"])
+    log.info(f"Downloading DNF packages (download only): {', '.join(packages)}")
+    try:
+        run_command(
+            cmd, capture_output=True, check=True, stream_output=True,
+            print_fn_info=_p_info, print_fn_error=_p_error, print_fn_sub_step=_p_sub,
+            logger=log
+        )
+        log.info(f"DNF download-only finished for {len(packages)} packages.")
+        return True
+    except Exception as e:
+        log.warning(f"DNF download-only failed for {', '.join(packages)}: {e}")
+        return False
+
+@exec_trace.traced_helper
 def install_dnf_groups(
     groups: List[str],
     allow_erasing: bool = True, 
     capture_output: bool = True,
+    stream_output: bool = True,
     print_fn_info: Optional[Callable[[str], None]] = None, 
     print_fn_error: Optional[Callable[[str], None]] = None, 
     print_fn_sub_step: Optional[Callable[[str], None]] = None, 
@@ -765,32 +1510,41 @@ def install_dnf_groups(
     if _p_sub and _p_sub is not PRINT_FN_SUB_STEP_DEFAULT and _p_sub is not None: _p_sub(f"Installing DNF groups: {groups_str}")
 
     for group_id_or_name in groups:
-        cmd = ["sudo", "dnf", "group", "install", "-y"]
+        if group_id_or_name in _installed_groups_this_run():
+            log.info(f"DNF group '{group_id_or_name}' was already installed in this run; skipping.")
+            if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None: _p_info(f"DNF group '{group_id_or_name}' already installed in this run.")
+            continue
+        ensure_dnf_metadata(log)
+        cmd = build_dnf_cmd(["group", "install", "-y"])
         if allow_erasing:
             cmd.append("--allowerasing")
         cmd.append(group_id_or_name)
         
         if _p_sub and _p_sub is not PRINT_FN_SUB_STEP_DEFAULT and _p_sub is not None: _p_sub(f"Processing DNF group: {group_id_or_name}")
         try:
-            run_command(
-                cmd, capture_output=capture_output, check=True,
-                print_fn_info=_p_info if (_p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None) else None, 
-                print_fn_error=_p_error, 
-                print_fn_sub_step=_p_sub if (_p_sub and _p_sub is not PRINT_FN_SUB_STEP_DEFAULT and _p_sub is not None) else None,
-                logger=log
-            )
+            with package_index.get_installed_package_index(log).transaction(): # Group members are unknown here
+                run_command(
+                    cmd, capture_output=capture_output, check=True, stream_output=stream_output,
+                    print_fn_info=_p_info if (_p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None) else None, 
+                    print_fn_error=_p_error, 
+                    print_fn_sub_step=_p_sub if (_p_sub and _p_sub is not PRINT_FN_SUB_STEP_DEFAULT and _p_sub is not None) else None,
+                    logger=log
+                )
             if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None: _p_info(f"DNF group '{group_id_or_name}' processed successfully.")
             log.info(f"DNF group '{group_id_or_name}' processed successfully.")
+            _installed_groups_this_run().add(group_id_or_name)
         except Exception as e:
             log.error(f"Failed to process DNF group '{group_id_or_name}'. Error: {e}", exc_info=True)
             all_successful = False
     return all_successful
 
+@exec_trace.traced_helper
 def swap_dnf_packages(
     from_pkg: str,
     to_pkg: str,
     allow_erasing: bool = True, 
     capture_output: bool = True,
+    stream_output: bool = True,
     print_fn_info: Optional[Callable[[str], None]] = None, 
     print_fn_error: Optional[Callable[[str], None]] = None, 
     print_fn_sub_step: Optional[Callable[[str], None]] = None, 
@@ -826,24 +1580,26 @@ def swap_dnf_packages(
             if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None: _p_info(f"Package '{from_pkg}' is not installed. Attempting direct install of '{to_pkg}'.")
             log.info(f"'{from_pkg}' not installed. Directly installing '{to_pkg}'.")
             return install_dnf_packages(
-                [to_pkg], allow_erasing=allow_erasing, capture_output=capture_output,
+                [to_pkg], allow_erasing=allow_erasing, capture_output=capture_output, stream_output=stream_output,
                 print_fn_info=_p_info, print_fn_error=_p_error, print_fn_sub_step=_p_sub,
                 logger=log
             )
 
         # If from_pkg is (assumed to be) installed, proceed with swap
-        cmd = ["sudo", "dnf", "swap", "-y"]
+        ensure_dnf_metadata(log)
+        cmd = build_dnf_cmd(["swap", "-y"])
         if allow_erasing:
             cmd.append("--allowerasing")
         cmd.extend([from_pkg, to_pkg])
         
-        run_command(
-            cmd, capture_output=capture_output, check=True,
-            print_fn_info=_p_info if (_p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None) else None, 
-            print_fn_error=_p_error, 
-            print_fn_sub_step=_p_sub if (_p_sub and _p_sub is not PRINT_FN_SUB_STEP_DEFAULT and _p_sub is not None) else None,
-            logger=log
-        )
+        with package_index.get_installed_package_index(log).transaction(None if allow_erasing else [from_pkg, to_pkg]):
+            run_command(
+                cmd, capture_output=capture_output, check=True, stream_output=stream_output,
+                print_fn_info=_p_info if (_p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None) else None, 
+                print_fn_error=_p_error, 
+                print_fn_sub_step=_p_sub if (_p_sub and _p_sub is not PRINT_FN_SUB_STEP_DEFAULT and _p_sub is not None) else None,
+                logger=log
+            )
         if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None: _p_info(f"DNF package '{from_pkg}' successfully swapped with '{to_pkg}'.")
         log.info(f"Successfully swapped '{from_pkg}' with '{to_pkg}'.")
         return True
@@ -852,8 +1608,47 @@ def swap_dnf_packages(
         # _p_error is called by run_command
         return False
 
+@exec_trace.traced_helper
+def setup_custom_repo(
+    repo_name: str,
+    setup_commands: List[str],
+    print_fn_info: Optional[Callable[[str], None]] = None,
+    print_fn_error: Optional[Callable[[str], None]] = None,
+    print_fn_sub_step: Optional[Callable[[str], None]] = None,
+    logger: Optional[logging.Logger] = None
+) -> bool:
+    """Runs the shell commands that add a third-party repository (key import, .repo file), stopping at the first failure."""
+    log = logger or default_script_logger
+    _p_info = print_fn_info or (lambda msg: None)
+    _p_error = print_fn_error or PRINT_FN_ERROR_DEFAULT
+    _p_sub = print_fn_sub_step or (lambda msg: None)
+
+    if install_root.current() is not None and setup_commands:
+        # Shell strings run against the live system (they are not rewritten like argv commands)
+        log.error(f"Repository '{repo_name}' is set up by shell commands, which cannot target install root '{install_root.current()}'.")
+        _p_error(f"Repository for '{repo_name}' needs a 'repo' or 'repo_file_url' entry to be set up in an install root.")
+        return False
+    log.info(f"Setting up repository for '{repo_name}' ({len(setup_commands)} commands).")
+    if _p_sub and _p_sub is not PRINT_FN_SUB_STEP_DEFAULT and _p_sub is not None: _p_sub(f"Setting up repository for {repo_name}...")
+    for setup_cmd in setup_commands:
+        try:
+            run_command(
+                setup_cmd, shell=True, capture_output=True, check=True,
+                print_fn_info=_p_info if (_p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None) else None,
+                print_fn_error=_p_error,
+                logger=log
+            )
+        except Exception as e:
+            log.error(f"Repository setup for '{repo_name}' failed at '{setup_cmd}': {e}", exc_info=True)
+            return False
+    invalidate_dnf_metadata() # The new repository's metadata is not in the cache yet
+    log.info(f"Repository for '{repo_name}' is set up.")
+    return True
+
+@exec_trace.traced_helper
 def upgrade_system_dnf(
     capture_output: bool = False, 
+    stream_output: bool = True,
     print_fn_info: Optional[Callable[[str], None]] = None, 
     print_fn_error: Optional[Callable[[str], None]] = None, 
     logger: Optional[logging.Logger] = None
@@ -862,16 +1657,18 @@ def upgrade_system_dnf(
     _p_info = print_fn_info or (lambda msg: None)
     _p_error = print_fn_error or PRINT_FN_ERROR_DEFAULT
 
-    cmd = ["sudo", "dnf", "upgrade", "-y"]
+    ensure_dnf_metadata(log)
+    cmd = build_dnf_cmd(["upgrade", "-y"])
     log.info("Attempting system upgrade using DNF...")
     if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None: _p_info("Attempting system upgrade (sudo dnf upgrade -y)...")
     try:
-        run_command(
-            cmd, capture_output=capture_output, check=True,
-            print_fn_info=_p_info if (_p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None) else None, 
-            print_fn_error=_p_error,
-            logger=log
-        )
+        with package_index.get_installed_package_index(log).transaction():
+            run_command(
+                cmd, capture_output=capture_output, check=True, stream_output=stream_output,
+                print_fn_info=_p_info if (_p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None) else None, 
+                print_fn_error=_p_error,
+                logger=log
+            )
         if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None: _p_info("System DNF upgrade completed successfully.")
         log.info("System DNF upgrade completed successfully.")
         return True
@@ -880,6 +1677,7 @@ def upgrade_system_dnf(
         # _p_error is called by run_command
         return False
 
+@exec_trace.traced_helper
 def clean_dnf_cache(
     clean_type: str = "all", 
     capture_output: bool = True,
@@ -891,7 +1689,8 @@ def clean_dnf_cache(
     _p_info = print_fn_info or (lambda msg: None)
     _p_error = print_fn_error or PRINT_FN_ERROR_DEFAULT
 
-    cmd = ["sudo", "dnf", "clean", clean_type]
+    invalidate_dnf_metadata()
+    cmd = build_dnf_cmd(["clean", clean_type])
     log.info(f"Attempting to clean DNF cache ({clean_type})...")
     if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None: _p_info(f"Attempting to clean DNF cache (sudo dnf clean {clean_type})...")
     try:
@@ -911,6 +1710,76 @@ def clean_dnf_cache(
 
 
 # --- Pip Operations ---
+# Pip packages for one target are resolved in a single pip invocation. With a wheelhouse, wheels
+# for the packages and all their dependencies are kept in a machine-wide directory: later runs and
+# other users install from it offline, and it is only refilled (online) when something is missing.
+# It is opt-in ("pip.wheelhouse" in packages.json) and filled by whoever installs from it: root for
+# system-wide installs, the target user for --user installs.
+PIP_WHEELHOUSE_DIR: Optional[Path] = None
+PIP_CONSTRAINTS_FILE: Optional[Path] = None
+
+def set_pip_options(wheelhouse: Optional[Union[str, Path]] = None, constraints_file: Optional[Union[str, Path]] = None) -> None:
+    """Sets the default wheelhouse and constraints (or lock) file of install_pip_packages. Empty disables."""
+    global PIP_WHEELHOUSE_DIR, PIP_CONSTRAINTS_FILE
+    PIP_WHEELHOUSE_DIR = Path(wheelhouse) if wheelhouse else None
+    PIP_CONSTRAINTS_FILE = Path(constraints_file) if constraints_file else None
+
+def _build_pip_install_base_cmd(
+    user_only: bool,
+    target_user: Optional[str],
+    upgrade: bool
+) -> Tuple[List[str], Optional[str], str]:
+    """Returns the pip install base command, the user to run it as, and a log context label."""
+    base_cmd_list_for_user = ["python3", "-m", "pip", "install"]
+    if upgrade:
+        base_cmd_list_for_user.append("--upgrade")
+    if user_only: # This flag is for pip itself
+        base_cmd_list_for_user.append("--user")
+
+    # Determine actual execution command and context
+    run_as_whom = None
+    final_base_cmd_list = base_cmd_list_for_user.copy() # Start with the user-context command
+    log_context_message = ""
+
+    if user_only:
+        run_as_whom = target_user
+        log_context_message = f"for user '{target_user}'"
+        # Command is `python3 -m pip install --user ...` run as `target_user`
+    else: # System-wide pip install generally needs sudo
+        final_base_cmd_list.insert(0, "sudo") # Prepend sudo for system-wide execution
+        log_context_message = "system-wide"
+        # Command is `sudo python3 -m pip install ...`
+    return final_base_cmd_list, run_as_whom, log_context_message
+
+def _fill_wheelhouse(
+    packages: List[str],
+    wheelhouse: Path,
+    constraint_args: List[str],
+    log: logging.Logger,
+    _p_error: Callable[[str], None],
+    run_as_user: Optional[str] = None
+) -> bool:
+    """
+    Builds/downloads wheels for packages and all their dependencies into the shared wheelhouse (one resolver run).
+    Runs as run_as_user (the user of a --user install) or, for system-wide installs, as root without
+    pip's HTTP/build cache, so no root-owned files are left outside the wheelhouse.
+    """
+    if not ensure_dir_exists(wheelhouse, target_user=run_as_user, mode="0755", logger=log, print_fn_error=_p_error):
+        return False
+    cmd = ["python3", "-m", "pip", "wheel", "--wheel-dir", str(wheelhouse), "--find-links", str(wheelhouse)] + constraint_args + packages
+    if not run_as_user:
+        cmd = ["sudo"] + cmd[:4] + ["--no-cache-dir"] + cmd[4:]
+    try:
+        run_command(
+            cmd, run_as_user=run_as_user, shell=bool(run_as_user), # Same python3 lookup as the user's pip install
+            capture_output=True, check=True, print_fn_info=None, print_fn_error=lambda msg: None, logger=log
+        )
+        return True
+    except Exception as e:
+        log.warning(f"Could not fill the wheelhouse {wheelhouse}: {e}")
+        return False
+
+@exec_trace.traced_helper
 def install_pip_packages(
     packages: List[str],
     user_only: bool = False,
@@ -920,8 +1789,17 @@ def install_pip_packages(
     print_fn_info: Optional[Callable[[str], None]] = None, 
     print_fn_error: Optional[Callable[[str], None]] = None, 
     print_fn_sub_step: Optional[Callable[[str], None]] = None, 
-    logger: Optional[logging.Logger] = None
+    logger: Optional[logging.Logger] = None,
+    constraints_file: Optional[Path] = None,
+    wheelhouse: Optional[Path] = None
 ) -> bool:
+    """
+    Installs packages with one pip resolver run for the target (system-wide, or --user for target_user),
+    so dependency conflicts are reported together. constraints_file (default PIP_CONSTRAINTS_FILE) pins
+    versions, e.g. a lock file of name==version lines. With a wheelhouse (default PIP_WHEELHOUSE_DIR)
+    the install is tried offline from it first, then it is refilled and the install retried offline,
+    and only if that fails does pip install from the index directly.
+    """
     log = logger or default_script_logger
     _p_info = print_fn_info or (lambda msg: None)
     _p_error = print_fn_error or PRINT_FN_ERROR_DEFAULT
@@ -937,37 +1815,19 @@ def install_pip_packages(
         log.error("pip install --user requires target_user.")
         return False
 
-    base_cmd_list_for_user = ["python3", "-m", "pip", "install"]
-    if upgrade:
-        base_cmd_list_for_user.append("--upgrade")
-    if user_only: # This flag is for pip itself
-        base_cmd_list_for_user.append("--user")
-    
-    # Determine actual execution command and context
-    run_as_whom = None
-    final_base_cmd_list = base_cmd_list_for_user.copy() # Start with the user-context command
-    log_context_message = ""
-
-    if user_only:
-        run_as_whom = target_user
-        log_context_message = f"for user '{target_user}'"
-        # Command is `python3 -m pip install --user ...` run as `target_user`
-    else: # System-wide pip install generally needs sudo
-        final_base_cmd_list.insert(0, "sudo") # Prepend sudo for system-wide execution
-        log_context_message = "system-wide"
-        # Command is `sudo python3 -m pip install ...`
+    final_base_cmd_list, run_as_whom, log_context_message = _build_pip_install_base_cmd(user_only, target_user, upgrade)
+    constraints_file = constraints_file or PIP_CONSTRAINTS_FILE
+    wheelhouse = wheelhouse or PIP_WHEELHOUSE_DIR
+    constraint_args = ["--constraint", str(constraints_file)] if constraints_file else []
 
     packages_str = ', '.join(packages)
     log.info(f"Installing pip packages ({log_context_message}): {packages_str}")
     if _p_sub and _p_sub is not PRINT_FN_SUB_STEP_DEFAULT and _p_sub is not None: _p_sub(f"Installing pip packages ({log_context_message}): {packages_str}")
-    
-    all_ok = True
-    for pkg in packages:
-        current_pkg_cmd_list = final_base_cmd_list + [pkg]
-        
+
+    def _pip_install(extra_args: List[str], quiet_failure: bool) -> bool:
         try:
             run_command(
-                current_pkg_cmd_list, 
+                final_base_cmd_list + extra_args + constraint_args + packages,
                 run_as_user=run_as_whom, # This is None for system-wide, target_user for user_only
                                           # run_command handles sudo -u if run_as_whom is set.
                 shell=bool(run_as_whom),  # Use shell for user context to find python3 in user's PATH correctly
@@ -975,63 +1835,74 @@ def install_pip_packages(
                 capture_output=capture_output, 
                 check=True, 
                 print_fn_info=_p_info if (_p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None) else None,
-                print_fn_error=_p_error,
+                print_fn_error=(lambda msg: None) if quiet_failure else _p_error, # A failed offline attempt falls through to the next one
                 print_fn_sub_step=_p_sub if (_p_sub and _p_sub is not PRINT_FN_SUB_STEP_DEFAULT and _p_sub is not None) else None,
                 logger=log
             )
-            if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None: _p_info(f"Pip package '{pkg}' installed/updated ({log_context_message}).")
-            log.info(f"Pip package '{pkg}' installed/updated ({log_context_message}).")
+            return True
         except subprocess.CalledProcessError as e:
             # _p_error is called by run_command
-            log.error(f"Failed pip install of '{pkg}' ({log_context_message}). Exit code: {e.returncode}", exc_info=False) # exc_info=False as run_command already logged details
-            all_ok = False
+            log.log(logging.INFO if quiet_failure else logging.ERROR, f"pip install {' '.join(extra_args)} failed ({log_context_message}). Exit code: {e.returncode}")
+            return False
         except Exception as e_unexpected: # Catch other errors like FileNotFoundError for python3
-            log.error(f"Unexpected error during pip install of '{pkg}' ({log_context_message}): {e_unexpected}", exc_info=True)
-            if _p_error: _p_error(f"Unexpected error installing pip package '{pkg}' ({log_context_message}).")
-            all_ok = False
-    return all_ok
+            log.error(f"Unexpected error during pip install ({log_context_message}): {e_unexpected}", exc_info=True)
+            if _p_error: _p_error(f"Unexpected error installing pip packages ({log_context_message}).")
+            return False
+
+    offline_args = ["--no-index", "--find-links", str(wheelhouse)] if wheelhouse else []
+    installed = False
+    if wheelhouse and wheelhouse.is_dir():
+        installed = _pip_install(offline_args, quiet_failure=True)
+        if installed:
+            log.info(f"Pip packages installed offline from the wheelhouse {wheelhouse}.")
+    if not installed and wheelhouse and _fill_wheelhouse(packages, wheelhouse, constraint_args, log, _p_error, run_as_whom):
+        installed = _pip_install(offline_args, quiet_failure=True)
+    if not installed:
+        installed = _pip_install([], quiet_failure=False) # Online, straight from the index
+
+    if installed:
+        if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None: _p_info(f"Pip packages installed/updated ({log_context_message}): {packages_str}")
+        log.info(f"Pip packages installed/updated ({log_context_message}): {packages_str}")
+    return installed
 
 
 # --- Flatpak Operations ---
+# Flathub only has to be checked once per run; every later install reuses the result
+_flathub_remote_ensured: Set[str] = set() # install_root.key() of each installation checked this run
+_flathub_lock = threading.Lock()
+
+@exec_trace.traced_helper
 def ensure_flathub_remote_exists(
     print_fn_info: Optional[Callable[[str], None]] = None, 
     print_fn_error: Optional[Callable[[str], None]] = None, 
     print_fn_sub_step: Optional[Callable[[str], None]] = None, # Kept for API consistency
     logger: Optional[logging.Logger] = None
 ) -> bool:
-    """Ensures the Flathub repository is configured for Flatpak system-wide."""
+    """Ensures the Flathub repository is configured for Flatpak system-wide (checked once per run)."""
     log = logger or default_script_logger
     _p_info = print_fn_info or (lambda msg: None)
     _p_error = print_fn_error or PRINT_FN_ERROR_DEFAULT
 
-    log.info("Ensuring Flathub remote is configured for Flatpak (system-wide).")
-    if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None: _p_info("Ensuring Flathub remote is configured for Flatpak (system-wide)...")
+    with _flathub_lock:
+        if install_root.key() in _flathub_remote_ensured: # Checked (or added) earlier in this run
+            return True
+
+        log.info("Ensuring Flathub remote is configured for Flatpak (system-wide).")
+        if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None: _p_info("Ensuring Flathub remote is configured for Flatpak (system-wide)...")
+        if _add_flathub_remote_if_missing(log, _p_info, _p_error):
+            _flathub_remote_ensured.add(install_root.key())
+            return True
+        return False
 
+def _add_flathub_remote_if_missing(log: logging.Logger, _p_info: Callable[[str], None], _p_error: Callable[[str], None]) -> bool:
     try:
-        # Check if flatpak command exists first
         try:
-            run_command(["flatpak", "--version"], capture_output=True, check=True, print_fn_info=None, logger=log)
+            flathub_found = flatpak_index.get_flatpak_index(log).has_remote("flathub", system_wide=True)
         except FileNotFoundError:
             log.error("'flatpak' command not found. Is Flatpak installed (e.g., via DNF in Phase 1)?")
             if _p_error: _p_error("'flatpak' command not found. Please ensure it is installed.")
             return False
-        
-        check_cmd = ["flatpak", "remotes", "--system"]
-        remotes_process = run_command(
-            check_cmd, capture_output=True, check=False, # check=False, as empty output or error can mean no remotes
-            print_fn_info=None, # Quiet check
-            logger=log
-        )
-        
-        flathub_found = False
-        if remotes_process.returncode == 0 and remotes_process.stdout:
-            for line in remotes_process.stdout.strip().splitlines():
-                # Remote names are typically the first column, tab-separated
-                remote_name_candidate = line.strip().split("\t")[0].strip()
-                if remote_name_candidate.lower() == "flathub": # Case-insensitive check
-                    flathub_found = True
-                    break
-        
+
         if flathub_found:
             if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None: _p_info("Flathub remote 'flathub' already exists (system-wide).")
             log.info("Flathub remote 'flathub' already exists system-wide.")
@@ -1062,6 +1933,77 @@ def ensure_flathub_remote_exists(
         if _p_error: _p_error(f"An unexpected error occurred during Flathub setup: {e_unexp}")
         return False
 
+def _build_flatpak_install_cmd(
+    app_ids: List[str],
+    system_wide: bool = True,
+    remote_name: str = "flathub"
+) -> List[str]:
+    """Builds the 'flatpak install' command list shared by the sync and async installers."""
+    cmd_list = []
+    # Flatpak install --system requires sudo, flatpak install --user does not.
+    # run_command does not add sudo if run_as_user is None.
+    if system_wide:
+        cmd_list.append("sudo")
+
+    cmd_list.extend(["flatpak", "install"])
+
+    if system_wide:
+        cmd_list.append("--system")
+    else:
+        cmd_list.append("--user")
+        # For --user install, we should run as the target_user if one is implied by context (e.g. non-root script run)
+        # This function doesn't take target_user. It assumes system_wide means root, user means current user.
+        # If a phase running as root wants to install a user flatpak, it needs a target_user.
+        # For now, this structure is simpler: sudo for system, no sudo for user (current user).
+
+    cmd_list.extend(["--noninteractive", "--or-update", remote_name])
+    cmd_list.extend(app_ids)
+    return cmd_list
+
+def _installed_flatpak_app_ids(system_wide: bool, log: logging.Logger) -> Set[str]:
+    """Application ids installed in the system (or current user's) Flatpak installation."""
+    try:
+        return flatpak_index.get_flatpak_index(log).installed_app_ids(system_wide)
+    except Exception as e:
+        log.warning(f"Could not list installed Flatpak apps: {e}")
+        return set()
+
+def _skip_installed_flatpak_apps(
+    apps_to_install: Dict[str, str],
+    system_wide: bool,
+    log: logging.Logger,
+    _p_info: Callable[[str], None]
+) -> Dict[str, str]:
+    """Drops apps already in the target installation (one snapshot for all apps, no remote access)."""
+    installed = _installed_flatpak_app_ids(system_wide, log)
+    already = [app_id for app_id in apps_to_install if app_id in installed]
+    if already:
+        log.info(f"Flatpak apps already installed, skipping: {', '.join(already)}")
+        if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None: _p_info(f"Already installed: {', '.join(apps_to_install[app_id] for app_id in already)}")
+    return {app_id: name for app_id, name in apps_to_install.items() if app_id not in installed}
+
+def _reject_unknown_flatpak_apps(
+    apps_to_install: Dict[str, str],
+    system_wide: bool,
+    remote_name: str,
+    log: logging.Logger,
+    _p_error: Callable[[str], None]
+) -> Dict[str, str]:
+    """Drops (and reports) app ids the remote does not offer, using its listing cached for the run."""
+    try:
+        available = flatpak_index.get_flatpak_index(log).remote_app_ids(remote_name, system_wide)
+    except Exception as e:
+        log.warning(f"Could not list the apps of Flatpak remote '{remote_name}': {e}")
+        available = None
+    if available is None: # Cannot validate; let flatpak report unknown ids itself
+        return dict(apps_to_install)
+    for app_id, app_name in apps_to_install.items():
+        if app_id not in available:
+            log.error(f"Flatpak app '{app_name}' ({app_id}) is not available on remote '{remote_name}'.")
+            if _p_error: _p_error(f"Flatpak app '{app_name}' ({app_id}) is not available on remote '{remote_name}'; check its id in packages.json.")
+    return {app_id: name for app_id, name in apps_to_install.items() if app_id in available}
+
+@exec_trace.traced_helper
 def install_flatpak_apps(
     apps_to_install: Dict[str, str], 
     system_wide: bool = True,
@@ -1081,6 +2023,12 @@ def install_flatpak_apps(
         if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None: _p_info("No Flatpak applications specified for installation.")
         return True
 
+    requested_count = len(apps_to_install)
+    apps_to_install = _skip_installed_flatpak_apps(apps_to_install, system_wide, log, _p_info)
+    if not apps_to_install:
+        log.info("All requested Flatpak applications are already installed.")
+        return True
+
     # Ensure Flathub remote exists before trying to install from it
     if remote_name.lower() == "flathub":
         if not ensure_flathub_remote_exists(print_fn_info=_p_info, print_fn_error=_p_error, logger=log):
@@ -1088,34 +2036,51 @@ def install_flatpak_apps(
             # _p_error already called by ensure_flathub_remote_exists
             return False
 
-    overall_success = True
+    pending_count = len(apps_to_install)
+    apps_to_install = _reject_unknown_flatpak_apps(apps_to_install, system_wide, remote_name, log, _p_error)
+    overall_success = len(apps_to_install) == pending_count
+    if not apps_to_install:
+        log.error(f"None of the {requested_count} requested Flatpak applications can be installed from '{remote_name}'.")
+        return False
     install_type = "system-wide" if system_wide else "user"
     
     app_names_str = ', '.join(f"{name} ({id})" for id, name in apps_to_install.items()) # More descriptive
     log.info(f"Preparing to install Flatpak applications ({install_type}): {app_names_str}")
     if _p_sub and _p_sub is not PRINT_FN_SUB_STEP_DEFAULT and _p_sub is not None: _p_sub(f"Installing Flatpak applications ({install_type}): {app_names_str}")
 
-    for app_id, app_name in apps_to_install.items():
-        log.info(f"Processing Flatpak app '{app_name}' ({app_id})...")
+    # One transaction for every ref: runtimes shared between apps are resolved and downloaded once
+    app_ids = list(apps_to_install)
+    try:
+        run_command(
+            _build_flatpak_install_cmd(app_ids, system_wide, remote_name),
+            capture_output=True,
+            check=True,
+            print_fn_info=_p_info if (_p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None) else None,
+            print_fn_error=_p_error,
+            print_fn_sub_step=_p_sub if (_p_sub and _p_sub is not PRINT_FN_SUB_STEP_DEFAULT and _p_sub is not None) else None,
+            logger=log
+        )
+        retry_ids = []
+    except FileNotFoundError: # Should be caught by ensure_flathub_remote_exists's check
+        log.error("'flatpak' command not found. Is Flatpak installed?", exc_info=True)
+        if _p_error: _p_error("'flatpak' command not found. Is Flatpak installed?")
+        return False
+    except Exception as e:
+        # A single bad ref aborts the whole transaction; only refs that did not get installed are retried
+        installed_now = _installed_flatpak_app_ids(system_wide, log)
+        retry_ids = [app_id for app_id in app_ids if app_id not in installed_now]
+        log.warning(f"Batched Flatpak install failed ({e}); retrying individually: {', '.join(retry_ids) or 'none'}")
 
-        cmd_list = []
-        # Flatpak install --system requires sudo, flatpak install --user does not.
-        # run_command does not add sudo if run_as_user is None.
-        if system_wide: 
-            cmd_list.append("sudo") 
-        
-        cmd_list.extend(["flatpak", "install"])
-        
-        if system_wide: 
-            cmd_list.append("--system")
-        else: 
-            cmd_list.append("--user")
-            # For --user install, we should run as the target_user if one is implied by context (e.g. non-root script run)
-            # This function doesn't take target_user. It assumes system_wide means root, user means current user.
-            # If a phase running as root wants to install a user flatpak, it needs a target_user.
-            # For now, this structure is simpler: sudo for system, no sudo for user (current user).
+    for app_id in app_ids:
+        if app_id not in retry_ids:
+            if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None: _p_info(f"Flatpak app '{apps_to_install[app_id]}' ({app_id}) processed successfully ({install_type}).")
+            log.info(f"Flatpak app '{apps_to_install[app_id]}' ({app_id}) installed/updated successfully ({install_type}).")
+
+    for app_id in retry_ids:
+        app_name = apps_to_install[app_id]
+        log.info(f"Retrying Flatpak app '{app_name}' ({app_id}) on its own...")
 
-        cmd_list.extend(["--noninteractive", "--or-update", remote_name, app_id])
+        cmd_list = _build_flatpak_install_cmd([app_id], system_wide, remote_name)
 
         try:
             run_command(
@@ -1129,10 +2094,6 @@ def install_flatpak_apps(
             )
             if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None: _p_info(f"Flatpak app '{app_name}' ({app_id}) processed successfully ({install_type}).")
             log.info(f"Flatpak app '{app_name}' ({app_id}) installed/updated successfully ({install_type}).")
-        except FileNotFoundError: # Should be caught by ensure_flathub_remote_exists's check
-            log.error("'flatpak' command not found. Is Flatpak installed?", exc_info=True)
-            if _p_error: _p_error("'flatpak' command not found. Is Flatpak installed?")
-            overall_success = False; break 
         except subprocess.CalledProcessError:
             # run_command already logs and calls _p_error
             log.error(f"Failed to install Flatpak app '{app_name}' ({app_id}) ({install_type}).")
@@ -1148,4 +2109,377 @@ def install_flatpak_apps(
         log.error(f"Some Flatpak applications ({install_type}) could not be installed.")
         if _p_error : _p_error(f"Some Flatpak applications ({install_type}) could not be installed. Check logs for details.")
 
-    return overall_success
\ No newline at end of file
+    return overall_success
+
+# --- Async Operations ---
+# Async counterparts of the helpers above. They share command building, logging and
+# CalledProcessError behavior with the sync path, but let independent work (Flatpak
+# installs, downloads, user-level file operations) overlap instead of queuing.
+# Concurrency is bounded by a semaphore so a gather() over many commands cannot
+# fork-bomb the machine.
+
+ASYNC_CONCURRENCY_LIMIT = 4
+
+_async_semaphore: Optional[asyncio.Semaphore] = None
+_async_semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def set_async_concurrency_limit(limit: int) -> None:
+    """Sets how many commands run_command_async may execute at the same time."""
+    global ASYNC_CONCURRENCY_LIMIT, _async_semaphore, _async_semaphore_loop
+    if limit < 1:
+        raise ValueError("Async concurrency limit must be at least 1.")
+    ASYNC_CONCURRENCY_LIMIT = limit
+    _async_semaphore = None # Rebuilt lazily with the new limit
+    _async_semaphore_loop = None
+
+def _get_async_semaphore() -> asyncio.Semaphore:
+    """Returns the concurrency semaphore bound to the running event loop."""
+    global _async_semaphore, _async_semaphore_loop
+    loop = asyncio.get_running_loop()
+    if _async_semaphore is None or _async_semaphore_loop is not loop:
+        _async_semaphore = asyncio.Semaphore(ASYNC_CONCURRENCY_LIMIT)
+        _async_semaphore_loop = loop
+    return _async_semaphore
+
+# asyncio's default 64 KiB line limit is too small for some dnf/flatpak progress lines
+_ASYNC_STREAM_LINE_LIMIT = 1024 * 1024
+
+async def _pump_async_stream(stream: asyncio.StreamReader, handler: Callable[[str], None]) -> None:
+    """Feeds an asyncio stream to a line handler until EOF."""
+    while True:
+        try:
+            raw_line = await stream.readline()
+        except ValueError: # Line longer than the stream limit; take what is buffered and continue
+            raw_line = await stream.read(_ASYNC_STREAM_LINE_LIMIT)
+        if not raw_line:
+            break
+        handler(raw_line.decode(errors="replace"))
+
+async def run_command_async(
+    command: Union[str, List[str]],
+    capture_output: bool = False,
+    check: bool = True,
+    shell: bool = False,
+    run_as_user: Optional[str] = None,
+    cwd: Optional[Union[str, Path]] = None,
+    env_vars: Optional[Dict[str, str]] = None,
+    print_fn_info: Optional[Callable[[str], None]] = None,
+    print_fn_error: Optional[Callable[[str], None]] = None,
+    print_fn_sub_step: Optional[Callable[[str], None]] = None,
+    logger: Optional[logging.Logger] = None,
+    stream_output: bool = False,
+    tail_lines: int = STREAM_TAIL_LINES
+) -> subprocess.CompletedProcess:
+    """Async counterpart of run_command, limited to ASYNC_CONCURRENCY_LIMIT concurrent commands."""
+    log = logger or default_script_logger
+    _p_info = print_fn_info or PRINT_FN_INFO_DEFAULT
+    _p_error = print_fn_error or PRINT_FN_ERROR_DEFAULT
+    _p_sub = print_fn_sub_step or PRINT_FN_SUB_STEP_DEFAULT
+
+    command = install_root.adapt_command(command)
+    command_to_execute, effective_shell, display_command_str, current_env = _prepare_command(
+        command, shell, run_as_user, env_vars, log, _p_error
+    )
+
+    async with _get_async_semaphore():
+        log.info(f"Executing: {display_command_str}")
+        _p_info(f"Executing: {display_command_str}")
+
+        timer = exec_trace.command_timer()
+        process = None
+        try:
+            route = _worker_route(command, shell, run_as_user)
+            if route:
+                try:
+                    process, rusage = await asyncio.to_thread(
+                        _run_via_worker, route[0], route[1], command_to_execute, cwd, env_vars,
+                        capture_output, stream_output, tail_lines, display_command_str, log, _p_sub
+                    )
+                    exec_trace.record_command(timer, display_command_str, process.returncode, rusage, "worker")
+                    command_cache.query_cache.note_executed(command, shell)
+                    _check_command_result(process, command_to_execute, display_command_str, capture_output, check, log, _p_sub, streamed=stream_output)
+                    return process
+                except privileged_worker.WorkerUnavailableError as e_worker:
+                    log.warning(f"{e_worker} Spawning '{display_command_str}' directly.")
+
+            pipe = asyncio.subprocess.PIPE if (capture_output or stream_output) else None
+            spawn_kwargs = {"stdout": pipe, "stderr": pipe, "cwd": str(cwd) if cwd else None, "env": current_env}
+            if stream_output:
+                spawn_kwargs["limit"] = _ASYNC_STREAM_LINE_LIMIT
+            if effective_shell:
+                proc = await asyncio.create_subprocess_shell(command_to_execute, **spawn_kwargs)
+            else:
+                # A plain string without shell=True is a single program path, as with subprocess.run
+                argv = [command_to_execute] if isinstance(command_to_execute, str) else [str(part) for part in command_to_execute]
+                proc = await asyncio.create_subprocess_exec(*argv, **spawn_kwargs)
+
+            if stream_output:
+                stdout_tail: Deque[str] = deque(maxlen=tail_lines)
+                stderr_tail: Deque[str] = deque(maxlen=tail_lines)
+                await asyncio.gather(
+                    _pump_async_stream(proc.stdout, _make_stream_line_handler(display_command_str, "STDOUT", stdout_tail, log, _p_sub)),
+                    _pump_async_stream(proc.stderr, _make_stream_line_handler(display_command_str, "STDERR", stderr_tail, log, _p_sub)),
+                )
+                await proc.wait()
+                stdout_text, stderr_text = "".join(stdout_tail), "".join(stderr_tail)
+            else:
+                stdout_bytes, stderr_bytes = await proc.communicate()
+                stdout_text = stdout_bytes.decode(errors="replace") if stdout_bytes is not None else None
+                stderr_text = stderr_bytes.decode(errors="replace") if stderr_bytes is not None else None
+
+            process = subprocess.CompletedProcess(
+                args=command_to_execute,
+                returncode=proc.returncode,
+                stdout=stdout_text,
+                stderr=stderr_text
+            )
+            # asyncio reaps the child itself, so no wait4 resource usage on this path
+            exec_trace.record_command(timer, display_command_str, process.returncode, None, "async")
+            command_cache.query_cache.note_executed(command, shell)
+            _check_command_result(process, command_to_execute, display_command_str, capture_output, check, log, _p_sub, streamed=stream_output)
+            return process
+
+        except Exception as e:
+            if process is None:
+                exec_trace.record_command(timer, display_command_str, None, None, "async")
+            _report_command_exception(e, command_to_execute, display_command_str, log, _p_error)
+            raise
+
+@exec_trace.traced_helper
+async def install_dnf_packages_async(
+    packages: List[str],
+    allow_erasing: bool = False,
+    capture_output: bool = True,
+    stream_output: bool = True,
+    print_fn_info: Optional[Callable[[str], None]] = None,
+    print_fn_error: Optional[Callable[[str], None]] = None,
+    print_fn_sub_step: Optional[Callable[[str], None]] = None,
+    logger: Optional[logging.Logger] = None,
+    extra_args: Optional[List[str]] = None,
+    skip_installed: bool = True
+) -> bool:
+    """Async counterpart of install_dnf_packages. DNF holds the RPM lock, so this overlaps with non-DNF work only."""
+    log = logger or default_script_logger
+    _p_info = print_fn_info or (lambda msg: None)
+    _p_error = print_fn_error or PRINT_FN_ERROR_DEFAULT
+    _p_sub = print_fn_sub_step or (lambda msg: None)
+
+    if not packages:
+        log.info("No DNF packages specified for installation.")
+        if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None: _p_info("No DNF packages specified for installation.")
+        return True
+
+    if skip_installed:
+        packages, already_installed = await asyncio.to_thread(filter_installed_packages, packages, log)
+        _report_skipped_packages(already_installed, log, _p_info)
+        if not packages:
+            log.info("All requested DNF packages are already installed; not running dnf.")
+            if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None: _p_info("All requested DNF packages are already installed.")
+            return True
+
+    await asyncio.to_thread(ensure_dnf_metadata, log)
+    cmd = _build_dnf_install_cmd(packages, allow_erasing, extra_args)
+    action_verb = "Installing (allowing erasing)" if allow_erasing else "Installing"
+    packages_str = ', '.join(packages)
+    log.info(f"{action_verb} DNF packages: {packages_str}")
+    if _p_sub and _p_sub is not PRINT_FN_SUB_STEP_DEFAULT and _p_sub is not None: _p_sub(f"{action_verb} DNF packages: {packages_str}")
+
+    try:
+        with package_index.get_installed_package_index(log).transaction(None if allow_erasing else packages):
+            await run_command_async(
+                cmd, capture_output=capture_output, check=True, stream_output=stream_output,
+                print_fn_info=_p_info if (_p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None) else None,
+                print_fn_error=_p_error,
+                print_fn_sub_step=_p_sub if (_p_sub and _p_sub is not PRINT_FN_SUB_STEP_DEFAULT and _p_sub is not None) else None,
+                logger=log
+            )
+        if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None: _p_info(f"DNF packages installed: {packages_str}")
+        log.info(f"DNF packages installed: {packages_str}")
+        return True
+    except Exception as e: # run_command_async raises CalledProcessError on failure
+        log.error(f"Failed to process DNF packages: {packages_str}. Error: {e}", exc_info=True)
+        return False
+
+@exec_trace.traced_helper
+async def install_flatpak_apps_async(
+    apps_to_install: Dict[str, str],
+    system_wide: bool = True,
+    remote_name: str = "flathub",
+    print_fn_info: Optional[Callable[[str], None]] = None,
+    print_fn_error: Optional[Callable[[str], None]] = None,
+    print_fn_sub_step: Optional[Callable[[str], None]] = None,
+    logger: Optional[logging.Logger] = None
+) -> bool:
+    """Async counterpart of install_flatpak_apps. Refs that fail the batched install are retried concurrently, bounded by the concurrency limit."""
+    log = logger or default_script_logger
+    _p_info = print_fn_info or (lambda msg: None)
+    _p_error = print_fn_error or PRINT_FN_ERROR_DEFAULT
+    _p_sub = print_fn_sub_step or (lambda msg: None)
+
+    if not apps_to_install:
+        log.info("No Flatpak applications specified for installation.")
+        if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None: _p_info("No Flatpak applications specified for installation.")
+        return True
+
+    apps_to_install = await asyncio.to_thread(_skip_installed_flatpak_apps, apps_to_install, system_wide, log, _p_info)
+    if not apps_to_install:
+        log.info("All requested Flatpak applications are already installed.")
+        return True
+
+    if remote_name.lower() == "flathub":
+        flathub_ok = await asyncio.to_thread(
+            ensure_flathub_remote_exists, print_fn_info=_p_info, print_fn_error=_p_error, logger=log
+        )
+        if not flathub_ok:
+            log.error("Flathub remote setup failed. Cannot install Flatpak apps from Flathub.")
+            return False
+
+    pending_count = len(apps_to_install)
+    apps_to_install = await asyncio.to_thread(_reject_unknown_flatpak_apps, apps_to_install, system_wide, remote_name, log, _p_error)
+    all_known = len(apps_to_install) == pending_count
+    if not apps_to_install:
+        return False
+
+    install_type = "system-wide" if system_wide else "user"
+    app_names_str = ', '.join(f"{name} ({id})" for id, name in apps_to_install.items())
+    log.info(f"Preparing to install Flatpak applications concurrently ({install_type}): {app_names_str}")
+    if _p_sub and _p_sub is not PRINT_FN_SUB_STEP_DEFAULT and _p_sub is not None: _p_sub(f"Installing Flatpak applications ({install_type}): {app_names_str}")
+
+    # One transaction for every ref (shared runtimes are fetched once); failed refs are then retried concurrently
+    app_ids = list(apps_to_install)
+    try:
+        await run_command_async(
+            _build_flatpak_install_cmd(app_ids, system_wide, remote_name),
+            capture_output=True,
+            check=True,
+            print_fn_info=_p_info if (_p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None) else None,
+            print_fn_error=_p_error,
+            print_fn_sub_step=_p_sub if (_p_sub and _p_sub is not PRINT_FN_SUB_STEP_DEFAULT and _p_sub is not None) else None,
+            logger=log
+        )
+        retry_ids = []
+    except FileNotFoundError: # Already reported by run_command_async
+        return False
+    except Exception as e:
+        installed_now = await asyncio.to_thread(_installed_flatpak_app_ids, system_wide, log)
+        retry_ids = [app_id for app_id in app_ids if app_id not in installed_now]
+        log.warning(f"Batched Flatpak install failed ({e}); retrying individually: {', '.join(retry_ids) or 'none'}")
+
+    for app_id in app_ids:
+        if app_id not in retry_ids:
+            if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None: _p_info(f"Flatpak app '{apps_to_install[app_id]}' ({app_id}) processed successfully ({install_type}).")
+            log.info(f"Flatpak app '{apps_to_install[app_id]}' ({app_id}) installed/updated successfully ({install_type}).")
+
+    async def _install_one(app_id: str, app_name: str) -> bool:
+        log.info(f"Retrying Flatpak app '{app_name}' ({app_id}) on its own...")
+        try:
+            await run_command_async(
+                _build_flatpak_install_cmd([app_id], system_wide, remote_name),
+                capture_output=True,
+                check=True,
+                print_fn_info=_p_info if (_p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None) else None,
+                print_fn_error=_p_error,
+                print_fn_sub_step=_p_sub if (_p_sub and _p_sub is not PRINT_FN_SUB_STEP_DEFAULT and _p_sub is not None) else None,
+                logger=log
+            )
+            if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None: _p_info(f"Flatpak app '{app_name}' ({app_id}) processed successfully ({install_type}).")
+            log.info(f"Flatpak app '{app_name}' ({app_id}) installed/updated successfully ({install_type}).")
+            return True
+        except subprocess.CalledProcessError:
+            log.error(f"Failed to install Flatpak app '{app_name}' ({app_id}) ({install_type}).")
+            return False
+        except Exception as e: # Includes FileNotFoundError, already reported by run_command_async
+            log.error(f"An unexpected error occurred while installing Flatpak app '{app_name}' ({app_id}) ({install_type}): {e}", exc_info=True)
+            return False
+
+    results = await asyncio.gather(*(_install_one(app_id, apps_to_install[app_id]) for app_id in retry_ids))
+    overall_success = all_known and all(results)
+
+    if overall_success:
+        log.info(f"All specified Flatpak applications processed successfully ({install_type}).")
+    else:
+        log.error(f"Some Flatpak applications ({install_type}) could not be installed.")
+        if _p_error : _p_error(f"Some Flatpak applications ({install_type}) could not be installed. Check logs for details.")
+    return overall_success
+
+@exec_trace.traced_helper
+async def install_pip_packages_async(
+    packages: List[str],
+    user_only: bool = False,
+    target_user: Optional[str] = None, # Must be provided if user_only is True
+    upgrade: bool = True,
+    capture_output: bool = True,
+    print_fn_info: Optional[Callable[[str], None]] = None,
+    print_fn_error: Optional[Callable[[str], None]] = None,
+    print_fn_sub_step: Optional[Callable[[str], None]] = None,
+    logger: Optional[logging.Logger] = None,
+    constraints_file: Optional[Path] = None,
+    wheelhouse: Optional[Path] = None
+) -> bool:
+    """
+    Async counterpart of install_pip_packages.
+    The single pip run for the target overlaps with other async work.
+    """
+    # The wheelhouse/online fallback chain is sequential by nature; run it off the event loop
+    return await asyncio.to_thread(
+        install_pip_packages, packages, user_only, target_user, upgrade, capture_output,
+        print_fn_info, print_fn_error, print_fn_sub_step, logger, constraints_file, wheelhouse
+    )
+
+@exec_trace.traced_helper
+async def ensure_dir_exists_async(
+    dir_path: Path,
+    target_user: Optional[str] = None,
+    mode: Optional[str] = None, # e.g., "0755"
+    logger: Optional[logging.Logger] = None,
+    print_fn_info: Optional[Callable[[str], None]] = None,
+    print_fn_error: Optional[Callable[[str], None]] = None,
+    print_fn_success: Optional[Callable[[str], None]] = None
+) -> bool:
+    """Async counterpart of ensure_dir_exists."""
+    log = logger or default_script_logger
+    _p_info = print_fn_info or (lambda msg: None)
+    _p_error = print_fn_error or PRINT_FN_ERROR_DEFAULT
+    _p_success = print_fn_success or (lambda msg: None)
+
+    log.info(f"Ensuring directory exists: {dir_path} (User: {target_user or 'current/root'}, Mode: {mode or 'default'})")
+
+    try:
+        proc = await run_command_async(
+            f"test -d {shlex.quote(str(dir_path))}",
+            run_as_user=target_user,
+            shell=True,
+            check=False, capture_output=True,
+            print_fn_info=None, logger=log
+        )
+        if proc.returncode == 0:
+            log.info(f"Directory '{dir_path}' already exists.")
+            if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None : _p_info(f"Directory '{dir_path}' already exists.")
+            return True
+    except Exception as e_check:
+        log.warning(f"Could not check existence of directory '{dir_path}' (as user: {target_user}): {e_check}. Will attempt to create.")
+
+    if _p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None : _p_info(f"Directory '{dir_path}' not found. Attempting to create it...")
+
+    mkdir_cmd, chmod_cmd = _build_dir_create_cmds(dir_path, target_user, mode, log)
+
+    try:
+        for cmd in (mkdir_cmd, chmod_cmd):
+            if not cmd:
+                continue
+            await run_command_async(
+                cmd,
+                run_as_user=target_user,
+                shell=bool(target_user),
+                check=True,
+                print_fn_info=_p_info if (_p_info and _p_info is not PRINT_FN_INFO_DEFAULT and _p_info is not None) else None,
+                print_fn_error=_p_error,
+                logger=log
+            )
+        log.info(f"Successfully created/verified directory: {dir_path}")
+        if _p_success and _p_success is not PRINT_FN_SUCCESS_DEFAULT and _p_success is not None : _p_success(f"Successfully ensured directory exists: {dir_path}")
+        return True
+    except Exception as e:
+        log.error(f"Failed to create directory {dir_path} (User: {target_user}, Mode: {mode}): {e}", exc_info=True)
+        if _p_error : _p_error(f"Failed to create directory {dir_path}: {e}")
+        return False
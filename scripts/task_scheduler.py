@@ -0,0 +1,156 @@
+# Fedora-AutoEnv-Setup/scripts/task_scheduler.py
+
+# Lock-aware scheduler for the steps of one phase (and for whole phases in "run all"). Each step declares the resource classes it
+# uses; steps whose resources do not conflict run concurrently on a small thread pool, so a
+# phase takes roughly as long as its longest chain of conflicting steps instead of the sum of all
+# of them. Resource classes and how many steps may hold each at the same time:
+#   rpm             1   dnf/rpm transactions (the rpm database lock)
+#   flatpak_system  1   the system Flatpak installation
+#   network         3   downloads (dnf and flatpak fetch their payloads too)
+#   cpu             #   CPU-bound work (archive extraction, cache rebuilds), one per core
+#   user_home       1   file operations in the target user's home
+# Steps can also depend on other steps ("after"). A failed step skips its dependents; a failed
+# critical step also cancels every step that has not started yet. Each step runs in a copy of the
+# caller's context, so trace spans and other context variables carry over to the worker threads.
+
+import contextvars
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional
+
+from scripts import exec_trace
+
+RESOURCE_RPM = "rpm"
+RESOURCE_FLATPAK_SYSTEM = "flatpak_system"
+RESOURCE_NETWORK = "network"
+RESOURCE_CPU = "cpu"
+RESOURCE_USER_HOME = "user_home"
+
+RESOURCE_CAPACITY: Dict[str, int] = {
+    RESOURCE_RPM: 1,
+    RESOURCE_FLATPAK_SYSTEM: 1,
+    RESOURCE_NETWORK: 3,
+    RESOURCE_CPU: os.cpu_count() or 1,
+    RESOURCE_USER_HOME: 1,
+}
+
+DEFAULT_MAX_WORKERS = 4
+
+_module_logger = logging.getLogger(__name__)
+
+
+class PhaseTask:
+    """One step of a phase: a callable returning True on success, with its resources and dependencies."""
+
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[[], bool],
+        resources: Iterable[str] = (),
+        after: Iterable[str] = (),
+        critical: bool = False
+    ):
+        unknown = set(resources) - set(RESOURCE_CAPACITY)
+        if unknown:
+            raise ValueError(f"Task '{name}' uses unknown resource classes: {', '.join(sorted(unknown))}")
+        self.name = name
+        self.fn = fn
+        self.resources = frozenset(resources)
+        self.after = tuple(after)
+        self.critical = critical
+
+
+class TaskResult:
+    """Outcome of one task: 'ok', 'failed' or 'skipped' (dependency failed, or cancelled)."""
+
+    def __init__(self, name: str, status: str, duration: float = 0.0, error: Optional[BaseException] = None):
+        self.name = name
+        self.status = status
+        self.duration = duration
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.status == "ok"
+
+
+def _run_task(task: PhaseTask, log: logging.Logger) -> TaskResult:
+    start = time.monotonic()
+    try:
+        with exec_trace.trace_span(task.name, "task", resources=",".join(sorted(task.resources))):
+            ok = bool(task.fn())
+        return TaskResult(task.name, "ok" if ok else "failed", time.monotonic() - start)
+    except Exception as e:
+        log.error(f"Task '{task.name}' raised: {e}", exc_info=True)
+        return TaskResult(task.name, "failed", time.monotonic() - start, e)
+
+def run_tasks(
+    tasks: List[PhaseTask],
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    logger: Optional[logging.Logger] = None
+) -> Dict[str, TaskResult]:
+    """
+    Runs tasks as their dependencies and resources allow and returns every task's result.
+    Among the tasks ready at the same time, the earlier-declared one starts first.
+    """
+    log = logger or _module_logger
+    by_name = {task.name: task for task in tasks}
+    if len(by_name) != len(tasks):
+        raise ValueError("Task names must be unique.")
+    for task in tasks:
+        missing = [dep for dep in task.after if dep not in by_name]
+        if missing:
+            raise ValueError(f"Task '{task.name}' depends on unknown tasks: {', '.join(missing)}")
+
+    results: Dict[str, TaskResult] = {}
+    pending: List[PhaseTask] = list(tasks)
+    in_use: Dict[str, int] = {resource: 0 for resource in RESOURCE_CAPACITY}
+    running: Dict[Future, PhaseTask] = {}
+    cancelled = False
+
+    def fits(task: PhaseTask) -> bool:
+        return all(in_use[resource] < RESOURCE_CAPACITY[resource] for resource in task.resources)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="phase-task") as pool:
+        while pending or running:
+            # Settle tasks that can never run: a dependency failed/was skipped, or a critical task failed
+            for task in list(pending):
+                failed_deps = [dep for dep in task.after if dep in results and not results[dep].ok]
+                if cancelled or failed_deps:
+                    reason = "a critical task failed" if cancelled else f"{', '.join(failed_deps)} did not succeed"
+                    log.warning(f"Skipping task '{task.name}': {reason}.")
+                    results[task.name] = TaskResult(task.name, "skipped")
+                    pending.remove(task)
+
+            for task in list(pending):
+                if len(running) >= max_workers:
+                    break
+                if all(results.get(dep) is not None for dep in task.after) and fits(task):
+                    for resource in task.resources:
+                        in_use[resource] += 1
+                    log.debug(f"Starting task '{task.name}' (resources: {', '.join(sorted(task.resources)) or 'none'}).")
+                    running[pool.submit(contextvars.copy_context().run, _run_task, task, log)] = task
+                    pending.remove(task)
+
+            if not running:
+                if pending: # Only possible with a dependency cycle
+                    raise ValueError(f"Tasks can never start (dependency cycle?): {', '.join(task.name for task in pending)}")
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                for resource in task.resources:
+                    in_use[resource] -= 1
+                result = future.result()
+                results[task.name] = result
+                log.info(f"Task '{task.name}' {result.status} after {result.duration:.1f}s.")
+                if task.critical and not result.ok:
+                    cancelled = True
+
+    return {task.name: results[task.name] for task in tasks}
+
+def all_critical_ok(tasks: List[PhaseTask], results: Dict[str, TaskResult]) -> bool:
+    return all(results[task.name].ok for task in tasks if task.critical)
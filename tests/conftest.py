@@ -0,0 +1,53 @@
+# Fedora-AutoEnv-Setup/tests/conftest.py
+
+import os
+import stat
+import sys
+from pathlib import Path
+
+import pytest
+
+# Same import root as install.py: the modules are imported as scripts.<name>
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+
+@pytest.fixture
+def stub_bin(tmp_path, monkeypatch):
+    """
+    Returns a function that installs a shell script as a command on PATH, e.g.
+    stub_bin("rpm", 'echo "$@" >> "$STUB_LOG"'). Every stub appends its argv to $STUB_LOG.
+    """
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    log_path = tmp_path / "stub_calls.log"
+    log_path.touch()
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}")
+    monkeypatch.setenv("STUB_LOG", str(log_path))
+
+    def _install(name: str, body: str) -> Path:
+        script = bin_dir / name
+        script.write_text(f'#!/bin/sh\necho "{name} $*" >> "$STUB_LOG"\n{body}\n', encoding="utf-8")
+        script.chmod(script.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+        return script
+
+    _install.log_path = log_path
+    return _install
+
+
+@pytest.fixture
+def clean_run_state():
+    """Resets the per-run caches of system_utils (query cache, dnf metadata refresh, dnf global options)."""
+    from scripts import command_cache
+    from scripts import system_utils as util
+
+    def _reset():
+        command_cache.query_cache.clear()
+        util.invalidate_dnf_metadata()
+        util.set_dnf_global_args([])
+
+    _reset()
+    yield
+    _reset()
@@ -0,0 +1,89 @@
+# Fedora-AutoEnv-Setup/tests/fixtures/make_rpmdb_fixture.py
+
+# Regenerates rpmdb.sqlite: a few packages in the layout rpm 4.16+ writes on Fedora, i.e. a
+# Packages(hnum, blob) table of header blobs plus the Name index table. The headers carry the
+# immutable region tag and tags the reader skips, like real ones do. Run from the repository root:
+#
+#   python tests/fixtures/make_rpmdb_fixture.py
+
+import sqlite3
+import struct
+from pathlib import Path
+
+FIXTURE_PATH = Path(__file__).with_name("rpmdb.sqlite")
+
+_BIN, _INT32, _STRING, _STRING_ARRAY, _I18NSTRING = 7, 4, 6, 8, 9
+
+# (name, epoch, version, release, arch, provides); epoch None means no Epoch tag, arch None no Arch tag
+PACKAGES = [
+    ("bash", None, "5.2.26", "3.fc40", "x86_64", ["/bin/bash", "/bin/sh", "bash", "bash(x86-64)"]),
+    ("NetworkManager", 1, "1.46.0", "1.fc40", "x86_64", ["NetworkManager", "NetworkManager(x86-64)"]),
+    ("kernel-core", None, "6.8.5", "301.fc40", "x86_64", ["kernel-core", "kernel-core-uname-r"]),
+    ("kernel-core", None, "6.8.9", "300.fc40", "x86_64", ["kernel-core", "kernel-core-uname-r"]),
+    ("fedora-logos", None, "40.0.1", "1.fc40", "noarch", ["fedora-logos", "system-logos"]),
+    ("gpg-pubkey", None, "a15b79cc", "63d04c2c", None, ["gpg(Fedora (40) <fedora-40-primary@fedoraproject.org>)"]),
+]
+
+
+def build_header(name, epoch, version, release, arch, provides):
+    """Encodes one header blob: il, dl, the 16-byte index entries, then the data store."""
+    entries = [
+        (1000, _STRING, name),
+        (1001, _STRING, version),
+        (1002, _STRING, release),
+        (1004, _I18NSTRING, f"Summary of {name}"), # Not decoded by the reader
+        (1047, _STRING_ARRAY, provides),
+        (5000, _BIN, b"\x01\x02\x03"), # Unknown binary tag, skipped
+    ]
+    if epoch is not None:
+        entries.append((1003, _INT32, [epoch]))
+    if arch is not None:
+        entries.append((1022, _STRING, arch))
+    entries.sort(key=lambda entry: entry[0])
+
+    data = bytearray()
+    index = []
+    for tag, tag_type, value in entries:
+        if tag_type == _INT32:
+            data.extend(b"\0" * (-len(data) % 4)) # int32 data is 4-byte aligned
+            index.append((tag, tag_type, len(data), len(value)))
+            data.extend(struct.pack(f">{len(value)}i", *value))
+        elif tag_type == _BIN:
+            index.append((tag, tag_type, len(data), len(value)))
+            data.extend(value)
+        elif tag_type == _STRING_ARRAY:
+            index.append((tag, tag_type, len(data), len(value)))
+            for item in value:
+                data.extend(item.encode("utf-8") + b"\0")
+        else:
+            index.append((tag, tag_type, len(data), 1))
+            data.extend(value.encode("utf-8") + b"\0")
+
+    # Region tag (HEADERIMMUTABLE) first, as in every installed header; its trailer sits at the end of the data
+    region_offset = len(data)
+    data.extend(struct.pack(">iiii", 63, _BIN, -16 * (len(index) + 1), 16))
+    index.insert(0, (63, _BIN, region_offset, 16))
+
+    blob = struct.pack(">ii", len(index), len(data))
+    blob += b"".join(struct.pack(">iiii", *entry) for entry in index)
+    return blob + bytes(data)
+
+
+def main() -> None:
+    FIXTURE_PATH.unlink(missing_ok=True)
+    conn = sqlite3.connect(FIXTURE_PATH)
+    with conn:
+        conn.execute("CREATE TABLE 'Packages' (hnum INTEGER PRIMARY KEY AUTOINCREMENT, blob BLOB NOT NULL)")
+        conn.execute("CREATE TABLE 'Name' (key TEXT NOT NULL, hnum INTEGER NOT NULL, idx INTEGER NOT NULL, "
+                     "FOREIGN KEY (hnum) REFERENCES 'Packages'(hnum))")
+        conn.execute("CREATE INDEX 'Name_key_index' ON 'Name' (key)")
+        for package in PACKAGES:
+            hnum = conn.execute("INSERT INTO Packages (blob) VALUES (?)", (build_header(*package),)).lastrowid
+            conn.execute("INSERT INTO Name (key, hnum, idx) VALUES (?, ?, 0)", (package[0], hnum))
+    conn.execute("VACUUM")
+    conn.close()
+    print(f"Wrote {FIXTURE_PATH} ({len(PACKAGES)} packages).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# Fedora-AutoEnv-Setup/tests/test_dnf_config.py
+
+from scripts import dnf_config
+
+FEDORA_DNF_CONF = """\
+# see `man dnf.conf` for defaults and possible options
+
+[main]
+gpgcheck=True
+installonly_limit=3
+max_parallel_downloads=3
+
+[other]
+keepcache=True
+"""
+
+SETTINGS = {"max_parallel_downloads": 10, "fastestmirror": True, "metadata_expire": "6h"}
+
+
+def _write_conf(root, text=FEDORA_DNF_CONF):
+    conf_path = root / dnf_config.DNF_CONF_RELATIVE_PATH
+    conf_path.parent.mkdir(parents=True)
+    conf_path.write_text(text, encoding="utf-8")
+    return conf_path
+
+def _configure(root, printed):
+    return dnf_config.configure_dnf(SETTINGS, target_root=root, print_fn_info=printed.append, print_fn_sub_step=printed.append)
+
+
+def test_configure_dnf_edits_main_section_and_backs_up(tmp_path):
+    conf_path = _write_conf(tmp_path)
+    assert _configure(tmp_path, [])
+    assert conf_path.read_text(encoding="utf-8") == """\
+# see `man dnf.conf` for defaults and possible options
+
+[main]
+gpgcheck=True
+installonly_limit=3
+max_parallel_downloads=10
+fastestmirror=True
+metadata_expire=6h
+
+[other]
+keepcache=True
+"""
+    backups = list(conf_path.parent.glob("dnf.conf.backup_dnfconf_*"))
+    assert len(backups) == 1 and backups[0].read_text(encoding="utf-8") == FEDORA_DNF_CONF
+
+def test_configure_dnf_shows_a_unified_diff(tmp_path):
+    _write_conf(tmp_path)
+    printed = []
+    assert _configure(tmp_path, printed)
+    assert "-max_parallel_downloads=3" in printed
+    assert "+max_parallel_downloads=10" in printed
+    assert "+fastestmirror=True" in printed
+    assert "+metadata_expire=6h" in printed
+    assert not any(line.startswith(("-", "+")) and "keepcache" in line for line in printed) # [other] is untouched
+
+def test_configure_dnf_second_run_is_a_no_op(tmp_path):
+    conf_path = _write_conf(tmp_path)
+    assert _configure(tmp_path, [])
+    configured = conf_path.read_text(encoding="utf-8")
+    backups = set(conf_path.parent.glob("dnf.conf.backup_*"))
+
+    printed = []
+    assert _configure(tmp_path, printed)
+    assert conf_path.read_text(encoding="utf-8") == configured
+    assert set(conf_path.parent.glob("dnf.conf.backup_*")) == backups
+    assert not any(line.startswith(("-", "+")) for line in printed)
+    assert any("already has the requested DNF settings" in line for line in printed)
+
+def test_configure_dnf_creates_missing_conf(tmp_path):
+    assert _configure(tmp_path, [])
+    text = (tmp_path / dnf_config.DNF_CONF_RELATIVE_PATH).read_text(encoding="utf-8")
+    assert text.startswith("[main]\nmax_parallel_downloads=10\n")
+
+def test_invalid_settings_are_dropped():
+    options = dnf_config.normalize_settings({"max_parallel_downloads": 50, "fastestmirror": "yes", "zchunk": False, "bogus": 1}, dnf_config.app_logger)
+    assert options == {"zchunk": "False"}
@@ -0,0 +1,131 @@
+# Fedora-AutoEnv-Setup/tests/test_install_root.py
+
+import threading
+
+import pytest
+
+from scripts import command_cache
+from scripts import install_root
+from scripts import package_index
+from scripts import system_utils as util
+
+# Stub tools: each logs its argv (conftest.stub_bin). flatpak keeps its remotes in
+# $FLATPAK_SYSTEM_DIR/remotes, so a query shows which installation a command really targeted.
+SUDO_STUB = 'exec "$@"'
+FLATPAK_STUB = """\
+mkdir -p "$FLATPAK_SYSTEM_DIR"
+case "$1" in
+    remotes) cat "$FLATPAK_SYSTEM_DIR/remotes" 2>/dev/null ;;
+    remote-add) shift; for arg in "$@"; do case "$arg" in -*) ;; *) echo "$arg" >> "$FLATPAK_SYSTEM_DIR/remotes"; break ;; esac; done ;;
+esac
+exit 0
+"""
+DNF_STUB = "exit 0"
+RPM_STUB = """\
+for arg in "$@"; do
+    case "$arg" in
+        --root=*) printf 'bash\\t0\\t5.2.26\\t3.fc40\\tx86_64\\tbash /bin/sh \\n' ;;
+    esac
+done
+exit 0
+"""
+
+
+@pytest.fixture
+def root(tmp_path):
+    """An install root with an os-release of its own."""
+    root_dir = tmp_path / "root1"
+    (root_dir / "etc").mkdir(parents=True)
+    (root_dir / "etc" / "os-release").write_text('NAME="Fedora Linux"\nVERSION_ID=41\n', encoding="utf-8")
+    return root_dir
+
+def _flatpak_remotes():
+    proc = util.run_command(["flatpak", "remotes"], capture_output=True, check=True, read_only=True)
+    return proc.stdout.split()
+
+
+def test_adapt_command_outside_a_root_is_unchanged():
+    assert install_root.adapt_command(["sudo", "dnf", "install", "-y", "git"]) == ["sudo", "dnf", "install", "-y", "git"]
+
+def test_adapt_command_points_flatpak_behind_sudo_into_the_root(root):
+    with install_root.targeting(root):
+        argv = install_root.adapt_command(["sudo", "flatpak", "remote-add", "flathub", "https://example.invalid/flathub"])
+    assert argv[:3] == ["sudo", "env", f"FLATPAK_SYSTEM_DIR={root / 'var/lib/flatpak'}"]
+    assert command_cache.invalidated_families(argv) == {"flatpak"}
+
+def test_cached_flatpak_query_in_root_is_dropped_by_remote_add(root, stub_bin, clean_run_state):
+    stub_bin("sudo", SUDO_STUB)
+    stub_bin("flatpak", FLATPAK_STUB)
+    with install_root.targeting(root):
+        assert _flatpak_remotes() == []
+        assert _flatpak_remotes() == [] # Served from the query cache
+        util.run_command(["sudo", "flatpak", "remote-add", "--if-not-exists", "flathub", "https://example.invalid/flathub"])
+        assert _flatpak_remotes() == ["flathub"]
+    assert (root / "var/lib/flatpak/remotes").read_text().split() == ["flathub"]
+    assert sum(line == "flatpak remotes" for line in stub_bin.log_path.read_text().splitlines()) == 2
+
+def test_flatpak_queries_of_concurrent_roots_stay_separate(tmp_path, stub_bin, clean_run_state):
+    stub_bin("flatpak", FLATPAK_STUB)
+    roots = [tmp_path / "a", tmp_path / "b"]
+    results = {}
+
+    def _provision(root_dir, remote):
+        with install_root.targeting(root_dir):
+            util.run_command(["flatpak", "remote-add", remote, "https://example.invalid"])
+            results[root_dir] = _flatpak_remotes()
+
+    threads = [threading.Thread(target=_provision, args=(root_dir, f"remote-{root_dir.name}")) for root_dir in roots]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {roots[0]: ["remote-a"], roots[1]: ["remote-b"]}
+
+def test_dnf_in_root_gets_installroot_releasever_and_shared_cache(root, tmp_path, stub_bin, monkeypatch, clean_run_state):
+    stub_bin("sudo", SUDO_STUB)
+    stub_bin("dnf", DNF_STUB)
+    monkeypatch.setattr(install_root, "SHARED_DNF_CACHE_DIR", tmp_path / "dnf-cache")
+    with install_root.targeting(root):
+        util.run_command(["sudo", "dnf", "install", "-y", "git"], capture_output=True)
+    dnf_call = stub_bin.log_path.read_text().splitlines()[-1]
+    assert dnf_call == (
+        f"dnf --installroot={root} --releasever=41 --setopt=cachedir={tmp_path / 'dnf-cache'} "
+        "--setopt=keepcache=True install -y git"
+    )
+
+def test_dnf_install_in_root_drops_cached_rpm_queries(root, stub_bin, clean_run_state):
+    stub_bin("sudo", SUDO_STUB)
+    stub_bin("dnf", DNF_STUB)
+    stub_bin("rpm", RPM_STUB)
+    with install_root.targeting(root):
+        query = lambda: util.run_command(["rpm", "-q", "bash"], capture_output=True, check=False, read_only=True)
+        query()
+        query()
+        util.run_command(["sudo", "dnf", "install", "-y", "bash"], capture_output=True)
+        query()
+    rpm_calls = [line for line in stub_bin.log_path.read_text().splitlines() if line.startswith("rpm ")]
+    assert rpm_calls == [f"rpm --root={root} -q bash"] * 2
+
+def test_package_index_of_unpopulated_root_is_empty(root, stub_bin):
+    stub_bin("rpm", RPM_STUB)
+    index = package_index.InstalledPackageIndex(root=root)
+    index.load()
+    assert not index.is_installed("bash")
+    assert stub_bin.log_path.read_text() == "" # No rpm database in the root yet, nothing to query
+
+def test_package_index_of_root_queries_rpm_with_root(root, stub_bin):
+    stub_bin("rpm", RPM_STUB)
+    (root / "var/lib/rpm").mkdir(parents=True) # dnf created the database directory; no rpmdb.sqlite to read directly
+    index = package_index.InstalledPackageIndex(root=root)
+    index.load()
+    assert index.backend == "rpm"
+    assert index.is_installed("bash")
+    assert stub_bin.log_path.read_text().startswith(f"rpm -qa --root={root} ")
+
+def test_state_files_are_kept_per_root(root, tmp_path):
+    default_path = tmp_path / "install_status.json"
+    assert install_root.state_path(default_path) == default_path
+    with install_root.targeting(root):
+        root_path = install_root.state_path(default_path)
+    assert root_path != default_path and root_path.name == "install_status.json"
+    assert root_path.parent.parent == tmp_path / install_root.STATE_DIR_NAME
@@ -0,0 +1,148 @@
+# Fedora-AutoEnv-Setup/tests/test_local_rpm_repo.py
+
+import shutil
+import subprocess
+
+import pytest
+
+from scripts import local_rpm_repo
+from scripts import system_utils as util
+
+DNF4_GROUP_INFO = """\
+Last metadata expiration check: 0:12:04 ago on Mon 15 Apr 2024 10:00:00 CEST.
+Group: Development Tools
+ Group-Id: development-tools
+ Description: These tools include general development tools such as git and CVS.
+ Mandatory Packages:
+   gettext
+ Default Packages:
+   =git
+   diffstat
+   +patchutils
+ Optional Packages:
+   ElectricFence
+"""
+
+DNF5_GROUP_INFO = """\
+Id                   : development-tools
+Name                 : Development Tools
+Description          : These tools include general development tools such as git and CVS.
+Installed            : no
+Order                : 
+Langonly             : 
+Uservisible          : yes
+Repositories         : fedora
+Mandatory packages   : gettext
+Default packages     : git
+                     : diffstat
+                     : patchutils
+Optional packages    : ElectricFence
+"""
+
+# sudo and dnf stubs for build_local_repo: dnf download writes one dummy RPM per spec into --destdir,
+# dnf group info prints the dnf5 layout, createrepo_c writes repodata/repomd.xml.
+SUDO_STUB = 'exec "$@"'
+DNF_STUB = f"""\
+case "$*" in
+    *"group info"*) cat <<'OUT'
+{DNF5_GROUP_INFO}OUT
+        ;;
+    *download*)
+        for arg in "$@"; do
+            case "$arg" in
+                --destdir=*) destdir="${{arg#--destdir=}}" ;;
+                -*|download) ;;
+                *) touch "$destdir/$arg-1.0-1.fc40.noarch.rpm" ;;
+            esac
+        done
+        ;;
+esac
+exit 0
+"""
+CREATEREPO_STUB = 'for last in "$@"; do :; done\nmkdir -p "$last/repodata" && echo "<repomd/>" > "$last/repodata/repomd.xml"'
+
+
+def test_parse_group_packages_dnf4_layout():
+    assert local_rpm_repo._parse_group_packages(DNF4_GROUP_INFO) == ["gettext", "git", "diffstat", "patchutils"]
+
+def test_parse_group_packages_dnf5_layout():
+    assert local_rpm_repo._parse_group_packages(DNF5_GROUP_INFO) == ["gettext", "git", "diffstat", "patchutils"]
+
+def test_dnf_args_for_local_repo(tmp_path):
+    assert local_rpm_repo.dnf_args_for_local_repo(tmp_path, priority=5, gpgcheck=False) == [
+        f"--repofrompath=autoenv-local,{tmp_path.resolve()}",
+        "--setopt=autoenv-local.priority=5",
+        "--setopt=autoenv-local.gpgcheck=0",
+    ]
+
+def test_dnf_args_for_local_repo_exclusive_disables_other_repos(tmp_path):
+    args = local_rpm_repo.dnf_args_for_local_repo(tmp_path, exclusive=True)
+    assert args[-2:] == ["--disablerepo=*", "--enablerepo=autoenv-local"]
+
+def test_has_repo_metadata(tmp_path):
+    assert not local_rpm_repo.has_repo_metadata(tmp_path)
+    (tmp_path / "repodata").mkdir()
+    (tmp_path / "repodata" / "repomd.xml").write_text("<repomd/>")
+    assert local_rpm_repo.has_repo_metadata(tmp_path)
+
+def test_activate_local_repo_needs_metadata(tmp_path, clean_run_state):
+    app_config = {"local_rpm_repo": {"path": str(tmp_path), "enabled": True}}
+    assert not local_rpm_repo.activate_local_repo(app_config)
+    assert util.build_dnf_cmd(["install"]) == ["sudo", "dnf", "install"]
+
+def test_activate_local_repo_when_disabled(tmp_path, clean_run_state):
+    (tmp_path / "repodata").mkdir()
+    (tmp_path / "repodata" / "repomd.xml").write_text("<repomd/>")
+    assert not local_rpm_repo.activate_local_repo({"local_rpm_repo": {"path": str(tmp_path), "enabled": False}})
+
+def test_build_then_activate_local_repo_with_stubs(tmp_path, stub_bin, clean_run_state):
+    stub_bin("sudo", SUDO_STUB)
+    stub_bin("dnf", DNF_STUB)
+    stub_bin("createrepo_c", CREATEREPO_STUB)
+    repo_dir = tmp_path / "repo"
+    app_config = {
+        "phase1_system_preparation": {"dnf_packages": ["git", "htop"]},
+        "phase2_basic_configuration": {"dnf_groups_dev": ["development-tools"]},
+    }
+
+    assert local_rpm_repo.build_local_repo(app_config, ["system_preparation", "basic_installation"], repo_dir)
+    assert sorted(path.name for path in repo_dir.glob("*.rpm")) == [
+        f"{name}-1.0-1.fc40.noarch.rpm" for name in ["diffstat", "gettext", "git", "htop", "patchutils"]
+    ]
+    calls = stub_bin.log_path.read_text().splitlines()
+    download = next(line for line in calls if line.startswith("dnf ") and " download " in line)
+    assert "--resolve --alldeps" in download and "@" not in download
+    assert any(line.startswith("createrepo_c --quiet ") and "--update" not in line for line in calls)
+
+    # A second build only updates the existing metadata
+    assert local_rpm_repo.build_local_repo(app_config, ["system_preparation"], repo_dir)
+    assert stub_bin.log_path.read_text().splitlines()[-1].startswith("createrepo_c --quiet --update")
+
+    app_config["local_rpm_repo"] = {"path": str(repo_dir), "enabled": True, "exclusive": True, "gpgcheck": False}
+    assert local_rpm_repo.activate_local_repo(app_config)
+    cmd = util.build_dnf_cmd(["install", "-y", "git"])
+    assert cmd[:3] == ["sudo", "dnf", f"--repofrompath=autoenv-local,{repo_dir.resolve()}"]
+    assert "--disablerepo=*" in cmd and "--setopt=autoenv-local.gpgcheck=0" in cmd
+
+def test_build_local_repo_needs_createrepo_c(tmp_path, monkeypatch, clean_run_state):
+    monkeypatch.setenv("PATH", str(tmp_path)) # Nothing on PATH
+    errors = []
+    assert not local_rpm_repo.build_local_repo({}, [], tmp_path / "repo", print_fn_error=errors.append)
+    assert "createrepo_c" in errors[0]
+
+@pytest.mark.skipif(not (shutil.which("rpmbuild") and shutil.which("createrepo_c")), reason="needs rpmbuild and createrepo_c")
+def test_createrepo_c_metadata_for_locally_built_rpm(tmp_path):
+    spec = tmp_path / "autoenv-dummy.spec"
+    spec.write_text(
+        "Name: autoenv-dummy\nVersion: 1.0\nRelease: 1\nSummary: Dummy package\nLicense: MIT\nBuildArch: noarch\n"
+        "%description\nDummy package for the local repository tests.\n%files\n"
+    )
+    repo_dir = tmp_path / "repo"
+    subprocess.run(
+        ["rpmbuild", "-bb", f"--define=_topdir {tmp_path / 'rpmbuild'}", f"--define=_rpmdir {repo_dir}",
+         "--define=_build_name_fmt %%{NAME}-%%{VERSION}-%%{RELEASE}.%%{ARCH}.rpm", str(spec)],
+        check=True, capture_output=True
+    )
+    assert (repo_dir / "autoenv-dummy-1.0-1.noarch.rpm").is_file()
+    subprocess.run(["createrepo_c", "--quiet", str(repo_dir)], check=True)
+    assert local_rpm_repo.has_repo_metadata(repo_dir)
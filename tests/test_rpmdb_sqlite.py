@@ -0,0 +1,137 @@
+# Fedora-AutoEnv-Setup/tests/test_rpmdb_sqlite.py
+
+import shutil
+import sqlite3
+import struct
+
+import pytest
+
+from conftest import FIXTURES_DIR
+from scripts import package_index
+from scripts import rpmdb_sqlite
+from scripts.rpmdb_sqlite import RpmdbSchemaError, RpmdbSqliteReader, parse_header_blob
+
+FIXTURE_DB = FIXTURES_DIR / "rpmdb.sqlite"
+
+
+@pytest.fixture
+def fixture_db(tmp_path):
+    """A copy of the fixture database, so sqlite never touches the shipped file."""
+    db_path = tmp_path / "rpmdb.sqlite"
+    shutil.copy(FIXTURE_DB, db_path)
+    return db_path
+
+def _blobs(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return {hnum: bytes(blob) for hnum, blob in conn.execute("SELECT hnum, blob FROM Packages")}
+    finally:
+        conn.close()
+
+
+# --- parse_header_blob ---
+
+def test_parse_header_blob_decodes_name_evr_arch_and_provides(fixture_db):
+    fields = [parse_header_blob(blob) for blob in _blobs(fixture_db).values()]
+    assert fields[0] == ("bash", 0, "5.2.26", "3.fc40", "x86_64", ("/bin/bash", "/bin/sh", "bash", "bash(x86-64)"))
+
+def test_parse_header_blob_reads_the_epoch_tag(fixture_db):
+    by_name = {fields[0]: fields for fields in map(parse_header_blob, _blobs(fixture_db).values())}
+    assert by_name["NetworkManager"][1] == 1
+
+def test_parse_header_blob_without_arch_tag_reports_none(fixture_db):
+    by_name = {fields[0]: fields for fields in map(parse_header_blob, _blobs(fixture_db).values())}
+    assert by_name["gpg-pubkey"][4] == "(none)"
+
+def test_parse_header_blob_rejects_short_blob():
+    with pytest.raises(RpmdbSchemaError):
+        parse_header_blob(b"\x00\x00\x00")
+
+def test_parse_header_blob_rejects_implausible_sizes():
+    with pytest.raises(RpmdbSchemaError):
+        parse_header_blob(struct.pack(">ii", 3, 1000) + b"\x00" * 16)
+
+def test_parse_header_blob_rejects_offset_outside_data():
+    blob = struct.pack(">ii", 1, 4) + struct.pack(">iiii", rpmdb_sqlite.RPMTAG_NAME, 6, 64, 1) + b"abc\x00"
+    with pytest.raises(RpmdbSchemaError):
+        parse_header_blob(blob)
+
+def test_parse_header_blob_rejects_unterminated_string():
+    blob = struct.pack(">ii", 1, 3) + struct.pack(">iiii", rpmdb_sqlite.RPMTAG_NAME, 6, 0, 1) + b"abc"
+    with pytest.raises(RpmdbSchemaError):
+        parse_header_blob(blob)
+
+def test_parse_header_blob_rejects_unexpected_tag_type():
+    blob = struct.pack(">ii", 1, 4) + struct.pack(">iiii", rpmdb_sqlite.RPMTAG_NAME, 4, 0, 1) + b"\x00\x00\x00\x01"
+    with pytest.raises(RpmdbSchemaError):
+        parse_header_blob(blob)
+
+
+# --- RpmdbSqliteReader ---
+
+def test_read_all_returns_every_package(fixture_db):
+    rows = RpmdbSqliteReader(fixture_db).read_all()
+    assert len(rows) == 6
+    assert sorted({row[0] for row in rows}) == ["NetworkManager", "bash", "fedora-logos", "gpg-pubkey", "kernel-core"]
+
+def test_read_names_uses_name_index_and_returns_every_installed_version(fixture_db):
+    rows = RpmdbSqliteReader(fixture_db).read_names(["kernel-core", "bash", "not-installed"])
+    assert sorted((row[0], row[2]) for row in rows) == [("bash", "5.2.26"), ("kernel-core", "6.8.5"), ("kernel-core", "6.8.9")]
+
+def test_read_names_without_name_table_scans_packages(fixture_db):
+    conn = sqlite3.connect(fixture_db)
+    with conn:
+        conn.execute("DROP TABLE Name")
+    conn.close()
+    rows = RpmdbSqliteReader(fixture_db).read_names(["fedora-logos"])
+    assert [row[:3] for row in rows] == [("fedora-logos", 0, "40.0.1")]
+
+def test_read_names_with_no_names_does_not_open_the_database(tmp_path):
+    assert RpmdbSqliteReader(tmp_path / "missing.sqlite").read_names([]) == []
+
+def test_missing_database_raises_file_not_found(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        RpmdbSqliteReader(tmp_path / "missing.sqlite").read_all()
+
+def test_non_sqlite_file_raises_schema_error(tmp_path):
+    db_path = tmp_path / "Packages"
+    db_path.write_bytes(b"\x00\x06\x15\x61" + b"\x00" * 4092) # Berkeley DB hash magic, as in pre-F33 rpmdbs
+    with pytest.raises(RpmdbSchemaError):
+        RpmdbSqliteReader(db_path).read_all()
+
+def test_database_without_packages_table_raises_schema_error(tmp_path):
+    db_path = tmp_path / "rpmdb.sqlite"
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute("CREATE TABLE Other (x INTEGER)")
+    conn.close()
+    with pytest.raises(RpmdbSchemaError):
+        RpmdbSqliteReader(db_path).read_all()
+
+def test_corrupt_blob_raises_schema_error(fixture_db):
+    conn = sqlite3.connect(fixture_db)
+    with conn:
+        conn.execute("UPDATE Packages SET blob = ? WHERE hnum = 1", (b"\xff\xff\xff\xff\x00\x00\x00\x00",))
+    conn.close()
+    with pytest.raises(RpmdbSchemaError):
+        RpmdbSqliteReader(fixture_db).read_all()
+
+
+# --- InstalledPackageIndex over the reader ---
+
+def test_index_loads_from_sqlite(fixture_db):
+    index = package_index.InstalledPackageIndex(db_path=fixture_db)
+    index.load()
+    assert index.backend == "sqlite"
+    assert index.is_installed("bash")
+    assert index.is_installed("NetworkManager-1:1.46.0-1.fc40.x86_64")
+
+def test_index_falls_back_to_rpm_cli_on_schema_error(tmp_path, stub_bin):
+    db_path = tmp_path / "rpmdb.sqlite"
+    db_path.write_bytes(b"not an sqlite database" + b"\x00" * 100)
+    stub_bin("rpm", 'printf "zsh\\t0\\t5.9\\t10.fc40\\tx86_64\\tzsh /bin/zsh \\n"')
+    index = package_index.InstalledPackageIndex(db_path=db_path)
+    index.load()
+    assert index.backend == "rpm"
+    assert index.is_installed("zsh")
+    assert "rpm -qa --queryformat" in stub_bin.log_path.read_text()